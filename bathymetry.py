@@ -0,0 +1,285 @@
+import gzip
+import math
+import os
+
+import numpy as np
+
+import gpxwriter
+import instrumentation
+
+# Gridded bathymetry from the tide-corrected soundings of a log: a raster of depths, and iso-depth
+# contour lines, as an alternative to one waypoint per sounding.
+#
+# Every cell of a regular grid gets the inverse-distance weighted mean (IDW) of the soundings within
+# RADIUS meters of its centre, or the depth of the nearest one. The soundings are spread over the
+# cells around them block by block, so the memory used depends on the size of the grid, not on the
+# number of soundings. Cells without a sounding in range have no data.
+#
+# The raster is an ESRI ASCII grid in WGS84 (with a .prj file), which GIS tools and GDAL read as is,
+# e.g. "gdal_translate depths.asc depths.tif" for a GeoTIFF. Its cells are square in degrees: CELL_SIZE
+# meters north-south, and cos(latitude) times that east-west, e.g. 40% less at 53 degrees north.
+# Depths are in meters below the chart datum, as the waypoints. The contours are GPX routes, one per
+# line, named after their depth; they are traced through the grid by marching squares.
+
+CELL_SIZE = 10          # meters north-south
+RADIUS = 25             # meters; soundings further from a cell centre are not used for it
+POWER = 2               # of the inverse distance weights
+METHODS = ("idw", "nearest")
+CONTOUR_DEPTHS = [1, 2, 3, 5, 10]  # meters
+MAX_GRID_MEMORY = 512 * 1024 * 1024  # bytes; larger grids are refused, choose larger cells
+BYTES_PER_CELL = 48     # at the peak, while contouring: the IDW sums, the depths and the marching squares cases
+SCATTER_BLOCK = 2000000 # (sounding, cell) pairs handled at a time
+NODATA = -9999
+METERS_PER_DEGREE = 60 * 1852
+WGS84 = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+    'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+# Marching squares: the cell sides crossed by the contour, per case. A case has bit 1, 2, 4, 8 set
+# when the corner south-west, south-east, north-east, north-west is deeper than the contour. The
+# sides are 0 south, 1 east, 2 north, 3 west. Saddles (5, 10) depend on the mean of the corners.
+SEGMENTS = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)], 6: [(0, 2)], 7: [(3, 2)], 8: [(2, 3)],
+    9: [(0, 2)], 11: [(1, 2)], 12: [(1, 3)], 13: [(0, 1)], 14: [(3, 0)],
+}
+SADDLES = {
+    5: ([(0, 1), (2, 3)], [(3, 0), (1, 2)]),    # (deeper centre, shallower centre)
+    10: ([(3, 0), (1, 2)], [(0, 1), (2, 3)]),
+}
+
+
+
+class DepthGrid(object):
+
+    # Grid over an area, to which soundings are added block by block
+
+    def __init__(self, south, west, north, east, cellSize=CELL_SIZE, radius=RADIUS, method="idw"):
+        if (method not in METHODS):
+            raise ValueError("unknown method {}; choose from {}".format(method, ", ".join(METHODS)))
+        self.method = method
+        self.radius = float(radius)
+        self.cellDegrees = cellSize / METERS_PER_DEGREE
+        margin = radius / METERS_PER_DEGREE / math.cos(max(abs(south), abs(north)) / 180 * math.pi)
+        self.south = math.floor((south - margin) / self.cellDegrees) * self.cellDegrees
+        self.west = math.floor((west - margin) / self.cellDegrees) * self.cellDegrees
+        self.rows = int(math.ceil((north + margin - self.south) / self.cellDegrees)) + 1
+        self.cols = int(math.ceil((east + margin - self.west) / self.cellDegrees)) + 1
+        if (self.rows * self.cols * BYTES_PER_CELL > MAX_GRID_MEMORY):
+            raise ValueError("a grid of {} by {} cells needs about {} MB; choose larger cells".format(self.cols, self.rows,
+                self.rows * self.cols * BYTES_PER_CELL // (1024 * 1024)))
+        # Meters per cell; east-west at the middle of the area
+        self.cellHeight = self.cellDegrees * METERS_PER_DEGREE
+        self.cellWidth = self.cellHeight * math.cos((self.south + self.rows * self.cellDegrees / 2) / 180 * math.pi)
+        cells = self.rows * self.cols
+        if (method == "idw"):
+            self.weights = np.zeros(cells)
+            self.weighted = np.zeros(cells)
+        else:
+            self.nearest = np.full(cells, np.inf)
+            self.depth = np.full(cells, np.nan)
+        # Cells around a sounding that can lie within the radius, as (row, col) offsets
+        rowReach = int(math.ceil(self.radius / self.cellHeight)) + 1
+        colReach = int(math.ceil(self.radius / self.cellWidth)) + 1
+        dr, dc = np.mgrid[-rowReach:rowReach + 1, -colReach:colReach + 1]
+        self.offsets = list(zip(dr.ravel().tolist(), dc.ravel().tolist()))
+
+
+
+    def add(self, lats, lons, depths):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        depths = np.asarray(depths, dtype=np.float64)
+        block = max(1, SCATTER_BLOCK // len(self.offsets))
+        for start in range(0, len(depths), block):
+            self.scatter(lats[start:start + block], lons[start:start + block], depths[start:start + block])
+
+
+
+    def scatter(self, lats, lons, depths):
+        # Spread a block of soundings over the cells within the radius
+        v = (lats - self.south) / self.cellDegrees
+        u = (lons - self.west) / self.cellDegrees
+        row = np.floor(v).astype(np.int64)
+        col = np.floor(u).astype(np.int64)
+        cells, distances, values = [], [], []
+        for dr, dc in self.offsets:
+            r = row + dr
+            c = col + dc
+            d = np.hypot((c + 0.5 - u) * self.cellWidth, (r + 0.5 - v) * self.cellHeight)
+            inside = (d <= self.radius) & (r >= 0) & (r < self.rows) & (c >= 0) & (c < self.cols)
+            cells.append(r[inside] * self.cols + c[inside])
+            distances.append(d[inside])
+            values.append(depths[inside])
+        cells = np.concatenate(cells)
+        distances = np.concatenate(distances)
+        values = np.concatenate(values)
+        if (self.method == "idw"):
+            w = np.maximum(distances, self.cellHeight / 2) ** -POWER
+            np.add.at(self.weights, cells, w)
+            np.add.at(self.weighted, cells, w * values)
+        else:
+            # The nearest sounding of the block per cell, where it is nearer than those of earlier blocks
+            order = np.lexsort((distances, cells))
+            cells, first = np.unique(cells[order], return_index=True)
+            distances = distances[order][first]
+            values = values[order][first]
+            nearer = distances < self.nearest[cells]
+            self.nearest[cells[nearer]] = distances[nearer]
+            self.depth[cells[nearer]] = values[nearer]
+
+
+
+    def values(self):
+        # Depths as a (rows, cols) array, row 0 in the south; NaN where there is no data
+        if (self.method == "idw"):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                depth = self.weighted / self.weights
+        else:
+            depth = self.depth
+        return depth.reshape(self.rows, self.cols)
+
+
+
+    def position(self, row, col):
+        # (lat, lon) of a point in grid coordinates; cell centres are at whole numbers
+        return self.south + (row + 0.5) * self.cellDegrees, self.west + (col + 0.5) * self.cellDegrees
+
+
+
+def writeAsciiGrid(rasterFileName, grid, depth):
+    # ESRI ASCII grid, north row first, and a .prj file with the coordinate system. A file name
+    # ending in .gz is written gzip-compressed (GDAL reads it as /vsigzip/depths.asc.gz).
+    opener = gzip.open if (rasterFileName.endswith(".gz")) else open
+    with opener(rasterFileName + ".part", "wt") as f:
+        f.write("ncols {}\nnrows {}\nxllcorner {!r}\nyllcorner {!r}\ncellsize {!r}\nNODATA_value {}\n".format(
+            grid.cols, grid.rows, grid.west, grid.south, grid.cellDegrees, NODATA))
+        for row in depth[::-1]:
+            f.write(" ".join("{:.2f}".format(value) if (value == value) else str(NODATA) for value in row.tolist()))
+            f.write("\n")
+    os.replace(rasterFileName + ".part", rasterFileName)
+    with open(os.path.splitext(rasterFileName[:-3] if (opener is gzip.open) else rasterFileName)[0] + ".prj", "w") as f:
+        f.write(WGS84)
+
+
+
+def contourSegments(depth, level):
+    # The contour at level through the grid, as pairs of crossed cell sides. A side is numbered
+    # 2 * (row * cols + col) for the one from (row, col) to the east, plus 1 for the one to the north.
+    rows, cols = depth.shape
+    sw, se, ne, nw = depth[:-1, :-1], depth[:-1, 1:], depth[1:, 1:], depth[1:, :-1]
+    with np.errstate(invalid="ignore"):
+        case = (sw > level) * 1 + (se > level) * 2 + (ne > level) * 4 + (nw > level) * 8
+        deeperCentre = (sw + se + ne + nw) / 4 > level
+    case[np.isnan(sw) | np.isnan(se) | np.isnan(ne) | np.isnan(nw)] = 0
+    segments = []
+    for value in range(1, 15):
+        r, c = np.nonzero(case == value)
+        if (len(r) == 0):
+            continue
+        sides = np.stack((2 * (r * cols + c), 2 * ((r * cols + c + 1)) + 1, 2 * ((r + 1) * cols + c), 2 * (r * cols + c) + 1))
+        if (value in SADDLES):
+            deeper = deeperCentre[r, c]
+            for pairs, where in zip(SADDLES[value], (deeper, ~deeper)):
+                for a, b in pairs:
+                    segments.extend(zip(sides[a][where].tolist(), sides[b][where].tolist()))
+        else:
+            for a, b in SEGMENTS[value]:
+                segments.extend(zip(sides[a].tolist(), sides[b].tolist()))
+    return segments
+
+
+
+def contourLines(depth, level):
+    # Join the segments of a contour into lines of crossed sides; closed lines end where they start
+    segments = contourSegments(depth, level)
+    ends = {}
+    for k, (a, b) in enumerate(segments):
+        ends.setdefault(a, []).append(k)
+        ends.setdefault(b, []).append(k)
+    used = [False] * len(segments)
+    lines = []
+    for k in range(len(segments)):
+        if (used[k]):
+            continue
+        used[k] = True
+        line = list(segments[k])
+        for forward in (True, False):
+            while True:
+                side = line[-1] if (forward) else line[0]
+                nextSegments = [s for s in ends[side] if (not used[s])]
+                if (not nextSegments):
+                    break
+                s = nextSegments[0]
+                used[s] = True
+                a, b = segments[s]
+                other = b if (a == side) else a
+                if (forward):
+                    line.append(other)
+                else:
+                    line.insert(0, other)
+        lines.append(line)
+    return lines
+
+
+
+def sidePosition(depth, side, level):
+    # (row, col) in grid coordinates where the contour crosses a cell side
+    rows, cols = depth.shape
+    cell, north = divmod(side, 2)
+    row, col = divmod(cell, cols)
+    row2, col2 = (row + 1, col) if (north) else (row, col + 1)
+    a, b = depth[row, col], depth[row2, col2]
+    t = (level - a) / (b - a) if (b != a) else 0.5
+    return row + t * (row2 - row), col + t * (col2 - col)
+
+
+
+def writeContours(contourFileName, grid, depth, levels):
+    # The contours as GPX routes; returns the number of routes
+    routes = 0
+    with gpxwriter.GpxWriter(contourFileName, gpxwriter.GPX_HEADER, gpxwriter.LAYER_FOOTER) as writer:
+        for level in levels:
+            for line in contourLines(depth, level):
+                writer.write(gpxwriter.ROUTE_HEADER % "{:g} m".format(level))
+                for side in line:
+                    lat, lon = grid.position(*sidePosition(depth, side, level))
+                    writer.write(gpxwriter.ROUTEPOINT % (lat, lon))
+                writer.write(gpxwriter.ROUTE_FOOTER)
+                routes += 1
+    return routes
+
+
+
+def generateRaster(log, tidalData, rasterFileName, fromTimeStamp, toTimeStamp, cellSize=CELL_SIZE, radius=RADIUS, method="idw",
+        contourFileName=None, contourDepths=CONTOUR_DEPTHS, blockSize=200000):
+    # Grid the tide-corrected soundings of the time window into an ASCII grid, and/or write their
+    # contours at contourDepths; returns the number of cells with data. Without tidalData the depths
+    # are not corrected. A depth of 0 is no sounding, as in the layer.
+    timeStamps, lats, lons, depths = log.soundingColumns(fromTimeStamp, toTimeStamp)
+    keep = depths != 0
+    timeStamps, lats, lons, depths = timeStamps[keep], lats[keep], lons[keep], depths[keep]
+    if (len(depths) == 0):
+        print ("No soundings in the time window; no raster written")
+        return 0
+    grid = DepthGrid(lats.min(), lons.min(), lats.max(), lons.max(), cellSize, radius, method)
+    print ("Gridding {} soundings into {} by {} cells of {} m ({})".format(len(depths), grid.cols, grid.rows, cellSize, method))
+    for start in range(0, len(depths), blockSize):
+        block = slice(start, start + blockSize)
+        blockDepths = depths[block]
+        if (tidalData is not None):
+            blockDepths = blockDepths - tidalData.getWeighedWaterLevels(timeStamps[block], lats[block], lons[block])
+        with instrumentation.stage("grid"):
+            grid.add(lats[block], lons[block], blockDepths)
+    if (tidalData is not None):
+        tidalData.printStatistics()
+    depth = grid.values()
+    cells = int(np.count_nonzero(~np.isnan(depth)))
+    if (rasterFileName is not None):
+        with instrumentation.stage("raster write"):
+            writeAsciiGrid(rasterFileName, grid, depth)
+        print ("OK - Raster {} written with {} of {} cells".format(rasterFileName, cells, depth.size))
+    if (contourFileName is not None):
+        with instrumentation.stage("contours"):
+            routes = writeContours(contourFileName, grid, depth, contourDepths)
+        print ("OK - Contour file {} written with {} routes".format(contourFileName, routes))
+    instrumentation.count("raster cells", cells)
+    return cells
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# Throughput benchmarks on synthetic data, to make regressions visible on logs of any size:
+#
+#     python benchmark.py --size 1000 --days 3 --dir /tmp/bench
+#
+# A VDR log of about --size MB is generated in the work directory (and reused by later runs with
+# the same settings): RMC and DPT sentences from mixed talker IDs, other sentences the tools
+# ignore, now and then a corrupt line, spread over --days days of sailing in the Wadden Sea.
+# Tide CSV files in the waterinfo format are generated for the stations of tidalstations.conf,
+# covering the log. Every stage then runs in a process of its own, so its peak RSS is its own:
+#
+#     load      NmeaLog.load (the loadFile step of process_depth.py)     lines/s
+#     layer     depthwaypoints.generateLayerFile, tide-corrected         soundings/s, waypoints/s
+#     track     depthwaypoints.generateTrackFile                         fixes/s, trackpoints/s
+#     nmea2gpx  nmea2gpx.generateTrackFile, including loading the log    lines/s
+#     tide      reading the tide CSVs, getWeighedWaterLevel(s)           lookups/s
+#     window    NmeaLog.open from the time index, one hour read           MB read, fixes
+#
+# The generated data only depends on the settings and --seed, so runs can be compared.
+
+import argparse
+import calendar
+import csv
+import datetime
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+
+import instrumentation
+import nmeadecoder
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZE = 100      # MB
+DEFAULT_DAYS = 3
+DEFAULT_SEED = 1
+DEFAULT_LOOKUPS = 100000
+STAGES = ["load", "layer", "track", "nmea2gpx", "tide", "window"]
+
+START = datetime.datetime(2023, 2, 27, 6, 0, 0)  # UTC
+AREA = (52.95, 53.45, 4.85, 5.85)  # south, north, west, east: between the tidal stations
+SPEED = 2.5               # m/s
+BYTES_PER_FIX = 105       # about: RMC, DPT and some other sentences
+CORRUPT_EVERY = 5000      # fixes per corrupt line, on average
+TIDE_INTERVAL = 600       # seconds between water levels, as from waterinfo
+TIDE_MARGIN = 86400       # seconds of tide data before and after the log
+TIDE_TIMEZONE = 3600      # waterinfo times are in MET, UTC+1
+FORECAST_FRACTION = 0.1   # last part of a tide file with forecasts only, as in a download
+
+RMC_TALKERS = ["GP", "GN", "II", "IN"]
+DPT_TALKERS = ["SD", "II"]
+OTHER_SENTENCES = [       # ignored by the tools, but parsed past
+    "IIMWV,120.0,R,10.5,N,A",
+    "IIVHW,,T,45.0,M,5.2,N,9.6,K",
+    "IIHDG,45.0,,,1.5,E",
+    "GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00",
+    "GPGGA,123519,5310.000,N,00518.000,E,1,08,0.9,5.4,M,46.9,M,,",
+    "IIVTG,45.0,T,43.5,M,5.2,N,9.6,K,A",
+    "SDDBT,10.5,f,3.2,M,1.7,F",
+]
+AIS_LINE = "!AIVDM,1,1,,A,13aEOK?P00PD2wVMdLDRhgvL289?,0*26"
+
+
+
+def sentence(body):
+    return "$" + body + "*" + nmeadecoder.HEXDIGITS[nmeadecoder.checksum(body)] + "\n"
+
+
+
+def formatLatLon(value, degreeDigits, positive, negative):
+    # degrees into ddmm.mmmm or dddmm.mmmm, and the hemisphere
+    hemisphere = positive if value >= 0 else negative
+    value = abs(value)
+    degrees = int(value)
+    return "{:0{}d}{:07.4f}".format(degrees, degreeDigits, (value - degrees) * 60), hemisphere
+
+
+
+def corruptLine(rng, rmc):
+    kind = rng.randrange(5)
+    if (kind == 0):
+        return rmc[:-3] + ("00" if rmc[-3:-1] != "00" else "01") + "\n"  # checksum mismatch
+    if (kind == 1):
+        return ",".join(rmc.split(",")[:5]) + "\n"  # cut off, without checksum
+    if (kind == 2):
+        return "".join(chr(rng.randrange(1, 256)) for i in range(rng.randrange(10, 80))).replace("\n", "").replace("\r", "") + "\n"
+    if (kind == 3):
+        return "\n"
+    return rmc[:-1] + rmc  # two sentences run together
+
+
+
+def logFileName(directory, size, days, seed):
+    return os.path.join(directory, "synthetic-{}MB-{}d-{}.log".format(size, days, seed))
+
+
+
+def generateLog(filename, size, days, seed):
+    # Write a VDR log of about size MB spanning days days; returns (lines, seconds)
+    started = time.time()
+    rng = random.Random(seed)
+    fixes = max(1, int(size * 1024 * 1024 / BYTES_PER_FIX))
+    step = days * 86400.0 / fixes
+    south, north, west, east = AREA
+    lat = (south + north) / 2
+    lon = (west + east) / 2
+    heading = rng.uniform(0, 2 * math.pi)
+    t = float(calendar.timegm(START.timetuple()))
+    day = None
+    date = None
+    lines = 0
+    others = [sentence(body) for body in OTHER_SENTENCES] + [AIS_LINE + "\n"]
+    block = []
+    with open(filename + ".part", "w", encoding = "utf-8", newline = "\n") as f:
+        for k in range(fixes):
+            # Sail on, turning now and then, and away from the edges of the area
+            heading += rng.gauss(0, 0.05)
+            if (not (south < lat < north and west < lon < east)):
+                heading = math.atan2((south + north) / 2 - lat, ((west + east) / 2 - lon) * math.cos(lat / 180 * math.pi))
+                heading = math.pi / 2 - heading
+            distance = SPEED * step
+            lat += distance * math.cos(heading) / 1852 / 60
+            lon += distance * math.sin(heading) / 1852 / 60 / math.cos(lat / 180 * math.pi)
+            t += step
+
+            seconds = int(t)
+            if (seconds // 86400 != day):
+                day = seconds // 86400
+                date = time.strftime("%d%m%y", time.gmtime(seconds))
+            s = seconds % 86400
+            hhmmss = "{:02d}{:02d}{:02d}.{:02d}".format(s // 3600, s // 60 % 60, s % 60, int((t - seconds) * 100))
+            talker = RMC_TALKERS[k % len(RMC_TALKERS)]
+            if (rng.random() < 0.002):
+                rmc = sentence("{}RMC,{},V,,,,,,,{},,,N".format(talker, hhmmss, date))  # no fix
+            else:
+                latText, ns = formatLatLon(lat, 2, "N", "S")
+                lonText, ew = formatLatLon(lon, 3, "E", "W")
+                rmc = sentence("{}RMC,{},A,{},{},{},{},{:.1f},{:.1f},{},,,A".format(talker, hhmmss, latText, ns, lonText, ew,
+                    SPEED * 3600 / 1852, math.degrees(heading) % 360, date))
+            block.append(rmc)
+
+            depth = 1.0 + 6.0 * (1 + math.sin(lat * 700) * math.cos(lon * 400)) + rng.gauss(0, 0.2)
+            if (rng.random() < 0.001):
+                depth = 0.0  # no bottom found
+            block.append(sentence("{}DPT,{:.1f},0.0".format(DPT_TALKERS[k % len(DPT_TALKERS)], max(depth, 0.0))))
+            lines += 2
+            if (rng.random() < 0.5):
+                block.append(others[rng.randrange(len(others))])
+                lines += 1
+            if (rng.randrange(CORRUPT_EVERY) == 0):
+                block.append(corruptLine(rng, rmc))
+                lines += 1
+
+            if (len(block) >= 10000):
+                f.write("".join(block))
+                block = []
+        f.write("".join(block))
+    os.replace(filename + ".part", filename)
+    return lines, time.time() - started
+
+
+
+def tideLevel(t, phase):
+    # Water level in cm: the M2 and S2 tides
+    return int(round(90 * math.cos(2 * math.pi * t / 44714.2 + phase) + 20 * math.cos(2 * math.pi * t / 43200 + 2 * phase)))
+
+
+
+def generateTides(directory, fromTime, toTime, seed):
+    # Write a waterinfo CSV file in directory/data for every station in tidalstations.conf, and a copy
+    # of the configuration; returns the number of files
+    rng = random.Random(seed)
+    shutil.copy(os.path.join(PACKAGE_DIR, "tidalstations.conf"), os.path.join(directory, "tidalstations.conf"))
+    dataDir = os.path.join(directory, "data")
+    if (not os.path.isdir(dataDir)):
+        os.makedirs(dataDir)
+    with open(os.path.join(directory, "tidalstations.conf"), newline = '') as f:
+        stations = [row for row in csv.reader(f, delimiter = '\t') if (len(row) > 2 and not row[0].startswith("#"))]
+    first = (fromTime - TIDE_MARGIN) // TIDE_INTERVAL * TIDE_INTERVAL
+    last = toTime + TIDE_MARGIN
+    forecasts = last - FORECAST_FRACTION * (last - first)
+    for row in stations:
+        code = row[2].lstrip("*").rsplit(".", 1)[0]
+        phase = rng.uniform(0, 0.5)
+        with open(os.path.join(dataDir, "synthetic-{}.csv".format(code)), "w", newline = "\n") as f:
+            f.write("Datum;Tijd;Parameter;Locatie;Meting;Verwachting\n")
+            for t in range(first, last, TIDE_INTERVAL):
+                local = time.gmtime(t + TIDE_TIMEZONE)
+                level = tideLevel(t, phase)
+                measured, forecast = ("", level) if (t >= forecasts) else (level, "")
+                f.write("{}-{}-{};{:02d}:{:02d}:{:02d};Waterhoogte;{};{};{}\n".format(local.tm_mday, local.tm_mon, local.tm_year,
+                    local.tm_hour, local.tm_min, local.tm_sec, code, measured, forecast))
+    return len(stations)
+
+
+
+def loadLog(args):
+    import nmealog
+    log = nmealog.NmeaLog(args.log)
+    log.load(args.processes)
+    return log
+
+
+
+def loadTides():
+    import depthwaypoints
+    return depthwaypoints.loadTidalData()
+
+
+
+def benchmarkLoad(args):
+    import nmealog
+    log = nmealog.NmeaLog(args.log)
+    started = time.time()
+    log.load(args.processes)
+    seconds = time.time() - started
+    size = os.path.getsize(args.log) / 1024 / 1024
+    return {"seconds": seconds, "lines": log.lines, "lines/s": log.lines / seconds, "MB/s": size / seconds}
+
+
+
+def benchmarkLayer(args):
+    import depthwaypoints
+    log = loadLog(args)
+    tidalData = None if (args.no_tide) else loadTides()
+    soundings = len(log.soundingDepth)
+    started = time.time()
+    waypoints = depthwaypoints.generateLayerFile(log, tidalData, os.path.join(args.dir, "layer.gpx"), depthwaypoints.ALL_TIMES[0], depthwaypoints.ALL_TIMES[1],
+        0, depthwaypoints.DEFAULT_MAX_DEPTH, depthwaypoints.DEFAULT_INTERVAL)
+    seconds = time.time() - started
+    return {"seconds": seconds, "soundings": soundings, "waypoints": waypoints, "soundings/s": soundings / seconds, "waypoints/s": waypoints / seconds}
+
+
+
+def benchmarkTrack(args):
+    import depthwaypoints
+    log = loadLog(args)
+    fixes = len(log.fixTime)
+    started = time.time()
+    trackpoints = depthwaypoints.generateTrackFile(log, os.path.join(args.dir, "track.gpx"), depthwaypoints.ALL_TIMES[0], depthwaypoints.ALL_TIMES[1],
+        tolerance = args.track_tolerance)
+    seconds = time.time() - started
+    return {"seconds": seconds, "fixes": fixes, "trackpoints": trackpoints, "fixes/s": fixes / seconds, "trackpoints/s": trackpoints / seconds}
+
+
+
+def benchmarkNmea2gpx(args):
+    # nmea2gpx works in the current directory, and moves the log away when done. Its manifest
+    # is removed, or the log would be skipped as converted before.
+    shutil.rmtree("gpx", ignore_errors = True)
+    for directory in ("nmea/old", "gpx"):
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+    source = os.path.join("nmea", os.path.basename(args.log))
+    try:
+        os.link(args.log, source)
+    except OSError:
+        shutil.copy(args.log, source)
+    import nmea2gpx
+    import nmealog
+    nmea2gpx.PARSE_PROCESSES = args.processes
+    started = time.time()
+    nmea2gpx.generateTrackFile(source, nmealog.MIN_TIME, nmealog.MAX_TIME)
+    seconds = time.time() - started
+    os.remove(os.path.join("nmea/old", os.path.basename(args.log)))
+    size = os.path.getsize(args.log) / 1024 / 1024
+    return {"seconds": seconds, "lines": args.lines, "lines/s": args.lines / seconds, "MB/s": size / seconds}
+
+
+
+def benchmarkTide(args):
+    import numpy as np
+    shutil.rmtree(os.path.join("data", "cache"), ignore_errors = True)  # parse the CSV files, not the cache
+    started = time.time()
+    tidalData = loadTides()
+    loadSeconds = time.time() - started
+    if (len(tidalData.stations) == 0):
+        raise RuntimeError("no tidal stations loaded")
+
+    rng = np.random.default_rng(args.seed)
+    south, north, west, east = AREA
+    first = calendar.timegm(START.timetuple())
+    utcTimes = rng.integers(first, first + args.days * 86400, args.lookups)
+    lats = rng.uniform(south, north, args.lookups)
+    lons = rng.uniform(west, east, args.lookups)
+    started = time.time()
+    for utcTime, lat, lon in zip(utcTimes.tolist(), lats.tolist(), lons.tolist()):
+        tidalData.getWeighedWaterLevel(utcTime, lat, lon)
+    scalarSeconds = time.time() - started
+    started = time.time()
+    tidalData.getWeighedWaterLevels(utcTimes, lats, lons)
+    batchSeconds = time.time() - started
+    return {"seconds": loadSeconds + scalarSeconds + batchSeconds, "stations": len(tidalData.stations), "load seconds": loadSeconds,
+        "lookups": args.lookups, "lookups/s": args.lookups / scalarSeconds, "batched lookups/s": args.lookups / batchSeconds}
+
+
+
+def benchmarkWindow(args):
+    # The time index is written by a first, untimed, open; an hour in the middle of the log is then read through it
+    import nmealog
+    nmealog.NmeaLog(args.log).open(args.processes)
+    started = time.time()
+    log = nmealog.NmeaLog(args.log)
+    log.open(args.processes)
+    middle = (log.firstTime + log.lastTime) // 2
+    window = log.window(middle, middle + 3600, args.processes)
+    seconds = time.time() - started
+    start, end, lat, lon = log.timeIndex.span(middle, middle + 3600)
+    size = (end if (end is not None) else os.path.getsize(args.log)) - start
+    return {"seconds": seconds, "MB read": size / 1024 / 1024, "fixes": len(window.fixTime)}
+
+
+
+BENCHMARKS = {
+    "load": benchmarkLoad,
+    "layer": benchmarkLayer,
+    "track": benchmarkTrack,
+    "nmea2gpx": benchmarkNmea2gpx,
+    "tide": benchmarkTide,
+    "window": benchmarkWindow,
+}
+
+
+
+def runStage(stage, args, connection):
+    # In a process of its own: run one benchmark in the work directory and send back its result
+    sys.path.insert(0, PACKAGE_DIR)
+    os.chdir(args.dir)
+    stdout = sys.stdout
+    if (not args.verbose):
+        sys.stdout = open(os.devnull, "w")
+    try:
+        result = BENCHMARKS[stage](args)
+        result["peak RSS MB"] = instrumentation.peakRss()
+    except Exception as e:
+        result = {"error": "{}: {}".format(type(e).__name__, str(e))}
+    finally:
+        sys.stdout = stdout
+    connection.send(result)
+    connection.close()
+
+
+
+def formatResult(stage, result):
+    if ("error" in result):
+        return "{:10}*** {}".format(stage, result["error"])
+    parts = ["{:8.2f} s".format(result["seconds"])]
+    for key, value in result.items():
+        if (key in ("seconds", "peak RSS MB")):
+            continue
+        if (isinstance(value, float) and not key.endswith("/s")):
+            parts.append("{:.2f} {}".format(value, key))
+        else:
+            parts.append("{:,.0f} {}".format(value, key))
+    rss = result.get("peak RSS MB")
+    parts.append("peak RSS {:,.0f} MB".format(rss) if (rss is not None) else "peak RSS n/a")
+    return "{:10}{}".format(stage, ", ".join(parts))
+
+
+
+def countLines(filename):
+    lines = 0
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(16 * 1024 * 1024)
+            if (not block):
+                break
+            lines += block.count(b"\n")
+    return lines
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Throughput benchmarks on a synthetic NMEA0183 log and tide data.")
+    parser.add_argument("--size", type = int, default = DEFAULT_SIZE, help = "log size in MB (default %(default)s)")
+    parser.add_argument("--days", type = int, default = DEFAULT_DAYS, help = "days the log spans (default %(default)s)")
+    parser.add_argument("--seed", type = int, default = DEFAULT_SEED, help = "seed of the synthetic data (default %(default)s)")
+    parser.add_argument("--dir", default = "benchmark", help = "work directory; the generated log is kept there (default %(default)s)")
+    parser.add_argument("--processes", type = int, default = os.cpu_count() or 1, help = "processes for parsing the log (default %(default)s)")
+    parser.add_argument("--lookups", type = int, default = DEFAULT_LOOKUPS, help = "tide lookups (default %(default)s)")
+    parser.add_argument("--no-tide", action = "store_true", help = "generate the layer without tide correction")
+    parser.add_argument("--track-tolerance", type = float, default = 0, help = "simplify the track to this tolerance in meters (default %(default)s: thin it)")
+    parser.add_argument("--verbose", action = "store_true", help = "show the output of the tools")
+    parser.add_argument("stages", nargs = "*", metavar = "STAGE", help = "stages to run: {} (default all)".format(", ".join(STAGES)))
+    args = parser.parse_args(argv)
+    for stage in args.stages:
+        if (stage not in STAGES):
+            parser.error("unknown stage {}; choose from {}".format(stage, ", ".join(STAGES)))
+    args.stages = args.stages or STAGES
+
+    args.dir = os.path.abspath(args.dir)
+    if (not os.path.isdir(args.dir)):
+        os.makedirs(args.dir)
+    args.log = logFileName(args.dir, args.size, args.days, args.seed)
+    if (not os.path.exists(args.log)):
+        print ("Generating {}...".format(args.log))
+        lines, seconds = generateLog(args.log, args.size, args.days, args.seed)
+        print ("{:,} lines in {:.1f} s".format(lines, seconds))
+    args.lines = countLines(args.log)
+    first = calendar.timegm(START.timetuple())
+    stations = generateTides(args.dir, first, first + args.days * 86400, args.seed)
+    print ("{:,} lines, {:.1f} MB; tide data for {} stations".format(args.lines, os.path.getsize(args.log) / 1024 / 1024, stations))
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for stage in args.stages:
+        receiver, sender = context.Pipe(duplex = False)
+        process = context.Process(target = runStage, args = (stage, args, sender))
+        process.start()
+        sender.close()
+        try:
+            results[stage] = receiver.recv()
+        except EOFError:
+            results[stage] = {"error": "stage process ended with exit code {}".format(process.exitcode)}
+        process.join()
+        print (formatResult(stage, results[stage]))
+    return 1 if any("error" in result for result in results.values()) else 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+
+# Greedy distance-threshold decimation of a track, vectorized with NumPy.
+#
+# Walking along the points, a point is kept when it lies more than `interval` meters from
+# the last kept point (the anchor). A jump of more than RESET_DISTANCE meters, e.g. from the
+# initial (0, 0) anchor to the first fix, moves the anchor as well. This is the same rule as
+# the per-point loop in the layer and track generators, and gives the same points:
+#
+#     distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852
+#     if (distance > 10000): lastlat = curlat; lastlon = curlon
+#     if (distance > interval): <keep point>; lastlat = curlat; lastlon = curlon
+#
+# The next anchor after every point is computed for all points at once, by comparing each
+# point with the one 1, 2, ... VECTOR_OFFSETS positions further. Following the chain of
+# anchors from the first point is then a cheap walk over a list of integers. Points whose next anchor
+# is further away than that (the boat lying still) are searched in blocks from the anchor.
+
+RESET_DISTANCE = 10000  # meters
+VECTOR_OFFSETS = 64
+SEARCH_BLOCK = 256
+
+
+
+def distances(lat, lon, cosLat, anchorLat, anchorLon):
+    # Equirectangular distance in meters; same operations, in the same order, as the per-point loop
+    return np.sqrt(((lon - anchorLon) * cosLat) ** 2 + (lat - anchorLat) ** 2) * 60 * 1852
+
+
+
+def decimate(lat, lon, interval, anchorLat=0.0, anchorLon=0.0):
+    # Returns the indices of the points kept by the distance filter, as an int64 array. To carry
+    # on after an earlier run, pass the last point kept then as the initial anchor.
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    interval = float(interval)
+    n = len(lat)
+    if (n == 0):
+        return np.zeros(0, dtype=np.int64)
+
+    # np.cos agrees with math.cos to the last bit on the usual platforms; where it does not,
+    # only a point within a rounding error of the interval could be decided differently
+    cosLat = np.cos(lat/180*math.pi)
+    threshold = min(interval, RESET_DISTANCE)  # distance beyond which the anchor moves on
+
+    def search(anchorLat, anchorLon, start):
+        # First point from start on that lies beyond threshold from the anchor: (index, distance)
+        block = SEARCH_BLOCK
+        while (start < n):
+            end = min(start + block, n)
+            d = distances(lat[start:end], lon[start:end], cosLat[start:end], anchorLat, anchorLon)
+            beyond = d > threshold
+            if (beyond.any()):
+                k = int(beyond.argmax())
+                return start + k, float(d[k])
+            start = end
+            block *= 2
+        return -1, 0.0
+
+    # nextAnchor[i]: first point beyond threshold from point i, if within VECTOR_OFFSETS points.
+    # While many points are unresolved, whole shifted slices are compared; once few remain,
+    # only those are gathered.
+    nextAnchor = np.full(n, -1, dtype=np.int64)
+    nextDistance = np.zeros(n, dtype=np.float64)
+    unresolved = np.ones(n, dtype=bool)
+    pending = None
+    for k in range(1, min(VECTOR_OFFSETS, n - 1) + 1):
+        if (pending is None):
+            d = distances(lat[k:], lon[k:], cosLat[k:], lat[:-k], lon[:-k])
+            found = unresolved[:-k] & (d > threshold)
+            i = np.flatnonzero(found)
+            nextAnchor[i] = i + k
+            nextDistance[i] = d[i]
+            unresolved[i] = False
+            if (np.count_nonzero(unresolved) * 8 < n):
+                pending = np.flatnonzero(unresolved)
+        else:
+            pending = pending[pending + k < n]
+            if (len(pending) == 0):
+                break
+            j = pending + k
+            d = distances(lat[j], lon[j], cosLat[j], lat[pending], lon[pending])
+            beyond = d > threshold
+            nextAnchor[pending[beyond]] = j[beyond]
+            nextDistance[pending[beyond]] = d[beyond]
+            pending = pending[~beyond]
+    nextAnchor = nextAnchor.tolist()
+    nextDistance = nextDistance.tolist()
+
+    kept = []
+    anchor, distance = search(anchorLat, anchorLon, 0)
+    while (anchor >= 0):
+        if (distance > interval):
+            kept.append(anchor)
+        if (nextAnchor[anchor] >= 0):
+            distance = nextDistance[anchor]
+            anchor = nextAnchor[anchor]
+        else:
+            anchor, distance = search(lat[anchor], lon[anchor], anchor + 1)
+    return np.array(kept, dtype=np.int64)
+
+
+
+class Decimator(object):
+
+    # The same filter for points that arrive one at a time, e.g. from a live NMEA stream
+
+    def __init__(self, interval, anchorLat=0.0, anchorLon=0.0):
+        self.interval = float(interval)
+        self.anchorLat = anchorLat
+        self.anchorLon = anchorLon
+
+    def keep(self, lat, lon):
+        # True if the point is kept; it then becomes the anchor for the next points
+        distance = math.sqrt(((lon - self.anchorLon) * math.cos(lat/180*math.pi)) ** 2 + (lat - self.anchorLat) ** 2) * 60 * 1852
+        if (distance > RESET_DISTANCE or distance > self.interval):
+            self.anchorLat = lat
+            self.anchorLon = lon
+        return distance > self.interval
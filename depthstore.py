@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# Persistent store of depth soundings from many log files, on a grid of cells of CELL_SIZE meters.
+# Every cell keeps the number of soundings, the minimum and mean depth, and the latest sounding,
+# so overlapping passes over the same channel end up in the same cells instead of piling up as
+# separate waypoints. Depth layers are exported from the store, one waypoint per cell:
+#
+#     python depthstore.py depths.db add /extra/nmea.log [--start hhmmss] [--end hhmmss] [--no-tide]
+#     python depthstore.py depths.db export depths.gpx [--max-depth 10] [--depth min|mean|latest]
+#
+# The store is an SQLite database. Depths are stored tide-corrected, relative to the same
+# reference as the waypoints of depthwaypoints.py. The sources table records the time windows
+# added per log file; adding a log again, or after it grew, only adds the soundings outside them.
+
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+import depthwaypoints
+import gpxwriter
+import levelofdetail
+import nmealog
+import nmeatime
+
+CELL_SIZE = 5       # meters
+INGEST_BLOCK = 200000  # soundings aggregated and written per transaction
+METERS_PER_DEGREE = 60 * 1852
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value REAL);
+CREATE TABLE IF NOT EXISTS cells (
+    row INTEGER, col INTEGER,
+    count INTEGER, min REAL, sum REAL,
+    latest INTEGER, latestDepth REAL,
+    PRIMARY KEY (row, col)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    log TEXT, fromTime INTEGER, toTime INTEGER,
+    soundings INTEGER, added INTEGER,
+    PRIMARY KEY (log, fromTime, toTime));
+"""
+
+UPSERT = """
+INSERT INTO cells (row, col, count, min, sum, latest, latestDepth) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (row, col) DO UPDATE SET
+    count = count + excluded.count,
+    min = MIN(min, excluded.min),
+    sum = sum + excluded.sum,
+    latestDepth = CASE WHEN excluded.latest >= latest THEN excluded.latestDepth ELSE latestDepth END,
+    latest = MAX(latest, excluded.latest)
+"""
+
+
+
+class DepthStore(object):
+
+    def __init__(self, filename, cellSize=CELL_SIZE):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM settings WHERE name = 'cellSize'").fetchone()
+        if (row is None):
+            with self.db:
+                self.db.execute("INSERT INTO settings VALUES ('cellSize', ?)", (cellSize,))
+            self.cellSize = float(cellSize)
+        else:
+            self.cellSize = row[0]
+
+
+
+    def close(self):
+        self.db.close()
+
+
+
+    def cells(self, lats, lons):
+        # Grid cell (row, col) of every position. Rows are cellSize meters of latitude; the columns
+        # are cellSize meters of longitude at the middle of their row.
+        rows = np.floor(lats * METERS_PER_DEGREE / self.cellSize).astype(np.int64)
+        cosLat = np.cos((rows + 0.5) * self.cellSize / METERS_PER_DEGREE / 180 * math.pi)
+        cols = np.floor(lons * METERS_PER_DEGREE * cosLat / self.cellSize).astype(np.int64)
+        return rows, cols
+
+
+
+    def cellCentre(self, row, col):
+        lat = (row + 0.5) * self.cellSize / METERS_PER_DEGREE
+        lon = (col + 0.5) * self.cellSize / (METERS_PER_DEGREE * math.cos(lat / 180 * math.pi))
+        return lat, lon
+
+
+
+    def uncovered(self, log, fromTimeStamp, toTimeStamp):
+        # The parts of the time window that were not added from this log before, as [(from, to)]
+        covered = self.db.execute("SELECT fromTime, toTime FROM sources WHERE log = ?", (log,)).fetchall()
+        return nmeatime.uncovered(fromTimeStamp, toTimeStamp, covered)
+
+
+
+    def add(self, utcTimes, lats, lons, depths, sources=()):
+        # Add soundings (epoch times, positions, tide-corrected depths in m). They are aggregated per
+        # cell in NumPy first, so the database sees one upsert per cell and block. The sources
+        # (log, fromTimeStamp, toTimeStamp, soundings) are recorded in the same transaction.
+        utcTimes = np.asarray(utcTimes, dtype=np.int64)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        depths = np.asarray(depths, dtype=np.float64)
+        with self.db:
+            for start in range(0, len(depths), INGEST_BLOCK):
+                block = slice(start, start + INGEST_BLOCK)
+                rows, cols = self.cells(lats[block], lons[block])
+                keys, inverse = np.unique(np.stack((rows, cols), axis=1), axis=0, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                n = len(keys)
+                count = np.bincount(inverse, minlength=n)
+                total = np.bincount(inverse, weights=depths[block], minlength=n)
+                minimum = np.full(n, np.inf)
+                np.minimum.at(minimum, inverse, depths[block])
+                # Latest sounding per cell: sort by cell, then time, and take the last of every cell
+                order = np.lexsort((utcTimes[block], inverse))
+                last = order[np.r_[np.flatnonzero(np.diff(inverse[order])), len(order) - 1]] if (len(order) > 0) else order
+                self.db.executemany(UPSERT, zip(keys[:, 0].tolist(), keys[:, 1].tolist(), count.tolist(), minimum.tolist(), total.tolist(),
+                    utcTimes[block][last].tolist(), depths[block][last].tolist()))
+            added = int(time.time())
+            self.db.executemany("INSERT INTO sources VALUES (?, ?, ?, ?, ?)", [tuple(source) + (added,) for source in sources])
+
+
+
+    def query(self, depth="min", maxDepth=None):
+        # Yield (lat, lon, depth, count) per cell, with depth the min, mean or latest depth of the cell
+        column = {"min": "min", "mean": "sum / count", "latest": "latestDepth"}[depth]
+        sql = "SELECT row, col, {}, count FROM cells".format(column)
+        if (maxDepth is not None):
+            sql += " WHERE {} < ?".format(column)
+        for row, col, value, count in self.db.execute(sql, () if (maxDepth is None) else (maxDepth,)):
+            lat, lon = self.cellCentre(row, col)
+            yield lat, lon, value, count
+
+
+
+    def export(self, layerFileName, maxDepthValue, depth="min"):
+        # Write a layer with one waypoint per cell shallower than maxDepthValue, with the scale levels
+        # spread over all of them; returns the number of waypoints
+        cells = [(lat, lon, value) for lat, lon, value, count in self.query(depth, maxDepthValue) if (value != 0)]
+        lats, lons, values = (np.array(column, dtype=np.float64) for column in zip(*cells)) if (cells) else (np.zeros(0),) * 3
+        del cells
+        scales = levelofdetail.scaleLevels(lats, lons, values)
+        with gpxwriter.GpxWriter(layerFileName, gpxwriter.GPX_HEADER, gpxwriter.LAYER_FOOTER) as writer:
+            waypoint = gpxwriter.WAYPOINT
+            for lat, lon, value, scaleMin in zip(lats.tolist(), lons.tolist(), values.tolist(), scales.tolist()):
+                writer.write(waypoint % (lat, lon, depthwaypoints.depthIcon(value, 0), scaleMin))
+        print ("OK - Waypoint file created with {} waypoints from {}".format(len(lats), self.filename))
+        return len(lats)
+
+
+
+    def statistics(self):
+        cells, soundings = self.db.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM cells").fetchone()
+        sources = self.db.execute("SELECT COUNT(DISTINCT log) FROM sources").fetchone()[0]
+        return cells, soundings, sources
+
+
+
+def addLog(store, log, tidalData, fromTimeStamp, toTimeStamp):
+    # Add the tide-corrected soundings of the log in the time window, leaving out the times added
+    # from the same log before; returns the number added, or None if the whole window was added before
+    logFile = os.path.abspath(log.filename)
+    windows = store.uncovered(logFile, fromTimeStamp, toTimeStamp)
+    if (not windows):
+        print ("The soundings of {} in the time window are in the store already".format(logFile))
+        return None
+    columns = []
+    sources = []
+    for windowFrom, windowTo in windows:
+        utcTimes, lats, lons, depths = log.soundingColumns(windowFrom, windowTo)
+        keep = depths != 0  # as in the layer: a depth of 0 is no sounding
+        columns.append((utcTimes[keep], lats[keep], lons[keep], depths[keep]))
+        sources.append((logFile, windowFrom, windowTo, int(keep.sum())))
+    utcTimes, lats, lons, depths = (np.concatenate(column) for column in zip(*columns))
+    del columns
+    if (tidalData is not None):
+        depths = depths - tidalData.getWeighedWaterLevels(utcTimes, lats, lons)
+        tidalData.printStatistics()
+    store.add(utcTimes, lats, lons, depths, sources)
+    print ("OK - {} soundings added to {}".format(len(depths), store.filename))
+    return len(depths)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Persistent grid of depth soundings from many NMEA0183 logs, and GPX export.")
+    parser.add_argument("store", help = "store file (SQLite)")
+    parser.add_argument("--cell-size", type = float, default = CELL_SIZE, help = "cell size in meters for a new store (default %(default)s)")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    add = commands.add_parser("add", help = "add the soundings of a log file")
+    add.add_argument("logfile")
+    add.add_argument("--start", help = "start time (UTC), hhmmss on the first day or ddmmyyhhmmss")
+    add.add_argument("--end", help = "end time (UTC), hhmmss on the last day or ddmmyyhhmmss")
+    add.add_argument("--no-tide", action = "store_true", help = "do not correct the depths for the tide")
+    depthwaypoints.addTideArguments(add)
+    add.add_argument("--processes", type = int, default = depthwaypoints.PARSE_PROCESSES)
+    export = commands.add_parser("export", help = "export a depth layer")
+    export.add_argument("layer")
+    export.add_argument("--max-depth", type = float, default = depthwaypoints.DEFAULT_MAX_DEPTH, help = "deepest cell to show, in meters (default %(default)s)")
+    export.add_argument("--depth", choices = ("min", "mean", "latest"), default = "min", help = "depth shown per cell (default %(default)s)")
+    commands.add_parser("info", help = "show the size of the store")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    store = DepthStore(os.path.abspath(args.store), args.cell_size)
+    if (args.command == "add"):
+        logFile = os.path.abspath(args.logfile)
+        tidalData = None
+        if (not args.no_tide):
+            os.chdir(os.path.dirname(os.path.realpath(__file__)))
+            tidalData = depthwaypoints.loadTidalData(args.tide_stations, args.tide_radius)
+        log = nmealog.NmeaLog(logFile)
+        log.open(args.processes)
+        try:
+            fromTimeStamp, toTimeStamp = depthwaypoints.timeWindow(log, args.start, args.end)
+        except ValueError as e:
+            parser.error(str(e))
+        addLog(store, log.window(fromTimeStamp, toTimeStamp, args.processes), tidalData, fromTimeStamp, toTimeStamp)
+    elif (args.command == "export"):
+        store.export(os.path.abspath(args.layer), args.max_depth, args.depth)
+    print ("{} cells with {} soundings from {} logs; cells of {} m".format(*store.statistics(), store.cellSize))
+    store.close()
+    print ("Done in {:.1f} s".format(time.time() - started))
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# Depth layer and track generation, without user interface. Used by process_depth.py, and
+# runnable on its own from the command line:
+#
+#     python depthwaypoints.py /extra/nmea.log --layer depths.gpx --track tracks.gpx --interval 15 --max-depth 10
+#
+# or, for a depth raster (ESRI ASCII grid) and iso-depth contours:
+#
+#     python depthwaypoints.py /extra/nmea.log --raster depths.asc --contours contours.gpx --contour-depths 1,2,5
+#
+# Importing this module has no side effects. wxPython is not used at all, and the tidal data
+# (pytz, the station files) is only loaded when tide correction is asked for.
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import bathymetry
+import decimate
+import gpxwriter
+import instrumentation
+import levelofdetail
+import nmealog
+import nmeatime
+import simplify
+
+DEFAULT_INTERVAL = 15
+DEFAULT_MAX_DEPTH = 10
+TRACK_INTERVAL = 30
+DEFAULT_TRACK_TOLERANCE = 0  # meters; above 0 the track is simplified to that tolerance instead of thinned by TRACK_INTERVAL
+PARSE_PROCESSES = os.cpu_count() or 1  # large log files are parsed in parallel
+GENERATE_BLOCK = 20000  # soundings/fixes per step while generating; progress and cancel are handled between steps
+ALL_TIMES = (nmealog.MIN_TIME, nmealog.MAX_TIME)  # time window of an incremental run: everything that was appended
+CHECKPOINT_VERSION = 3  # checkpoints of another version are not continued from
+
+
+
+class Checkpoint(object):
+
+    # State after an incremental run over a growing log file: how far the log was read, its last
+    # RMC fix, and how the layer and track files were left, so the next run only processes the
+    # appended data and adds to the same files
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.log = None
+        self.settings = None
+        self.offset = 0          # bytes of the log processed
+        self.head = None         # digest of the start of the log (nmealog.headDigest), to notice a new file
+        self.lastFix = None      # [epoch seconds, lat, lon]
+        self.layer = None        # {"file", "size", "lat", "lon", "cells"}: last waypoint position, scale level cells taken
+        self.track = None        # {"file", "size", "lat", "lon"}: last trackpoint position
+        self.corrected = 0       # tide statistics
+        self.uncorrected = 0
+
+
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                self.__dict__.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print ("*** Could not read checkpoint {}: {}".format(self.filename, str(e)))
+
+
+
+    def save(self):
+        state = dict(self.__dict__)
+        del state["filename"]
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+
+    def matches(self, logFile, layerFileName, trackFileName, settings):
+        # True if the previous run used the same files and settings, and left the files as recorded
+        if (self.log != logFile or self.settings != settings):
+            return False
+        if (os.path.getsize(logFile) < self.offset or nmealog.headDigest(logFile, self.offset) != self.head):
+            return False  # the log was restarted or replaced, e.g. rotated
+        for state, filename, footer in ((self.layer, layerFileName, gpxwriter.LAYER_FOOTER), (self.track, trackFileName, gpxwriter.TRACK_FOOTER)):
+            if ((state is None) != (filename is None)):
+                return False
+            if (state is not None and (state["file"] != filename or not gpxwriter.intact(filename, state["size"], footer))):
+                return False
+        return True
+
+
+
+def loadTidalData(nearestStations=None, maxRadius=None):
+    # Station files are found relative to the current directory, as in process_depth.py. Without
+    # nearestStations or maxRadius, those of tidalstations.conf are used.
+    import tidaldata
+    tidalData = tidaldata.TidalData(nearestStations, maxRadius)
+    tidalData.readStations(tidalData.DONT_FETCH_DATA)
+    return tidalData
+
+
+
+def depthIcon (curdepth, waterLevel):
+
+    actualDepth = round(float(curdepth) - float(waterLevel) , 1)  # 1 digit
+    icon = ICONS.get(actualDepth)
+    if (icon is not None):
+        return icon
+
+    if (actualDepth < 0):
+        name = 'dry'
+    else:
+        name = 'depth'
+
+    m = math.floor(abs(actualDepth))
+    dm = math.floor((abs(actualDepth) - m )*10)
+    icon = "{}_{}-{}".format(name, m, dm)
+    ICONS[actualDepth] = icon  # a few thousand depths at most
+
+    return icon
+
+ICONS = {}
+
+
+
+def scale (x):
+    s = 32
+    a = x % 32
+    for z in range(5, -1, -1):
+        if a > 31:
+            s = 2 ** z
+            a = a - 32
+        a = a * 2
+    return (s * 1600)
+
+SCALES = [scale(x) for x in range(32)]  # scale(i) == SCALES[i % 32]; for waypoints that arrive one at a time (nmeastream.py)
+
+
+
+def checkCancel(cancel):
+    if (cancel is not None and cancel.is_set()):
+        raise nmealog.Cancelled()
+
+
+
+def generateLayerFile (log, tidalData, layerFileName, fromTimeStamp, toTimeStamp, tideOffsetValue, maxDepthValue, intervalValue, progress=None, cancel=None, checkpoint=None, tileSize=None):
+    # Writes the depth waypoints of the soundings in the time window; returns the number of waypoints.
+    # Without tidalData the depths are not corrected. progress(done, total) is called after every
+    # block; when the threading.Event cancel gets set, generation stops with nmealog.Cancelled.
+    # With a checkpoint that holds a layer, the waypoints are added to that layer file instead.
+    # With tileSize, layerFileName is a directory of tiles (see gpxwriter.GpxTiles) that the
+    # waypoints are added to, leaving out the times of this log that were added before. The scale
+    # levels of the waypoints are spread over the area of the window, and when adding to a layer or
+    # tiles, against the cells their earlier waypoints fill (see levelofdetail.py).
+    anchorLat, anchorLon = 0.0, 0.0
+    state = checkpoint.layer if (checkpoint is not None) else None
+    if (state is not None):
+        anchorLat, anchorLon = state["lat"], state["lon"]
+        if (tidalData is not None):
+            tidalData.corrected += checkpoint.corrected
+            tidalData.uncorrected += checkpoint.uncorrected
+        print ("Adding to layer file", layerFileName)
+    else:
+        print ("Generating layer file", layerFileName)
+
+    if (tideOffsetValue != 0):
+        print ("Warning! Tide Offset = {}.".format(tideOffsetValue))
+
+    timeStamps, lats, lons, depths = log.soundingColumns(fromTimeStamp, toTimeStamp)
+    windows = [(fromTimeStamp, toTimeStamp)]
+    taken = None  # scale level cells of the earlier waypoints
+    if (checkpoint is not None):
+        taken = dict(state["cells"]) if (state is not None) else {}
+    if (tileSize is not None):
+        logFile = os.path.abspath(log.filename)
+        tiles = gpxwriter.GpxTiles(layerFileName, gpxwriter.GPX_HEADER, gpxwriter.LAYER_FOOTER, tileSize, {"interval": intervalValue, "maxDepth": maxDepthValue})
+        windows = tiles.uncovered(logFile, fromTimeStamp, toTimeStamp)
+        taken = tiles.index.setdefault("scaleCells", {})
+        if (not windows):
+            print ("Already in the tiles of {}; not added again".format(layerFileName))
+            return 0
+        inWindows = np.zeros(len(timeStamps), dtype=bool)
+        for windowFrom, windowTo in windows:
+            inWindows |= (timeStamps >= windowFrom) & (timeStamps <= windowTo)
+        timeStamps, lats, lons, depths = timeStamps[inWindows], lats[inWindows], lons[inWindows], depths[inWindows]
+    with instrumentation.stage("decimate"):
+        kept = decimate.decimate(lats, lons, intervalValue, anchorLat, anchorLon)
+    instrumentation.count("soundings", len(depths))
+    checkCancel(cancel)
+
+    if (tileSize is not None):
+        writer = tiles
+    else:
+        appendAt = state["size"] if (state is not None) else None
+        writer = gpxwriter.GpxWriter(layerFileName, gpxwriter.GPX_HEADER, gpxwriter.LAYER_FOOTER, appendAt = appendAt)
+    with writer:
+        # The waypoints of the whole window are selected first, as the scale levels depend on all of them
+        selected = []
+        icons = []
+        actualDepths = []
+        for start in range(0, len(kept), GENERATE_BLOCK):
+            block = kept[start:start + GENERATE_BLOCK]
+            blockTimeStamps = timeStamps[block].tolist()
+            if (tidalData is not None):
+                waterLevels = tidalData.getWeighedWaterLevels(timeStamps[block], lats[block], lons[block])
+            else:
+                waterLevels = np.zeros(len(block))
+
+            with instrumentation.stage("select"):
+                for index, timeStamp, curdepth, waterLevel in zip(block.tolist(), blockTimeStamps, depths[block].tolist(), waterLevels.tolist()):
+                    try:
+                        if (curdepth - waterLevel < maxDepthValue and curdepth != 0):
+                            icons.append(depthIcon(curdepth, waterLevel))
+                            selected.append(index)
+                            actualDepths.append(curdepth - waterLevel)
+                    except Exception as e:
+                        print ("exception processing sounding at {}: ".format(nmeatime.formatTime(timeStamp)) + str(e))
+                        pass
+            if (progress is not None):
+                progress(start + len(block), len(kept))
+            checkCancel(cancel)
+
+        write = writer.writePoint
+        waypoint = gpxwriter.WAYPOINT
+        selected = np.array(selected, dtype=np.int64)
+        with instrumentation.stage("scale levels"):
+            scales = levelofdetail.scaleLevels(lats[selected], lons[selected], actualDepths, taken = taken)
+        with instrumentation.stage("layer write"):
+            if (tileSize is None):
+                for curlat, curlon, icon, scaleMin in zip(lats[selected].tolist(), lons[selected].tolist(), icons, scales.tolist()):
+                    write(curlat, curlon, waypoint % (curlat, curlon, icon, scaleMin))
+            else:
+                # Every window is a trip of its own in the tile index
+                selectedTimeStamps = timeStamps[selected]
+                for windowFrom, windowTo in windows:
+                    writer.addTrip({"log": logFile, "from": windowFrom, "to": windowTo, "interval": intervalValue, "maxDepth": maxDepthValue})
+                    part = np.flatnonzero((selectedTimeStamps >= windowFrom) & (selectedTimeStamps <= windowTo)).tolist()
+                    for k in part:
+                        curlat, curlon = float(lats[selected[k]]), float(lons[selected[k]])
+                        write(curlat, curlon, waypoint % (curlat, curlon, icons[k], scales[k]))
+            checkCancel(cancel)
+    waypoints = len(selected)
+    instrumentation.count("waypoints", waypoints)
+
+    print ("OK - Waypoint file created with {} waypoints".format(waypoints))
+    if (checkpoint is not None):
+        if (len(kept) > 0):
+            anchorLat, anchorLon = float(lats[kept[-1]]), float(lons[kept[-1]])
+        checkpoint.layer = {"file": layerFileName, "size": os.path.getsize(layerFileName), "lat": anchorLat, "lon": anchorLon, "cells": taken}
+        if (tidalData is not None):
+            checkpoint.corrected = tidalData.corrected
+            checkpoint.uncorrected = tidalData.uncorrected
+    if (tidalData is not None):
+        tidalData.printStatistics()
+    return waypoints
+
+
+
+def generateTrackFile (log, trackFileName, fromTimeStamp, toTimeStamp, progress=None, cancel=None, checkpoint=None, tolerance=DEFAULT_TRACK_TOLERANCE):
+    # Writes the fixes in the time window as a track, one point per TRACK_INTERVAL meters, or with a
+    # tolerance, simplified (Douglas-Peucker) so that every fix lies within that many meters of the
+    # track; returns the number of trackpoints. With a checkpoint that holds a track, the trackpoints
+    # are added to that track file instead.
+    waypoints = 0
+    anchorLat, anchorLon = 0.0, 0.0
+    state = checkpoint.track if (checkpoint is not None) else None
+    if (state is not None):
+        anchorLat, anchorLon = state["lat"], state["lon"]
+        print ("Adding to track file", trackFileName)
+    else:
+        print ("Generating track file", trackFileName)
+
+    timeStamps, lats, lons = log.fixColumns(fromTimeStamp, toTimeStamp)
+    if (tolerance > 0):
+        with instrumentation.stage("simplify"):
+            kept = simplify.simplify(lats, lons, tolerance)
+    else:
+        with instrumentation.stage("decimate"):
+            kept = decimate.decimate(lats, lons, TRACK_INTERVAL, anchorLat, anchorLon)
+    checkCancel(cancel)
+
+    appendAt = state["size"] if (state is not None) else None
+    with gpxwriter.GpxWriter(trackFileName, gpxwriter.GPX_HEADER + gpxwriter.TRACK_HEADER % "", gpxwriter.TRACK_FOOTER, appendAt = appendAt) as writer:
+        write = writer.write
+        trackpoint = gpxwriter.TRACKPOINT
+        formatTime = nmeatime.formatTime
+        for start in range(0, len(kept), GENERATE_BLOCK):
+            block = kept[start:start + GENERATE_BLOCK]
+            with instrumentation.stage("track write"):
+                for timeStamp, curlat, curlon in zip(timeStamps[block].tolist(), lats[block].tolist(), lons[block].tolist()):
+                    write(trackpoint % (curlat, curlon, formatTime(timeStamp)))
+            waypoints += len(block)
+            if (progress is not None):
+                progress(start + len(block), len(kept))
+            checkCancel(cancel)
+
+    print ("OK - Track file created with {} waypoints".format(waypoints))
+    instrumentation.count("trackpoints", waypoints)
+    if (checkpoint is not None):
+        if (len(kept) > 0):
+            anchorLat, anchorLon = float(lats[kept[-1]]), float(lons[kept[-1]])
+        checkpoint.track = {"file": trackFileName, "size": os.path.getsize(trackFileName), "lat": anchorLat, "lon": anchorLon}
+    return waypoints
+
+
+
+def generateIncremental (logFile, checkpointFile, tidalData, layerFileName, trackFileName, tideOffsetValue, maxDepthValue, intervalValue, processes=1, progress=None, cancel=None, trackTolerance=DEFAULT_TRACK_TOLERANCE):
+    # Process only what was appended to the log file since the run recorded in the checkpoint file,
+    # and add the new waypoints and trackpoints to the layer and track files of that run. Without a
+    # checkpoint for the same files and settings, everything is generated from the start of the log.
+    # Either output file may be None. Returns the log with the appended data.
+    settings = {"tideOffset": tideOffsetValue, "maxDepth": maxDepthValue, "interval": intervalValue, "tide": tidalData is not None, "version": CHECKPOINT_VERSION}
+    if (trackTolerance > 0):
+        settings["trackTolerance"] = trackTolerance
+    checkpoint = Checkpoint(checkpointFile)
+    checkpoint.load()
+    if (not checkpoint.matches(logFile, layerFileName, trackFileName, settings)):
+        if (checkpoint.log is not None):
+            print ("Checkpoint {} does not match the files or settings; starting from the beginning".format(checkpointFile))
+        checkpoint = Checkpoint(checkpointFile)
+        checkpoint.log = logFile
+        checkpoint.settings = settings
+    else:
+        print ("Continuing at byte {} of {}".format(checkpoint.offset, logFile))
+
+    log = nmealog.NmeaLog(logFile)
+    if (checkpoint.lastFix is not None):
+        log.setLastFix(*checkpoint.lastFix)
+    index = nmealog.TimeIndex(logFile)
+    index.load()
+    log.load(processes, progress, cancel, checkpoint.offset, completeLines = True, index = index)
+    if (layerFileName is not None):
+        generateLayerFile(log, tidalData, layerFileName, ALL_TIMES[0], ALL_TIMES[1], tideOffsetValue, maxDepthValue, intervalValue, None, cancel, checkpoint)
+    if (trackFileName is not None):
+        generateTrackFile(log, trackFileName, ALL_TIMES[0], ALL_TIMES[1], None, cancel, checkpoint, trackTolerance)
+
+    checkpoint.offset = log.end
+    checkpoint.head = nmealog.headDigest(logFile, log.end)
+    lastFix = log.lastFix()
+    if (lastFix is not None):
+        checkpoint.lastFix = list(lastFix)
+    checkpoint.save()
+    return log
+
+
+
+def timeWindow(log, startTime, endTime):
+    # Time window in epoch seconds, from start and end times as hhmmss on the first and last day of
+    # the log, as in the user interface, or as complete ddmmyyhhmmss time stamps. A missing or empty
+    # time is the start or end of the log. ValueError for any other time.
+    if (log.firstTime is None):
+        return ALL_TIMES  # no fixes at all
+    startTime = (startTime or "").strip() or log.mintime
+    endTime = (endTime or "").strip() or log.maxtime
+    fromTimeStamp = nmeatime.parseTimeStamp(startTime) if (len(startTime) == 12) else nmeatime.toEpoch(log.mindate, startTime)
+    toTimeStamp = nmeatime.parseTimeStamp(endTime) if (len(endTime) == 12) else nmeatime.toEpoch(log.maxdate, endTime)
+    if (fromTimeStamp > toTimeStamp):
+        raise ValueError("start time {} is after end time {}".format(startTime, endTime))
+    return fromTimeStamp, toTimeStamp
+
+
+
+def addTideArguments(parser):
+    # Options of the tide correction that override tidalstations.conf
+    parser.add_argument("--tide-stations", type = int, metavar = "K", help = "weigh only the K nearest tidal stations; 0 for all (default: nearest in tidalstations.conf)")
+    parser.add_argument("--tide-radius", type = float, metavar = "NM", help = "ignore tidal stations further away; 0 for any distance (default: max_radius in tidalstations.conf)")
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Convert depth soundings from an NMEA0183 log file into GPX waypoints and a track.")
+    parser.add_argument("logfile", help = "NMEA0183 log file with RMC and DPT sentences; may be compressed (.gz, .bz2, .xz, .zst), or a quoted glob pattern of rotated segments such as 'nmea.log*'")
+    parser.add_argument("-l", "--layer", help = "output layer file with depth waypoints")
+    parser.add_argument("-t", "--track", help = "output track file")
+    parser.add_argument("--tiles", metavar = "DIR", help = "add the depth waypoints to a directory of tile files, one per --tile-size degrees, with an index")
+    parser.add_argument("--tile-size", type = float, default = gpxwriter.TILE_SIZE, help = "tile size in degrees (default %(default)s)")
+    parser.add_argument("--raster", metavar = "FILE", help = "output ESRI ASCII grid (.asc) of the tide-corrected depths, interpolated from all soundings")
+    parser.add_argument("--contours", metavar = "FILE", help = "output GPX file with depth contours as routes, from the same grid")
+    parser.add_argument("--contour-depths", default = ",".join("{:g}".format(depth) for depth in bathymetry.CONTOUR_DEPTHS), help = "depths of the contours in meters, comma separated (default %(default)s)")
+    parser.add_argument("--raster-cell", type = float, default = bathymetry.CELL_SIZE, help = "raster cell size in meters (default %(default)s)")
+    parser.add_argument("--raster-radius", type = float, default = bathymetry.RADIUS, help = "search radius in meters around a cell for its soundings (default %(default)s)")
+    parser.add_argument("--raster-method", choices = bathymetry.METHODS, default = "idw", help = "inverse distance weighted mean or nearest sounding (default %(default)s)")
+    parser.add_argument("--start", help = "start time (UTC), hhmmss on the first day or ddmmyyhhmmss; default: start of the log")
+    parser.add_argument("--end", help = "end time (UTC), hhmmss on the last day or ddmmyyhhmmss; default: end of the log")
+    parser.add_argument("--interval", type = float, default = DEFAULT_INTERVAL, help = "waypoint interval in meters (default %(default)s)")
+    parser.add_argument("--max-depth", type = float, default = DEFAULT_MAX_DEPTH, help = "deepest sounding to show, in meters (default %(default)s)")
+    parser.add_argument("--track-tolerance", type = float, default = DEFAULT_TRACK_TOLERANCE, help = "simplify the track so that every fix lies within this many meters of it; 0 keeps a point per {} m (default %(default)s)".format(TRACK_INTERVAL))
+    parser.add_argument("--tide-offset", type = float, default = 0, help = "tide offset in meters above MSL (default %(default)s)")
+    parser.add_argument("--no-tide", action = "store_true", help = "do not correct the depths for the tide")
+    addTideArguments(parser)
+    parser.add_argument("--processes", type = int, default = PARSE_PROCESSES, help = "processes for parsing large log files (default %(default)s)")
+    parser.add_argument("--incremental", action = "store_true", help = "only process what was appended to the log since the previous incremental run, adding to its layer and track files")
+    parser.add_argument("--checkpoint", help = "checkpoint file of incremental runs (default: the log file name + .checkpoint)")
+    parser.add_argument("--report", metavar = "FILE", help = "write a JSON run report with the time and counts per stage")
+    parser.add_argument("--profile", metavar = "FILE", help = "profile the run with cProfile into FILE; the top functions go into the report")
+    parser.add_argument("--trace-memory", action = "store_true", help = "trace memory allocations with tracemalloc; the top allocations go into the report")
+    args = parser.parse_args(argv)
+    if (args.layer is None and args.track is None and args.tiles is None and args.raster is None and args.contours is None):
+        parser.error("nothing to do; give --layer, --tiles, --track, --raster and/or --contours")
+    if (args.incremental and (args.raster is not None or args.contours is not None)):
+        parser.error("--raster and --contours do not apply to --incremental runs")
+    try:
+        contourDepths = [float(depth) for depth in args.contour_depths.split(",") if (depth.strip())]
+    except ValueError:
+        parser.error("--contour-depths takes depths in meters, comma separated")
+    if (args.tiles is not None and (args.layer is not None or args.incremental)):
+        parser.error("--tiles does not combine with --layer or --incremental")
+    if (args.incremental and (args.start is not None or args.end is not None)):
+        parser.error("--start and --end do not apply to --incremental runs")
+    if (args.incremental and (nmealog.compressed(args.logfile) or not os.path.isfile(args.logfile))):
+        parser.error("--incremental follows a single log file that is not compressed")
+    if (args.incremental and any(gpxwriter.compressed(f) for f in (args.layer, args.track) if (f is not None))):
+        # Appending needs the previous output intact up to its footer, which is checked in the raw bytes
+        parser.error("--incremental appends to the layer and track files, which cannot be compressed (.gz)")
+
+    started = time.time()
+    # The station files are found next to this script, so paths are made absolute before changing there
+    logFile, layerFile, trackFile = [os.path.abspath(f) if (f is not None) else None for f in (args.logfile, args.layer or args.tiles, args.track)]
+    reportFile, profileFile = [os.path.abspath(f) if (f is not None) else None for f in (args.report, args.profile)]
+    rasterFile, contourFile = [os.path.abspath(f) if (f is not None) else None for f in (args.raster, args.contours)]
+    if (reportFile is not None or profileFile is not None or args.trace_memory):
+        instrumentation.start("depthwaypoints", reportFile, profileFile, args.trace_memory)
+    tileSize = args.tile_size if (args.tiles is not None) else None
+    checkpointFile = os.path.abspath(args.checkpoint) if (args.checkpoint is not None) else logFile + ".checkpoint"
+    tidalData = None
+    if ((layerFile is not None or rasterFile is not None or contourFile is not None) and not args.no_tide):
+        os.chdir(os.path.dirname(os.path.realpath(__file__)))
+        tidalData = loadTidalData(args.tide_stations, args.tide_radius)
+
+    if (args.incremental):
+        log = generateIncremental(logFile, checkpointFile, tidalData, layerFile, trackFile, args.tide_offset, args.max_depth, args.interval, args.processes, trackTolerance = args.track_tolerance)
+        print ("Lines={}, RMC={}, DPT={}".format(log.lines, log.rmc, log.dpt))
+    else:
+        log = nmealog.NmeaLog(logFile)
+        log.open(args.processes)
+        print ("Lines={}, RMC={}, DPT={}, depth={} - {}".format(log.lines, log.rmc, log.dpt, round(log.mindepth, 1), round(log.maxdepth, 1)))
+        try:
+            fromTimeStamp, toTimeStamp = timeWindow(log, args.start, args.end)
+        except ValueError as e:
+            parser.error(str(e))
+        log = log.window(fromTimeStamp, toTimeStamp, args.processes)
+        if (layerFile is not None):
+            try:
+                generateLayerFile(log, tidalData, layerFile, fromTimeStamp, toTimeStamp, args.tide_offset, args.max_depth, args.interval, tileSize = tileSize)
+            except ValueError as e:
+                if (tileSize is None):
+                    raise
+                print ("*** " + str(e))  # tiles of other settings
+                return 1
+        if (trackFile is not None):
+            generateTrackFile(log, trackFile, fromTimeStamp, toTimeStamp, tolerance = args.track_tolerance)
+        if (rasterFile is not None or contourFile is not None):
+            bathymetry.generateRaster(log, tidalData, rasterFile, fromTimeStamp, toTimeStamp, args.raster_cell, args.raster_radius, args.raster_method,
+                contourFile, contourDepths)
+    instrumentation.finish(log = logFile, layer = layerFile, track = trackFile)
+    print ("Done in {:.1f} s".format(time.time() - started))
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
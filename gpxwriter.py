@@ -0,0 +1,306 @@
+import gzip
+import json
+import math
+import os
+
+import instrumentation
+import nmeatime
+
+# Writer for the GPX files of the depth and track tools.
+#
+# Points are formatted with %-templates (faster than str.format), collected and written to the
+# file in large blocks. A new file is written under a temporary name and renamed into place when
+# it is closed, so a crash or cancel never leaves a truncated file where OpenCPN looks for it.
+# A file name ending in .gz is written gzip-compressed. GpxTiles spreads waypoints over a grid
+# of tile files instead, so a plotter only needs to load the tiles of the area being sailed.
+
+WRITE_BUFFER = 1024 * 1024  # bytes
+BLOCK_LINES = 8192          # formatted points collected before they are written in one go
+GZIP_LEVEL = 6
+TILE_SIZE = 0.1             # degrees of latitude and longitude per tile
+TILE_INDEX = "index.json"
+
+GPX_HEADER = '<?xml version="1.0" encoding="UTF-8" ?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">\n'
+LAYER_FOOTER = '</gpx>'
+TRACK_HEADER = '<trk><name>%s</name><trkseg>'
+TRACK_FOOTER = '</trkseg></trk></gpx>'
+WAYPOINT = '  <wpt lat="%.6f" lon="%.6f"><sym>%s</sym><extensions><opencpn:scale_min_max UseScale="true" ScaleMin="%d" /></extensions></wpt>\n'
+TRACKPOINT = '  <trkpt lat="%.6f" lon="%.6f"><time>%s</time></trkpt>\n'
+ROUTE_HEADER = '<rte><name>%s</name>\n'
+ROUTEPOINT = '  <rtept lat="%.6f" lon="%.6f" />\n'
+ROUTE_FOOTER = '</rte>\n'
+
+
+
+def temporaryFile(filename):
+    return filename + ".part"
+
+
+
+def compressed(filename):
+    return filename.endswith(".gz")
+
+
+
+def intact(filename, size, footer):
+    # True if the (uncompressed) GPX file is still size bytes long and ends with the footer
+    try:
+        with open(filename, "rb") as f:
+            if (f.seek(0, os.SEEK_END) != size or size < len(footer)):
+                return False
+            f.seek(size - len(footer))
+            return f.read() == footer.encode()
+    except OSError:
+        return False
+
+
+
+class GpxWriter(object):
+
+    # GpxWriter(filename, header, footer) writes a new file. With extend, the points are added to
+    # the existing file: its content up to the footer is copied into the new file first. With
+    # appendAt, the points are added to the existing file of that many bytes in place, without
+    # rewriting it; an abort then restores the file as it was. Use as a context manager, or call
+    # close() when done and abort() on failure.
+
+    def __init__(self, filename, header, footer, extend=False, appendAt=None):
+        self.filename = filename
+        self.footer = footer
+        self.appendAt = appendAt
+        self.pending = []
+        if (appendAt is not None):
+            with open(filename, "r+b") as f:
+                f.truncate(appendAt - len(footer))
+            self.f = open(filename, "a", buffering = WRITE_BUFFER)
+            return
+        self.f = self.open()
+        if (not (extend and os.path.exists(filename) and self.copyBody())):
+            self.f.close()
+            self.f = self.open()
+            self.f.write(header)
+
+
+
+    def open(self):
+        if (compressed(self.filename)):
+            return gzip.open(temporaryFile(self.filename), "wt", compresslevel = GZIP_LEVEL)
+        return open(temporaryFile(self.filename), "w", buffering = WRITE_BUFFER)
+
+
+
+    def copyBody(self):
+        # Copy the existing file up to its footer; False if it does not end with the footer
+        n = len(self.footer)
+        tail = ""
+        try:
+            with (gzip.open if compressed(self.filename) else open)(self.filename, "rt") as old:
+                while True:
+                    chunk = old.read(WRITE_BUFFER)
+                    if (not chunk):
+                        break
+                    chunk = tail + chunk
+                    self.f.write(chunk[:-n])
+                    tail = chunk[-n:]
+        except (OSError, EOFError) as e:
+            print ("*** Could not read {}: {}".format(self.filename, str(e)))
+            return False
+        return tail == self.footer
+
+
+
+    def write(self, text):
+        self.pending.append(text)
+        if (len(self.pending) >= BLOCK_LINES):
+            self.flush()
+
+
+
+    def writePoint(self, lat, lon, text):
+        # Same as write(); GpxTiles uses the position to pick the tile
+        self.write(text)
+
+
+
+    def flush(self):
+        with instrumentation.stage("file write"):
+            self.f.write("".join(self.pending))
+        self.pending = []
+
+
+
+    def finish(self):
+        # Complete the file under its temporary name, without renaming it into place yet
+        self.flush()
+        self.f.write(self.footer)
+        self.f.close()
+
+
+
+    def close(self):
+        self.finish()
+        if (self.appendAt is None):
+            os.replace(temporaryFile(self.filename), self.filename)
+
+
+
+    def abort(self):
+        self.pending = []
+        self.f.close()
+        if (self.appendAt is not None):
+            with open(self.filename, "r+b") as f:
+                f.truncate(self.appendAt - len(self.footer))
+                f.seek(self.appendAt - len(self.footer))
+                f.write(self.footer.encode())
+        elif (os.path.exists(temporaryFile(self.filename))):
+            os.remove(temporaryFile(self.filename))
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.close()
+        else:
+            self.abort()
+
+
+
+
+class GpxTiles(object):
+
+    # Writes waypoints into a grid of tile files of tileSize degrees in a directory, with an index
+    # file listing every tile's bounds and number of waypoints, and the trips added: the log file
+    # and time window of each, so a log that grew only adds its new times. Adding a trip extends
+    # only the tiles it touches; each of those is rewritten through a GpxWriter, one at a time, and
+    # the finished tiles replace the old ones together, so a failure leaves all of them as they were.
+    # The waypoints of the trips are collected per tile until close(). The index also keeps the
+    # scale level cells the waypoints take (see levelofdetail.py). All trips in a directory have the
+    # same settings (e.g. interval and maximum depth), so densities do not mix.
+
+    def __init__(self, directory, header, footer, tileSize=TILE_SIZE, settings=None):
+        self.directory = directory
+        self.header = header
+        self.footer = footer
+        self.tileSize = tileSize
+        self.tiles = {}  # (row, column): formatted waypoints of these trips
+        self.index = {"tileSize": tileSize, "tiles": {}, "trips": []}
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+        try:
+            with open(self.indexFile()) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+        if (self.index["tileSize"] != tileSize):
+            raise ValueError("tiles in {} are {} degrees, not {}".format(directory, self.index["tileSize"], tileSize))
+        if (settings is not None):
+            # Indexes written before the settings were kept have them in every trip
+            previous = self.index.get("settings") or next(({k: t.get(k) for k in settings} for t in self.index["trips"]), None)
+            if (previous is not None and previous != settings):
+                raise ValueError("tiles in {} have {}, not {}".format(directory, previous, settings))
+            self.index["settings"] = dict(settings)
+        self.trips = []
+        self.trip = None
+        self.tripTiles = None
+
+
+
+    def indexFile(self):
+        return os.path.join(self.directory, TILE_INDEX)
+
+
+
+    def uncovered(self, log, fromTimeStamp, toTimeStamp):
+        # The parts of the time window of the log file that no trip added before, as [(from, to)]
+        covered = [(t["from"], t["to"]) for t in self.index["trips"] if (t["log"] == log)]
+        return nmeatime.uncovered(fromTimeStamp, toTimeStamp, covered)
+
+
+
+    def addTrip(self, trip):
+        # Register the trip (a dict with the log file, and the time window as "from" and "to") that
+        # the following waypoints belong to
+        self.trip = dict(trip, waypoints=0, tiles=0)
+        self.tripTiles = set()
+        self.trips.append(self.trip)
+
+
+
+    def tileName(self, row, column):
+        south = row * self.tileSize
+        west = column * self.tileSize
+        return "depths_{}{:07.3f}_{}{:07.3f}.gpx".format("N" if south >= 0 else "S", abs(south), "E" if west >= 0 else "W", abs(west))
+
+
+
+    def writePoint(self, lat, lon, text):
+        key = (math.floor(lat / self.tileSize), math.floor(lon / self.tileSize))
+        points = self.tiles.get(key)
+        if (points is None):
+            points = self.tiles[key] = []
+        points.append(text)
+        if (self.trip is not None):
+            self.trip["waypoints"] += 1
+            self.tripTiles.add(key)
+            self.trip["tiles"] = len(self.tripTiles)
+
+
+
+    def close(self):
+        finished = []  # tile files written under their temporary name
+        try:
+            for (row, column), points in self.tiles.items():
+                name = self.tileName(row, column)
+                writer = GpxWriter(os.path.join(self.directory, name), self.header, self.footer, extend = True)
+                try:
+                    for text in points:
+                        writer.write(text)
+                    writer.finish()
+                except BaseException:
+                    writer.abort()
+                    raise
+                finished.append(writer.filename)
+        except BaseException:
+            for filename in finished:
+                os.remove(temporaryFile(filename))
+            raise
+        for filename in finished:
+            os.replace(temporaryFile(filename), filename)
+
+        waypoints = 0
+        for (row, column), points in self.tiles.items():
+            name = self.tileName(row, column)
+            tile = self.index["tiles"].setdefault(name, {"south": row * self.tileSize, "west": column * self.tileSize,
+                "north": (row + 1) * self.tileSize, "east": (column + 1) * self.tileSize, "waypoints": 0})
+            tile["waypoints"] += len(points)
+            waypoints += len(points)
+        self.index["trips"].extend(self.trips)
+        with open(self.indexFile() + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(self.indexFile() + ".tmp", self.indexFile())
+        print ("{} waypoints in {} tiles of {}".format(waypoints, len(self.tiles), self.directory))
+        self.tiles = {}
+        self.trips = []
+
+
+
+    def abort(self):
+        self.tiles = {}
+        self.trips = []
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.close()
+        else:
+            self.abort()
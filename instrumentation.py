@@ -0,0 +1,180 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not on Windows; no peak RSS then
+
+# Stage timers and counters for the processing pipeline, and a JSON run report.
+#
+#     with instrumentation.stage("tide lookup"):
+#         ...
+#     instrumentation.count("waypoints", n)
+#
+# Until start() is called, stage() returns one shared do-nothing context manager and count()
+# returns right away, so the calls cost next to nothing; stages are timed per block of work,
+# not per line. Stage times include the time of the stages nested in them. start() can also switch
+# on cProfile and tracemalloc; finish() writes the report, with the top functions and allocations.
+# Programs without options (process_depth.py, nmea2gpx.py) are instrumented with environment
+# variables, see startFromEnvironment().
+
+REPORT_VARIABLE = "DEPTH_REPORT"        # JSON run report file
+PROFILE_VARIABLE = "DEPTH_PROFILE"      # cProfile statistics file, for pstats or snakeviz
+MEMORY_VARIABLE = "DEPTH_TRACEMALLOC"   # any value but 0 traces memory allocations
+TOP_ENTRIES = 20                        # functions and allocation sites in the report
+
+enabled = False
+stages = {}     # name: [seconds, calls]
+counters = {}   # name: total
+run = None
+
+
+
+class Stage(object):
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        entry = stages.get(self.name)
+        if (entry is None):
+            entry = stages[self.name] = [0.0, 0]
+        entry[0] += time.perf_counter() - self.started
+        entry[1] += 1
+        return False
+
+
+
+class NoStage(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+NO_STAGE = NoStage()
+
+
+
+def stage(name):
+    if (not enabled):
+        return NO_STAGE
+    return Stage(name)
+
+
+
+def count(name, n=1):
+    if (enabled):
+        counters[name] = counters.get(name, 0) + n
+
+
+
+class Run(object):
+
+    # One instrumented run of a program, from start() to finish()
+
+    def __init__(self, program, reportFile, profileFile, traceMemory):
+        self.program = program
+        self.reportFile = reportFile
+        self.profileFile = profileFile
+        self.traceMemory = traceMemory
+        self.started = time.time()
+        self.cpuStarted = time.process_time()
+        self.profiler = None
+        if (traceMemory):
+            tracemalloc.start()
+        if (profileFile is not None):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+
+
+    def report(self):
+        report = {
+            "program": self.program,
+            "argv": sys.argv,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "seconds": time.time() - self.started,
+            "cpuSeconds": time.process_time() - self.cpuStarted,
+            "peakRssMB": peakRss(),
+            "stages": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in sorted(stages.items())},
+            "counters": dict(sorted(counters.items())),
+        }
+        if (self.profiler is not None):
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profileFile)
+            stats = pstats.Stats(self.profiler)
+            top = sorted(stats.stats.items(), key = lambda item: item[1][3], reverse = True)[:TOP_ENTRIES]
+            report["profile"] = {"file": self.profileFile, "functions": [{"function": "{}:{}({})".format(*where), "calls": calls,
+                "seconds": tottime, "cumulativeSeconds": cumtime} for where, (primitive, calls, tottime, cumtime, callers) in top]}
+        if (self.traceMemory):
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ENTRIES]
+            tracemalloc.stop()
+            report["memory"] = {"currentMB": current / 1024 / 1024, "peakMB": peak / 1024 / 1024, "allocations": [{"where": "{}:{}".format(s.traceback[0].filename, s.traceback[0].lineno),
+                "MB": s.size / 1024 / 1024, "blocks": s.count} for s in top]}
+        return report
+
+
+
+def start(program, reportFile=None, profileFile=None, traceMemory=False):
+    # Switch the timers and counters on, and cProfile and tracemalloc if asked for
+    global enabled, run
+    stages.clear()
+    counters.clear()
+    run = Run(program, reportFile, profileFile, traceMemory)
+    enabled = True
+
+
+
+def startFromEnvironment(program):
+    # start() as set by the DEPTH_* environment variables; nothing if none of them is set
+    # The file names are made absolute, as the programs change directories
+    reportFile = os.environ.get(REPORT_VARIABLE) or None
+    profileFile = os.environ.get(PROFILE_VARIABLE) or None
+    reportFile, profileFile = [os.path.abspath(f) if (f is not None) else None for f in (reportFile, profileFile)]
+    traceMemory = os.environ.get(MEMORY_VARIABLE, "0") not in ("", "0")
+    if (reportFile is not None or profileFile is not None or traceMemory):
+        start(program, reportFile, profileFile, traceMemory)
+
+
+
+def finish(**extra):
+    # Stop, and write the report (with the extra items) if a report file was given; returns the report
+    global enabled, run
+    if (run is None):
+        return None
+    report = run.report()
+    report.update(extra)
+    if (run.reportFile is not None):
+        with open(run.reportFile + ".tmp", "w") as f:
+            json.dump(report, f, indent=1)
+        os.replace(run.reportFile + ".tmp", run.reportFile)
+        print ("Run report written to {}".format(run.reportFile))
+    enabled = False
+    run = None
+    return report
+
+
+
+def peakRss():
+    # Peak resident set size of this process in MB; None where it cannot be measured
+    if (resource is None):
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if (sys.platform == "darwin") else rss / 1024
@@ -0,0 +1,62 @@
+import numpy as np
+
+# Spatial level of detail for depth waypoints: which ScaleMin every waypoint gets.
+#
+# OpenCPN hides a waypoint when the chart is zoomed out beyond its ScaleMin. For every level,
+# from the coarsest scale down, the chart is divided into cells of about SCREEN_CELL meters on
+# screen (512 m on the ground at 1:51200), and the shallowest waypoints of every cell, up to
+# PER_CELL, are shown from that scale on. Waypoints shown at a coarser scale count towards the
+# cells of the finer ones. Whatever is left is shown at the finest scale only, so no waypoint is
+# dropped. The density on screen is then the same at every scale, however slowly the boat went
+# or however often the same water was sailed.
+#
+# Waypoints added to those of earlier runs (an incremental run, or tiles) are spread against the
+# cells those already fill, which their run passes in as taken, rather than over the new area
+# alone; otherwise every run would fill the coarse cells again. The earlier waypoints keep their
+# ScaleMin, so a deeper one shown before is not swapped for a shallower new one in the same cell as
+# a single run over all the data would.
+#
+# Every level sorts the waypoints once by cell, so the whole assignment is O(n log n).
+
+LEVELS = [51200, 25600, 12800, 6400, 3200, 1600]  # ScaleMin values, coarse to fine
+SCREEN_CELL = 0.01  # meters on screen per cell side
+PER_CELL = 1        # waypoints per cell and level
+METERS_PER_DEGREE = 60 * 1852
+
+
+
+def scaleLevels(lats, lons, depths, perCell=PER_CELL, levels=LEVELS, screenCell=SCREEN_CELL, taken=None):
+    # Returns the ScaleMin of every waypoint as an int64 array. Shallower depths are preferred;
+    # between equal depths, the earlier waypoint. taken, if given, maps str(level) to the cells of
+    # the earlier waypoints shown at that level, one entry per waypoint; the cells of these waypoints
+    # are added to it.
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    depths = np.asarray(depths, dtype=np.float64)
+    n = len(lats)
+    scales = np.full(n, levels[-1], dtype=np.int64)
+    if (n == 0):
+        return scales
+    y = lats * METERS_PER_DEGREE
+    x = lons * METERS_PER_DEGREE * np.cos(lats / 180 * np.pi)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), depths))] = np.arange(n)
+    shown = np.zeros(n, dtype=bool)
+    for level in levels[:-1]:
+        size = level * screenCell
+        cells = np.floor(y / size).astype(np.int64) * 2**32 + np.floor(x / size).astype(np.int64)
+        # Per cell: the waypoints shown already first, then the others by rank
+        order = np.lexsort((np.where(shown, rank - n, rank), cells))
+        sortedCells = cells[order]
+        starts = np.flatnonzero(np.r_[True, sortedCells[1:] != sortedCells[:-1]])
+        position = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+        room = perCell
+        if (taken is not None):
+            before = np.asarray(taken.get(str(level), []), dtype=np.int64)
+            room = perCell - (np.searchsorted(before, sortedCells, side='right') - np.searchsorted(before, sortedCells, side='left'))
+        chosen = order[(position < room) & ~shown[order]]
+        scales[chosen] = level
+        shown[chosen] = True
+        if (taken is not None):
+            taken[str(level)] = np.sort(np.r_[before, cells[shown]]).tolist()
+    return scales
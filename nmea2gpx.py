@@ -1,14 +1,29 @@
 import math
-import re    ## regular expressions
 import glob
+import hashlib
+import json
+import multiprocessing
 import shutil
 import os
+import time
+
+import gpxwriter
+import instrumentation
+import nmealog
+import nmeatime
+import simplify
 
-GPX_HEADER='<?xml version="1.0" encoding="UTF-8" ?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">\n'
 TRACK_INTERVAL = 30 # meters
+TRACK_TOLERANCE = 0 # meters; above 0 the tracks are simplified to that tolerance instead of thinned by TRACK_INTERVAL
+GPX_EXTENSION = ".gpx" # ".gpx.gz" for compressed track files
+PARSE_PROCESSES = os.cpu_count() or 1 # large log files are parsed in parallel
 SOURCE_DIR = "nmea/";
 TARGET_DIR = "gpx/";
 TRASH_DIR = "nmea/old/";
+DAYS_DIR = TARGET_DIR + "days/"; # trackpoints per day and log file, from which the day files are built
+MANIFEST = TARGET_DIR + "manifest.json"; # content hashes of the log files converted
+BATCH_PROCESSES = os.cpu_count() or 1 # log files converted in parallel
+HASH_BLOCK = 1024 * 1024 # bytes
 
 def checkDir(directory):
     if not (os.path.isdir(directory)):
@@ -20,96 +35,180 @@ checkDir(TARGET_DIR);
 checkDir(TRASH_DIR);
 
 
-def convertLatLon (latLon):
-    if (latLon[4] == "."):
-        latLon = "" + "0" + latLon
-    val = float(latLon[0:3]) + float(latLon[3:])/60
-    return val
-        
+def fileDigest(filename):
+    # SHA-256 of the file content, so a log file is recognized under any name
+    digest = hashlib.sha256();
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK);
+            if (not block):
+                break;
+            digest.update(block);
+    return digest.hexdigest();
+
+
+def loadManifest():
+    try:
+        with open(MANIFEST) as f:
+            return json.load(f);
+    except FileNotFoundError:
+        return {};
+
+
+def saveManifest(manifest):
+    with open(MANIFEST + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True);
+    os.replace(MANIFEST + ".tmp", MANIFEST);
+
+
+def segmentFileName(day, firstTimeStamp, digest):
+    # The segments of a day sort by the time (epoch seconds) of their first trackpoint
+    return DAYS_DIR + day + os.sep + "{0}-{1}.trk".format(nmeatime.formatTimeOfDay(firstTimeStamp), digest[:16]);
 
-def formatTimestamp(timeStamp):
-    # format 130223060009 into 2023-02-13T06:00:09Z
+
+def convertFile (job):
+    # Convert one log file; runs in a worker process in batch mode. A log file that cannot be read
+    # (e.g. a truncated .gz) gives (file name, digest, None, error message), so the batch carries on.
     try:
-       return "20{0}-{1}-{2}T{3}:{4}:{5}Z".format(timeStamp[4:6], timeStamp[2:4], timeStamp[0:2], timeStamp[6:8], timeStamp[8:10], timeStamp[10:12])
+        return convertLog(job);
     except Exception as e:
-       print ("exception formatting timeStamp " + timeStamp, str(e));
-            
-            
-def generateTrackFile (filename, fromTimeStamp, toTimeStamp):
+        return job[0], job[1], None, "{0}: {1}".format(type(e).__name__, str(e));
+
+
+def convertLog (job):
+    # Decimate the fixes of one log file and write the trackpoints of every day it covers into a
+    # segment file of that day. Returns the file name, its digest, the number of RMC sentences
+    # and {day: [segment file, trackpoints]}.
+    filename, digest, fromTimeStamp, toTimeStamp, processes = job;
     rmc = 0
-    trackpoints = 0
     lastlat = 0
     lastlon = 0
-    n = 0  # line counter for verbose exception handling 
     print ("Processing NMEA file {0}".format(filename));
-    
-    f = open("x", "w");
-    f.close();
-    
-    timeStamp = "";
-    lastDate = "";
-    
-    for lines in open(filename, 'r'):
-        n += 1;
-        line = lines.strip().split(',');
-        # print ("lines", lines);
-        
-        try:
-            if (re.match(r"\$[A-Z]{2}RMC", line[0])):
-                curdate = line[9];
-                curtime = line[1][:6];
-                timeStamp = "" + curdate + curtime;
-                
-                formattedTimeStamp = formatTimestamp(timeStamp);
-
-                
-                if (timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
-                    rmc += 1;
-                    curlat = convertLatLon(line[3]);
-                    curlon = convertLatLon(line[5]);
-
-                    # Calculate distance in meters to previously generated waypoint
-                    distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852;
-                    
-                    if (distance > 10000):
-                        lastlat = curlat; lastlon = curlon;   #distance = 0; to deal with initial measurement
-                        
-                    if (distance > float (TRACK_INTERVAL)):
-                        if (curdate != lastDate and not f.closed):
-                            f.close();
-                            print ("File created with {0} trackpoints out of {1} RMC sentences".format(trackpoints, rmc))
-                            rmc = 0;
-                            trackpoints = 0;
-                        if (f.closed):
-                            trackName = formattedTimeStamp[0:10];
-                            trackfilename = TARGET_DIR + os.sep + trackName + ".gpx";
-                            f = open(trackfilename, "w");
-                            f.write(GPX_HEADER);
-                            f.write("<trk><name>" + trackName + "</name><trkseg>");
-                            print ("Generating track file {0}".format(trackfilename));
-                        
-                        gpx = '  <trkpt lat="{0:.6f}" lon="{1:.6f}"><time>{2}</time></trkpt>' \
-                            .format(curlat, curlon, formattedTimeStamp);
-                        ### print (gpx)
-                        f.write(gpx + "\n");
-                        trackpoints += 1;
-                        
-                        lastlat = curlat;
-                        lastlon = curlon;
-                lastDate = curdate;
-        except Exception as e:
-            print ("exception processing line {0} of {1}: {2} error {3}".format(str(n), filename, lines, str(e)));
-        if (f.closed):
-            exit(1);
-
-    f.write ('</trkseg></trk></gpx>')
-    f.close(); 
-    print ("File created with {0} trackpoints out of {1} RMC sentences".format(trackpoints, rmc))
+
+    log = nmealog.NmeaLog(filename);
+    log.load(processes);
+
+    days = {};   # day: (first timeStamp, trackpoints)
+    trackpoint = gpxwriter.TRACKPOINT;
+    formatTime = nmeatime.formatTime;
+    simplifier = simplify.Simplifier(TRACK_TOLERANCE);   # passes every point on with a tolerance of 0
+
+    def addTrackpoints(points):
+        for timeStamp, curlat, curlon in points:
+            formattedTimeStamp = formatTime(timeStamp);
+            day = formattedTimeStamp[0:10];
+            if (day not in days):
+                days[day] = (timeStamp, []);
+            days[day][1].append(trackpoint % (curlat, curlon, formattedTimeStamp));
+
+    for timeStamp, curlat, curlon in log.fixes(fromTimeStamp, toTimeStamp):
+        rmc += 1;
+
+        # Calculate distance in meters to previously generated waypoint
+        distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852;
+
+        if (distance > 10000):
+            lastlat = curlat; lastlon = curlon;   #distance = 0; to deal with initial measurement
+
+        if (distance > float (TRACK_INTERVAL) or TRACK_TOLERANCE > 0):
+            addTrackpoints(simplifier.add(curlat, curlon, (timeStamp, curlat, curlon)));
+
+            lastlat = curlat;
+            lastlon = curlon;
+
+    addTrackpoints(simplifier.flush());
+
+    segments = {};
+    for day, (firstTimeStamp, trackpoints) in days.items():
+        segment = segmentFileName(day, firstTimeStamp, digest);
+        os.makedirs(os.path.dirname(segment), exist_ok = True);
+        with open(segment + ".part", "w") as f:
+            f.write("".join(trackpoints));
+        os.replace(segment + ".part", segment);
+        segments[day] = [segment, len(trackpoints)];
+    return filename, digest, rmc, segments;
+
+
+def buildDay (day):
+    # (Re)write the track file of the day from all its segments, in time order; returns the number of trackpoints
+    trackfilename = TARGET_DIR + os.sep + day + GPX_EXTENSION;
+    trackpoints = 0;
+    with gpxwriter.GpxWriter(trackfilename, gpxwriter.GPX_HEADER + gpxwriter.TRACK_HEADER % day, gpxwriter.TRACK_FOOTER) as writer:
+        for segment in sorted(glob.glob(DAYS_DIR + day + os.sep + "*.trk")):
+            with open(segment) as f:
+                text = f.read();
+            writer.write(text);
+            trackpoints += text.count("\n");
+    print ("Track file {0} created with {1} trackpoints".format(trackfilename, trackpoints));
+    return trackpoints;
+
+
+def finishFile (manifest, result):
+    # Record a converted log file in the manifest and move it out of the way; its days are built already
+    filename, digest, rmc, segments = result;
+    trackpoints = sum(segments[day][1] for day in segments);
+    print ("{0}: {1} trackpoints out of {2} RMC sentences".format(filename, trackpoints, rmc));
+    instrumentation.count("trackpoints", trackpoints);
+    manifest[digest] = {"file": os.path.basename(filename), "converted": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "rmc": rmc, "days": {day: trackpoints for day, (segment, trackpoints) in segments.items()}};
+    saveManifest(manifest);
     shutil.move(filename, TRASH_DIR + os.sep + os.path.basename(filename));
 
+
+def generateTrackFiles (filenames, fromTimeStamp, toTimeStamp, processes=BATCH_PROCESSES):
+    # Convert the log files, several at a time in a process pool. A day covered by several log files
+    # gets the trackpoints of all of them, and is built once when all files are converted; log files
+    # converted before, or earlier in the same batch (by content), are skipped.
+    manifest = loadManifest();
+    jobs = [];
+    queued = {};   # digest: file name
+    for filename in filenames:
+        digest = fileDigest(filename);
+        if (digest in manifest or digest in queued):
+            if (digest in manifest):
+                print ("{0} was converted before as {1}; skipped".format(filename, manifest[digest]["file"]));
+            else:
+                print ("{0} has the same content as {1}; skipped".format(filename, queued[digest]));
+            instrumentation.count("skipped log files");
+            shutil.move(filename, TRASH_DIR + os.sep + os.path.basename(filename));
+        else:
+            queued[digest] = os.path.basename(filename);
+            jobs.append((filename, digest, fromTimeStamp, toTimeStamp, 1));
+
+    results = [];
+    if (processes <= 1 or len(jobs) <= 1):
+        for filename, digest, fromTimeStamp, toTimeStamp, unused in jobs:
+            with instrumentation.stage("log file"):
+                results.append(convertFile((filename, digest, fromTimeStamp, toTimeStamp, PARSE_PROCESSES)));
+    else:
+        # Large files are not parsed in parallel within the workers; the pool is busy enough
+        with multiprocessing.Pool(min(processes, len(jobs))) as pool, instrumentation.stage("log files"):
+            results = list(pool.imap_unordered(convertFile, jobs));
+
+    # A log file that failed stays where it is, out of the manifest, to be tried again next time
+    for filename, digest, rmc, error in results:
+        if (rmc is None):
+            print ("*** Could not convert {0}: {1}".format(filename, error));
+            instrumentation.count("failed log files");
+    results = [result for result in results if (result[2] is not None)];
+
+    days = sorted(set(day for result in results for day in result[3]));
+    with instrumentation.stage("days"):
+        for day in days:
+            buildDay(day);
+    instrumentation.count("track files", len(days));
+    for result in results:
+        finishFile(manifest, result);
+    return len(jobs);
+
+
+def generateTrackFile (filename, fromTimeStamp, toTimeStamp):
+    generateTrackFiles([filename], fromTimeStamp, toTimeStamp, 1);
+
 if __name__ == '__main__':
-    for fname in glob.glob(SOURCE_DIR + os.sep + "*.*"):
-        generateTrackFile (fname, "000000", "999999")
-    files = glob.glob(TARGET_DIR + os.sep + "*.gpx");
+    multiprocessing.freeze_support();
+    instrumentation.startFromEnvironment("nmea2gpx");   # DEPTH_REPORT, DEPTH_PROFILE, DEPTH_TRACEMALLOC
+    generateTrackFiles(sorted(glob.glob(SOURCE_DIR + os.sep + "*.*")), nmealog.MIN_TIME, nmealog.MAX_TIME);
+    files = glob.glob(TARGET_DIR + os.sep + "*" + GPX_EXTENSION);
+    instrumentation.finish(files = files);
     print ('{ "files": ' + str(files).replace("'", '"') + '}');
-    
@@ -0,0 +1,131 @@
+# Decoder for the NMEA0183 sentences used by the depth and track tools.
+# Sentences are dispatched on their type (the three characters after the talker ID,
+# e.g. "$GPRMC" and "$GNRMC" both dispatch to "RMC"), so no regular expression runs
+# per line. Only lines of a registered type are checksummed and split, and then only
+# as far as the fields the decoder needs.
+
+
+
+def convertLatLon (latLon):
+    # ddmm.mmmm or dddmm.mmmm into degrees
+    p = latLon.index(".") - 2
+    val = float(latLon[0:p]) + float(latLon[p:])/60
+    return val
+
+
+
+def checksum(body):
+    # XOR of all characters between "$" and "*", folded in a few big-integer operations
+    # instead of a Python loop over the characters (up to 256 characters; NMEA0183 allows 82)
+    x = int.from_bytes(body.encode('latin-1'), 'little')
+    x ^= x >> 1024; x ^= x >> 512; x ^= x >> 256; x ^= x >> 128; x ^= x >> 64; x ^= x >> 32; x ^= x >> 16; x ^= x >> 8
+    return x & 0xFF
+
+
+
+def decodePosition(lat, ns, lon, ew):
+    # Returns (lat, lon) in degrees, or (None, None) if the sentence carries no position
+    if (lat == "" or lon == ""):
+        return None, None
+    lat = convertLatLon(lat)
+    lon = convertLatLon(lon)
+    if (ns == "S"): lat = -lat
+    if (ew == "W"): lon = -lon
+    return lat, lon
+
+
+
+def decodeFloat(value):
+    if (value == ""):
+        return None
+    return float(value)
+
+
+
+def decodeRMC(fields):
+    # (hhmmss, ddmmyy, lat, lon); lat and lon are None when there is no fix
+    lat, lon = decodePosition(fields[3], fields[4], fields[5], fields[6])
+    return fields[1][:6], fields[9], lat, lon
+
+
+
+def decodeDPT(fields):
+    # depth below transducer in metres
+    return float(fields[1])
+
+
+
+def decodeDBT(fields):
+    # depth below transducer in metres
+    return float(fields[3])
+
+
+
+def decodeDBS(fields):
+    # depth below surface in metres
+    return float(fields[3])
+
+
+
+def decodeGGA(fields):
+    # (hhmmss, lat, lon, fix quality); lat and lon are None when there is no fix
+    lat, lon = decodePosition(fields[2], fields[3], fields[4], fields[5])
+    return fields[1][:6], lat, lon, int(fields[6] or 0)
+
+
+
+def decodeVTG(fields):
+    # (course over ground true, speed over ground in knots); either may be None
+    return decodeFloat(fields[1]), decodeFloat(fields[5])
+
+
+
+# Sentence type: (number of leading fields needed, decoder)
+DECODERS = {
+    'RMC': (10, decodeRMC),
+    'DPT': (2, decodeDPT),
+    'DBT': (4, decodeDBT),
+    'DBS': (4, decodeDBS),
+    'GGA': (7, decodeGGA),
+    'VTG': (6, decodeVTG),
+}
+
+
+
+def decoders(*sentenceTypes):
+    # Subset of DECODERS for the given sentence types, e.g. decoders('RMC', 'DPT')
+    return {t: DECODERS[t] for t in sentenceTypes}
+
+
+
+HEXDIGITS = ["{:02X}".format(x) for x in range(256)]
+
+
+
+def decode(line, decoders=DECODERS):
+    # Returns (sentenceType, value) for a sentence of one of the given types, or None for
+    # any other line. Raises ValueError for a sentence of a wanted type that is corrupt.
+    if (line[0:1] != "$" or line[6:7] != ","):
+        return None
+    sentenceType = line[3:6]
+    decoder = decoders.get(sentenceType)
+    if (decoder is None):
+        return None
+
+    star = line.find("*", 7)
+    if (star >= 0):
+        body = line[1:star]
+        expected = line[star+1:star+3]
+        actual = HEXDIGITS[checksum(body)]
+        if (actual != expected and actual != expected.upper()):
+            raise ValueError("checksum mismatch")
+    else:
+        body = line[1:].rstrip()  # no checksum transmitted
+
+    nfields, decodeFields = decoder
+    fields = body.split(",", nfields)
+    try:
+        value = decodeFields(fields)
+    except IndexError:
+        raise ValueError("{} sentence has too few fields".format(sentenceType))
+    return sentenceType, value
@@ -0,0 +1,687 @@
+import array
+import bz2
+import glob
+import gzip
+import hashlib
+import json
+import lzma
+import math
+import mmap
+import multiprocessing
+import os
+import queue
+import threading
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # .zst logs cannot be read then
+
+import instrumentation
+import nmeadecoder
+import nmeatime
+
+LOG_DECODERS = nmeadecoder.decoders('RMC', 'DPT')
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024    # bytes; smaller files are not worth starting a process pool for
+PARALLEL_CHUNK_SIZE = 16 * 1024 * 1024  # bytes
+PROGRESS_BLOCK = 4 * 1024 * 1024        # bytes; progress is reported and cancellation checked once per block
+MIN_TIME = -2**62                       # before and after any fix
+MAX_TIME = 2**62
+INDEX_EXTENSION = ".idx"                # time index, next to the log file
+INDEX_VERSION = 1                       # indexes of another version are rebuilt
+INDEX_HEAD = 4096                       # bytes at the start of the log that identify it in its index
+READ_AHEAD = 4                          # blocks decompressed ahead of the parser
+SEGMENT_PROBE = 256 * 1024              # bytes at the start of a segment searched for its first fix
+NOT_LOGS = (INDEX_EXTENSION, ".checkpoint", ".tmp", ".part")  # files next to logs that a glob pattern skips
+
+
+
+class Cancelled(Exception):
+    pass
+
+
+
+class NmeaLog(object):
+
+    # Parsed representation of an NMEA0183 log file, built in a single pass over the file.
+    # RMC fixes and DPT soundings are kept in compact columns (array.array), so the
+    # layer and track generators can work from memory without reading the file again.
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.lines = 0
+        self.rmc = 0
+        self.dpt = 0
+        self.firstTime = None   # UTC epoch seconds of the first and last fix
+        self.lastTime = None
+        self.mintime = "999999" # hhmmss and ddmmyy of the first and last fix, for the user interface
+        self.mindate = "999999"
+        self.maxtime = "000000"
+        self.maxdate = "000000"
+        self.mindepth = 99.0
+        self.maxdepth = -99.0
+
+        # One entry per RMC sentence with a readable date and time
+        self.fixTime = array.array('q')   # UTC epoch seconds
+        self.fixLat = array.array('d')    # last known position; NaN if none yet
+        self.fixLon = array.array('d')
+        self.fixValid = array.array('b')  # 1 if this RMC sentence carried a position itself
+
+        # One entry per DPT sentence with a readable depth
+        self.soundingDepth = array.array('d')
+        self.soundingFix = array.array('q')  # index of the preceding RMC fix; -1 if none
+
+        # Last known position, carried from one line to the next
+        self.curlat = math.nan
+        self.curlon = math.nan
+
+        # First RMC fix of every minute, for the time index: [minute, byte offset, lat, lon], with
+        # the position known before that fix. parseLines() records the line, load() its offset.
+        self.minuteFixes = []
+        self.minute = None
+
+        self.timeIndex = None  # set by open() if only the summary was taken from the index
+
+
+
+    def load(self, processes=1, progress=None, cancel=None, start=0, completeLines=False, end=None, index=None):
+        # Parse the file from byte offset start on, up to byte offset end or the end of the file. With
+        # completeLines, a last line that is still being written is left out, for the next incremental
+        # load to pick up; self.end is the offset up to which the file was read. progress(bytesDone,
+        # bytesTotal, lines) is called now and then; when the threading.Event cancel gets set, loading
+        # stops with Cancelled. A TimeIndex is extended with what was read and saved, if it held the
+        # file up to start.
+        segments = logSegments(self.filename)
+        if (len(segments) > 1 or compressed(segments[0])):
+            if (start != 0 or end is not None or completeLines):
+                raise ValueError("{} is compressed or has several segments; it can only be read as a whole".format(self.filename))
+            self.loadSegments(segments, processes, progress, cancel)
+            return
+        print ("Loading NMEA log file {}...".format(self.filename))
+        linesBefore, rmcBefore, dptBefore = self.lines, self.rmc, self.dpt
+        minutesBefore = len(self.minuteFixes)
+        if (end is None):
+            end = os.path.getsize(self.filename)
+        if (completeLines and end > start):
+            with open(self.filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    end = m.rfind(b"\n", start, end) + 1 or start
+        if (processes > 1 and end - start >= PARALLEL_MIN_SIZE):
+            self.loadParallel(processes, progress, cancel, start, end)
+        else:
+            with open(self.filename, 'rb') as f:
+                f.seek(start)
+                position = start
+                while (position < end):
+                    if (cancel is not None and cancel.is_set()):
+                        raise Cancelled()
+                    with instrumentation.stage("log read"):
+                        block = f.read(min(PROGRESS_BLOCK, end - position))
+                        if (position + len(block) < end and not block.endswith(b"\n")):
+                            block += f.readline()  # up to the end of the line
+                    if (not block):
+                        break
+                    with instrumentation.stage("log parse"):
+                        first = len(self.minuteFixes)
+                        self.parseLines(block.decode('utf-8', 'replace').splitlines())
+                        self.locateMinutes(first, block, position)
+                    position += len(block)
+                    if (progress is not None):
+                        progress(position - start, end - start, self.lines)
+                end = position
+        self.end = end
+        instrumentation.count("log bytes", end - start)
+        instrumentation.count("log lines", self.lines - linesBefore)
+        if (index is not None):
+            index.extend(self, start, end, self.minuteFixes[minutesBefore:], self.lines - linesBefore, self.rmc - rmcBefore, self.dpt - dptBefore)
+        print ("OK - File loaded.")
+
+
+
+    def loadSegments(self, segments, processes=1, progress=None, cancel=None):
+        # Read the segments of a rotated log one after the other, as one log: plain files as load()
+        # does, compressed ones streamed. self.end is None, as offsets mean nothing here.
+        total = sum(os.path.getsize(segment) for segment in segments)
+        done = 0
+        for segment in segments:
+            part = NmeaLog(segment)
+            partProgress = None
+            if (progress is not None):
+                partProgress = lambda partDone, partTotal, lines: progress(done + partDone, total, self.lines + lines)
+            if (compressed(segment)):
+                part.loadCompressed(partProgress, cancel)
+            else:
+                part.load(processes, partProgress, cancel)
+            self.append(part)
+            done += os.path.getsize(segment)
+        self.end = None
+
+
+
+    def loadCompressed(self, progress=None, cancel=None):
+        # Parse a compressed log file, decompressed by a thread of its own while the lines are parsed
+        print ("Loading compressed NMEA log file {}...".format(self.filename))
+        linesBefore = self.lines
+        size = os.path.getsize(self.filename)
+        read = 0
+        rest = b""
+        with open(self.filename, 'rb') as raw, decompress(raw, self.filename) as f, ReadAhead(f, raw.tell) as blocks:
+            for block, position in blocks:
+                if (cancel is not None and cancel.is_set()):
+                    raise Cancelled()
+                read += len(block)
+                block = rest + block
+                cut = block.rfind(b"\n") + 1
+                rest = block[cut:]
+                with instrumentation.stage("log parse"):
+                    self.parseLines(block[:cut].decode('utf-8', 'replace').splitlines())
+                if (progress is not None):
+                    progress(position, size, self.lines)
+        self.parseLines(rest.decode('utf-8', 'replace').splitlines())
+        self.end = None
+        instrumentation.count("log bytes", read)
+        instrumentation.count("log lines", self.lines - linesBefore)
+        print ("OK - File loaded.")
+
+
+
+    def open(self, processes=1, progress=None, cancel=None):
+        # Load the file and write its time index. If the index is up to date already, only the
+        # summary (counts, time and depth range) is taken from it, and window() reads the data.
+        index = TimeIndex(self.filename)
+        index.load()
+        if (index.current()):
+            print ("Time index {} is up to date; the log is read per time window".format(index.filename))
+            index.summarize(self)
+            self.timeIndex = index
+        else:
+            self.load(processes, progress, cancel, index = index)
+
+
+
+    def window(self, fromTimeStamp, toTimeStamp, processes=1, progress=None, cancel=None):
+        # A log with (at least) the fixes and soundings of the time window: this log if it was
+        # loaded, else a new one, with only the part of the file that the time index gives
+        if (self.timeIndex is None):
+            return self
+        log = NmeaLog(self.filename)
+        span = self.timeIndex.span(fromTimeStamp, toTimeStamp)
+        if (span is not None):
+            start, end, log.curlat, log.curlon = span
+            log.load(processes, progress, cancel, start, end = end)
+        return log
+
+
+
+    def locateMinutes(self, first, block, offset):
+        # Replace the lines that parseLines() recorded in minuteFixes[first:] by their byte offsets;
+        # block holds the bytes of those lines and starts at byte offset offset of the file. Should a
+        # line not be found, the offset of the one before is kept: reading from there is still right.
+        found = 0
+        for entry in self.minuteFixes[first:]:
+            at = block.find(entry[1].encode('utf-8', 'replace'), found)
+            if (at >= 0):
+                found = block.rfind(b"\n", 0, at) + 1  # the start of that line
+            entry[1] = offset + found
+
+
+
+    def setLastFix(self, timeStamp, lat, lon):
+        # Continue from the last RMC fix of a previous load: soundings before the first fix
+        # are placed there. The fix itself is not yielded by fixes() again.
+        self.fixTime.append(timeStamp)
+        self.fixLat.append(lat)
+        self.fixLon.append(lon)
+        self.fixValid.append(0)
+        self.curlat = lat
+        self.curlon = lon
+
+
+
+    def lastFix(self):
+        # (timeStamp, lat, lon) of the last RMC fix, with the last known position; None if there is none
+        if (len(self.fixTime) == 0):
+            return None
+        return self.fixTime[-1], self.fixLat[-1], self.fixLon[-1]
+
+
+
+    def parseLines(self, lines, where=""):
+        # Decode the given lines and append their fixes and soundings to the columns
+        decode = nmeadecoder.decode
+        toEpoch = nmeatime.toEpoch
+        l = self.lines
+        firstTime = self.firstTime if (self.firstTime is not None) else MAX_TIME
+        lastTime = self.lastTime if (self.lastTime is not None) else MIN_TIME
+        curlat = self.curlat
+        curlon = self.curlon
+        minute = self.minute
+        minuteFixes = self.minuteFixes
+        for line in lines:
+            l += 1
+            try:
+                sentence = decode(line, LOG_DECODERS)
+                if (sentence is None):
+                    continue
+                sentenceType, value = sentence
+                if (sentenceType == 'RMC'):
+                    curtime, curdate, lat, lon = value
+                    timeStamp = toEpoch(curdate, curtime)
+                    self.rmc += 1
+                    if (timeStamp < firstTime): firstTime = timeStamp
+                    if (timeStamp > lastTime): lastTime = timeStamp
+                    if (timeStamp // 60 != minute):
+                        minute = timeStamp // 60
+                        minuteFixes.append([minute, line, curlat, curlon])
+                    if (lat is not None):
+                        curlat = lat
+                        curlon = lon
+                    self.fixTime.append(timeStamp)
+                    self.fixLat.append(curlat)
+                    self.fixLon.append(curlon)
+                    self.fixValid.append(lat is not None)
+                else:
+                    depth = value
+                    if (depth < self.mindepth): self.mindepth = depth;
+                    if (depth > self.maxdepth): self.maxdepth = depth;
+                    self.dpt += 1
+                    self.soundingDepth.append(depth)
+                    self.soundingFix.append(len(self.fixTime) - 1)
+            except ValueError as e:
+                print ("could not read line {}{}: {} ({})".format(l, where, line.strip(), str(e)))
+        self.lines = l
+        self.curlat = curlat
+        self.curlon = curlon
+        self.minute = minute
+        if (firstTime <= lastTime):
+            self.setTimeRange(firstTime, lastTime)
+
+
+
+    def setTimeRange(self, firstTime, lastTime):
+        self.firstTime = firstTime
+        self.lastTime = lastTime
+        self.mintime = nmeatime.formatTimeOfDay(firstTime)
+        self.mindate = nmeatime.formatDate(firstTime)
+        self.maxtime = nmeatime.formatTimeOfDay(lastTime)
+        self.maxdate = nmeatime.formatDate(lastTime)
+
+
+
+    def loadParallel(self, processes, progress=None, cancel=None, start=0, end=None):
+        # Split the memory-mapped file into chunks at line boundaries, decode the chunks in a
+        # process pool and stitch the partial logs together in file order
+        chunks = []
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size if (end is None) else end
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                chunkSize = max(PARALLEL_CHUNK_SIZE, (size - start) // (processes * 4) + 1)
+                first = start
+                while (start < size):
+                    end = m.find(b"\n", min(start + chunkSize, size) - 1, size)
+                    end = size if (end < 0) else end + 1
+                    chunks.append((self.filename, start, end))
+                    start = end
+        print ("- {} chunks in {} processes".format(len(chunks), processes))
+        with multiprocessing.Pool(processes) as pool, instrumentation.stage("log parse"):
+            for (filename, start, end), chunk in zip(chunks, pool.imap(loadChunk, chunks)):
+                if (cancel is not None and cancel.is_set()):
+                    raise Cancelled()  # leaving the with block terminates the pool
+                self.append(chunk)
+                if (progress is not None):
+                    progress(end - first, size - first, self.lines)
+
+
+
+    def append(self, other):
+        # Append a log parsed from the bytes following this one. Soundings before the first fix
+        # of the other log (-1) end up at our last fix, and fixes before its first position get ours.
+        offset = len(self.fixTime)
+        for k in range(len(other.fixLat)):
+            if (other.fixValid[k]):
+                break
+            other.fixLat[k] = self.curlat
+            other.fixLon[k] = self.curlon
+        for entry in other.minuteFixes:
+            if (entry[2] != entry[2]):  # NaN: before the first position of the other log
+                entry[2] = self.curlat
+                entry[3] = self.curlon
+        if (other.minuteFixes and other.minuteFixes[0][0] == self.minute):
+            del other.minuteFixes[0]  # not a new minute after all
+        self.minuteFixes.extend(other.minuteFixes)
+        if (other.minute is not None):
+            self.minute = other.minute
+        self.fixTime.extend(other.fixTime)
+        self.fixLat.extend(other.fixLat)
+        self.fixLon.extend(other.fixLon)
+        self.fixValid.extend(other.fixValid)
+        self.soundingDepth.extend(other.soundingDepth)
+        self.soundingFix.extend([fix + offset for fix in other.soundingFix])
+
+        self.lines += other.lines
+        self.rmc += other.rmc
+        self.dpt += other.dpt
+        if (other.firstTime is not None):
+            self.setTimeRange(min(other.firstTime, self.firstTime if (self.firstTime is not None) else MAX_TIME),
+                max(other.lastTime, self.lastTime if (self.lastTime is not None) else MIN_TIME))
+        self.mindepth = min(self.mindepth, other.mindepth)
+        self.maxdepth = max(self.maxdepth, other.maxdepth)
+        if (other.curlat == other.curlat):  # not NaN
+            self.curlat = other.curlat
+            self.curlon = other.curlon
+
+
+
+    def soundings(self, fromTimeStamp, toTimeStamp):
+        # Yield (timeStamp, lat, lon, depth) for every DPT sounding within the time window,
+        # positioned at the last RMC fix before it
+        for k in range(len(self.soundingDepth)):
+            fix = self.soundingFix[k]
+            if (fix < 0):
+                continue
+            timeStamp = self.fixTime[fix]
+            if (timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
+                curlat = self.fixLat[fix]
+                if (curlat == curlat):  # not NaN
+                    yield timeStamp, curlat, self.fixLon[fix], self.soundingDepth[k]
+
+
+
+    def fixes(self, fromTimeStamp, toTimeStamp):
+        # Yield (timeStamp, lat, lon) for every RMC fix within the time window that carried a position
+        for k in range(len(self.fixTime)):
+            timeStamp = self.fixTime[k]
+            if (self.fixValid[k] and timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
+                yield timeStamp, self.fixLat[k], self.fixLon[k]
+
+
+
+
+    def soundingColumns(self, fromTimeStamp, toTimeStamp):
+        # Same soundings as soundings(), as NumPy arrays: (timeStamp, lat, lon, depth)
+        fix = np.frombuffer(self.soundingFix, dtype=np.int64)
+        depth = np.frombuffer(self.soundingDepth, dtype=np.float64)
+        keep = fix >= 0
+        fix = fix[keep]
+        depth = depth[keep]
+        timeStamp = np.frombuffer(self.fixTime, dtype=np.int64)[fix]
+        lat = np.frombuffer(self.fixLat, dtype=np.float64)[fix]
+        lon = np.frombuffer(self.fixLon, dtype=np.float64)[fix]
+        keep = (timeStamp >= fromTimeStamp) & (timeStamp <= toTimeStamp) & ~np.isnan(lat)
+        return timeStamp[keep], lat[keep], lon[keep], depth[keep]
+
+
+
+    def fixColumns(self, fromTimeStamp, toTimeStamp):
+        # Same fixes as fixes(), as NumPy arrays: (timeStamp, lat, lon)
+        timeStamp = np.frombuffer(self.fixTime, dtype=np.int64)
+        keep = (np.frombuffer(self.fixValid, dtype=np.int8) != 0) & (timeStamp >= fromTimeStamp) & (timeStamp <= toTimeStamp)
+        return timeStamp[keep], np.frombuffer(self.fixLat, dtype=np.float64)[keep], np.frombuffer(self.fixLon, dtype=np.float64)[keep]
+
+
+
+class TimeIndex(object):
+
+    # Sparse time index of a log file, in a JSON file next to it: the byte offset of the first RMC
+    # fix of every minute, with the position known before it, and the summary of the log that the
+    # user interface shows. It is written when the log is loaded, and extended by incremental loads.
+    # A time window is then read from the offset of its first minute up to the first minute after
+    # it, found by binary search, instead of parsing the whole file. The index is only used while
+    # it holds the log as it is: same first bytes, same size.
+
+    def __init__(self, logFile):
+        self.logFile = logFile
+        self.filename = logFile + INDEX_EXTENSION
+        self.version = INDEX_VERSION
+        self.size = 0           # bytes of the log indexed
+        self.head = None        # SHA-256 of its first INDEX_HEAD bytes
+        self.minutes = []       # [minute, byte offset, lat, lon], in file order
+        self.lines = 0
+        self.rmc = 0
+        self.dpt = 0
+        self.firstTime = None
+        self.lastTime = None
+        self.mindepth = 99.0
+        self.maxdepth = -99.0
+
+
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+            if (state.get("version") == INDEX_VERSION and state.get("logFile") == self.logFile):
+                self.__dict__.update(state)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print ("*** Could not read time index {}: {}".format(self.filename, str(e)))
+
+
+
+    def save(self):
+        state = dict(self.__dict__)
+        del state["filename"]
+        try:
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError as e:
+            print ("*** Could not write time index {}: {}".format(self.filename, str(e)))
+
+
+
+    def headDigest(self):
+        return headDigest(self.logFile, self.size)
+
+
+
+    def holds(self, size):
+        # True if the index holds the log up to byte offset size, and the log was not replaced since
+        return size == self.size and self.head is not None and self.headDigest() == self.head
+
+
+
+    def current(self):
+        # True if the index holds the whole log file as it is now
+        return self.size > 0 and self.holds(os.path.getsize(self.logFile))
+
+
+
+    def extend(self, log, start, end, minutes, lines, rmc, dpt):
+        # Add what a log loaded from start to end: its minutes, and lines, RMC and DPT sentences
+        # read. The index starts over at a load from the beginning of the file; a load from
+        # anywhere else than the end of the index leaves it as it is.
+        if (start == 0):
+            self.__init__(self.logFile)
+        elif (not self.holds(start)):
+            return
+        if (minutes and self.minutes and minutes[0][0] == self.minutes[-1][0]):
+            minutes = minutes[1:]  # the minute went on from the end of the index
+        self.minutes.extend(minutes)
+        self.size = end
+        self.head = self.headDigest()
+        self.lines += lines
+        self.rmc += rmc
+        self.dpt += dpt
+        if (log.firstTime is not None):
+            self.firstTime = min(log.firstTime, self.firstTime if (self.firstTime is not None) else MAX_TIME)
+            self.lastTime = max(log.lastTime, self.lastTime if (self.lastTime is not None) else MIN_TIME)
+        self.mindepth = min(self.mindepth, log.mindepth)
+        self.maxdepth = max(self.maxdepth, log.maxdepth)
+        self.save()
+
+
+
+    def summarize(self, log):
+        # Give the log the counts and ranges of the whole file, without its fixes and soundings
+        log.lines = self.lines
+        log.rmc = self.rmc
+        log.dpt = self.dpt
+        log.mindepth = self.mindepth
+        log.maxdepth = self.maxdepth
+        log.end = self.size
+        if (self.firstTime is not None):
+            log.setTimeRange(self.firstTime, self.lastTime)
+
+
+
+    def span(self, fromTimeStamp, toTimeStamp):
+        # (start, end, lat, lon) of the part of the log to read for the time window, with the
+        # position known at start; end is None for the end of the file. None if no fix is in the window.
+        if (not self.minutes):
+            return None
+        entries = np.array(self.minutes, dtype=np.float64)
+        minutes = entries[:, 0]
+        first, last = fromTimeStamp // 60, toTimeStamp // 60
+        if (np.all(minutes[1:] >= minutes[:-1])):
+            i = np.searchsorted(minutes, first, "left")
+            j = np.searchsorted(minutes, last, "right")
+        else:
+            # The clock went back somewhere: from the first to the last minute in the window
+            inside = np.flatnonzero((minutes >= first) & (minutes <= last))
+            i, j = (inside[0], inside[-1] + 1) if (len(inside) > 0) else (0, 0)
+        if (i >= j):
+            return None
+        end = int(entries[j, 1]) if (j < len(entries)) else None
+        return int(entries[i, 1]), end, float(entries[i, 2]), float(entries[i, 3])
+
+
+
+class ReadAhead(object):
+
+    # Reads blocks from a file object in a thread of its own, a few blocks ahead of the parser, so
+    # decompression runs alongside parsing (zlib, bz2, lzma and zstandard release the GIL).
+    # Iterating yields (block, position()) until the end of the file; an error in the thread
+    # is raised there. Leaving the with block stops the thread.
+
+    def __init__(self, f, position, blockSize=PROGRESS_BLOCK, blocks=READ_AHEAD):
+        self.queue = queue.Queue(blocks)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, args = (f, position, blockSize), daemon = True)
+
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+
+    def run(self, f, position, blockSize):
+        try:
+            while (not self.stopped.is_set()):
+                block = f.read(blockSize)
+                self.put((block, position()))
+                if (not block):
+                    break
+        except Exception as e:
+            self.put(e)
+
+
+
+    def put(self, item):
+        while (not self.stopped.is_set()):
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                pass
+
+
+
+    def __iter__(self):
+        while True:
+            with instrumentation.stage("log read"):
+                item = self.queue.get()
+            if (isinstance(item, Exception)):
+                raise item
+            block, position = item
+            if (not block):
+                return
+            yield block, position
+
+
+
+def headDigest(filename, size):
+    # SHA-256 of the first INDEX_HEAD bytes of the log file, or its first size bytes if fewer;
+    # tells whether a log file that was read up to size bytes is still the same file
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read(min(size, INDEX_HEAD))).hexdigest()
+
+
+
+def compressed(filename):
+    return os.path.splitext(filename)[1].lower() in DECOMPRESSORS
+
+
+
+def decompress(raw, filename):
+    # A file object with the decompressed content of the open (binary) file raw, or raw itself for
+    # a plain log file
+    extension = os.path.splitext(filename)[1].lower()
+    if (extension not in DECOMPRESSORS):
+        return raw
+    if (extension == ".zst" and zstandard is None):
+        raise ValueError("{} is compressed with Zstandard; install the zstandard package to read it".format(filename))
+    return DECOMPRESSORS[extension](raw)
+
+DECOMPRESSORS = {
+    ".gz": lambda raw: gzip.GzipFile(fileobj = raw),
+    ".bz2": lambda raw: bz2.BZ2File(raw),
+    ".xz": lambda raw: lzma.LZMAFile(raw),
+    ".zst": lambda raw: zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames = True, closefd = False),
+}
+
+
+
+def firstFixTime(filename):
+    # UTC epoch seconds of the first RMC fix near the start of a log file; None if there is none
+    with open(filename, 'rb') as raw, decompress(raw, filename) as f:
+        lines = f.read(SEGMENT_PROBE).decode('utf-8', 'replace').splitlines()
+    for line in lines:
+        try:
+            sentence = nmeadecoder.decode(line, LOG_DECODERS)
+            if (sentence is not None and sentence[0] == 'RMC'):
+                curtime, curdate, lat, lon = sentence[1]
+                return nmeatime.toEpoch(curdate, curtime)
+        except ValueError:
+            pass
+    return None
+
+
+
+def logSegments(filename):
+    # The files of a log: the file itself, or else the files that match it as a glob pattern, such as
+    # the rotated segments of nmea.log* (nmea.log, nmea.log.1, nmea.log.2.gz, ...), ordered by the
+    # time of their first fix. Segments without a fix near their start go last, by name.
+    if (os.path.exists(filename) or not glob.has_magic(filename)):
+        return [filename]
+    segments = [f for f in glob.glob(filename) if (os.path.isfile(f) and not f.endswith(NOT_LOGS))]
+    if (not segments):
+        raise FileNotFoundError("no log files match {}".format(filename))
+    times = {segment: firstFixTime(segment) for segment in segments}
+    return sorted(segments, key = lambda segment: (times[segment] is None, times[segment] or 0, segment))
+
+
+
+def loadChunk(chunk):
+    # Process pool worker: parse the bytes start..end of the log file into a partial NmeaLog
+    filename, start, end = chunk
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            block = m[start:end]
+    log = NmeaLog(filename)
+    log.parseLines(block.decode('utf-8', 'replace').splitlines(), " (chunk at byte {})".format(start))
+    log.locateMinutes(0, block, start)
+    return log
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# Live depth layer from an NMEA0183 stream, e.g. the TCP or UDP output of SignalK or OpenCPN,
+# instead of waiting for the VDR log file:
+#
+#     python nmeastream.py --tcp localhost:10110 --layer depths.gpx
+#     python nmeastream.py --udp 10110 --layer depths.gpx
+#
+# Soundings go through the same decimation, tide correction and icons as in depthwaypoints.py.
+# As the waypoints arrive one at a time, they are spread over the scales by the scale pendulum
+# instead of per area as in levelofdetail.py. New waypoints are added to the layer file every FLUSH_INTERVAL seconds;
+# the file is replaced as a whole, so OpenCPN never reads a half-written one. Only the waypoints
+# since the last update are held in memory, so memory stays bounded over days of uptime.
+#
+# The tidal data is reloaded every TIDE_RELOAD_INTERVAL seconds, to pick up what autofetch downloaded
+# since. Soundings after the end of the tidal data are held back (up to MAX_HELD_BACK of them) until
+# a reload covers their time, rather than written uncorrected.
+#
+# For testing, a log file can be replayed on a local TCP port:
+#
+#     python nmeastream.py --replay nmea.log --port 10110 --rate 200
+
+import argparse
+import asyncio
+import collections
+import os
+import sys
+
+import decimate
+import depthwaypoints
+import gpxwriter
+import nmeadecoder
+import nmeatime
+
+STREAM_DECODERS = nmeadecoder.decoders('RMC', 'DPT')
+DEFAULT_PORT = 10110    # NMEA0183 over TCP/UDP
+FLUSH_INTERVAL = 60     # seconds between layer file updates
+MAX_PENDING = 10000     # waypoints held before the layer file is updated early
+TIDE_RELOAD_INTERVAL = 600  # seconds between reloads of the tidal data
+MAX_HELD_BACK = 100000  # soundings held back for tidal data; beyond that the oldest are dropped
+MAX_LINE = 4096         # bytes; a longer line is not NMEA0183
+RECONNECT_DELAY = 5     # seconds
+
+
+
+class LiveLayer(object):
+
+    # Turns NMEA0183 lines, fed one at a time, into depth waypoints for a layer file
+
+    def __init__(self, layerFileName, tidalData, maxDepthValue, intervalValue):
+        self.layerFileName = layerFileName
+        self.maxDepthValue = maxDepthValue
+        self.decimator = decimate.Decimator(intervalValue)
+        self.pending = []       # formatted waypoints not yet in the layer file
+        self.heldBack = collections.deque()  # (epoch, lat, lon, depth) of soundings after the tidal data
+        self.dropped = 0        # soundings held back too long
+        self.writing = None     # the layer file update running in the executor
+        self.full = asyncio.Event()
+        self.i = 0              # cycle for scale pendulum
+        self.lines = 0
+        self.waypoints = 0
+        self.curEpoch = None    # UTC epoch seconds of the last RMC fix
+        self.curlat = None
+        self.curlon = None
+        self.setTidalData(tidalData)
+
+
+
+    def setTidalData(self, tidalData):
+        # Use the (re)loaded tidal data, and add the soundings held back that it now covers
+        self.tidalData = tidalData
+        self.tideUntil = tidalData.lastTime() if (tidalData is not None) else None
+        released = 0
+        while (self.heldBack and self.covered(self.heldBack[0][0])):
+            self.addWaypoint(*self.heldBack.popleft())
+            released += 1
+        if (released or self.dropped):
+            print ("{} soundings held back for tidal data added, {} dropped; {} still held back".format(released, self.dropped, len(self.heldBack)))
+            self.dropped = 0
+
+
+
+    def covered(self, epoch):
+        return self.tidalData is None or (self.tideUntil is not None and epoch <= self.tideUntil)
+
+
+
+    def feed(self, line):
+        self.lines += 1
+        try:
+            sentence = nmeadecoder.decode(line, STREAM_DECODERS)
+        except ValueError as e:
+            print ("could not read line {}: {} ({})".format(self.lines, line.strip(), str(e)))
+            return
+        if (sentence is None):
+            return
+        sentenceType, value = sentence
+        if (sentenceType == 'RMC'):
+            curtime, curdate, lat, lon = value
+            try:
+                self.curEpoch = nmeatime.toEpoch(curdate, curtime)
+            except ValueError:
+                pass  # no date and time in this sentence; keep the last ones
+            if (lat is not None):
+                self.curlat = lat
+                self.curlon = lon
+        elif (self.curlat is not None and self.curEpoch is not None):
+            self.sounding(value)
+
+
+
+    def sounding(self, curdepth):
+        if (not self.decimator.keep(self.curlat, self.curlon)):
+            return
+        if (self.heldBack or not self.covered(self.curEpoch)):
+            if (not self.heldBack):
+                print ("*** No tidal data for {}; soundings are held back until it is loaded".format(nmeatime.formatTime(self.curEpoch)))
+            if (len(self.heldBack) >= MAX_HELD_BACK):
+                self.heldBack.popleft()
+                self.dropped += 1
+            self.heldBack.append((self.curEpoch, self.curlat, self.curlon, curdepth))
+            return
+        self.addWaypoint(self.curEpoch, self.curlat, self.curlon, curdepth)
+
+
+
+    def addWaypoint(self, epoch, lat, lon, curdepth):
+        waterLevel = 0
+        if (self.tidalData is not None):
+            waterLevel = self.tidalData.getWeighedWaterLevel(epoch, lat, lon)
+        if (curdepth - waterLevel < self.maxDepthValue and curdepth != 0):
+            self.pending.append(gpxwriter.WAYPOINT % (lat, lon, depthwaypoints.depthIcon(curdepth, waterLevel), depthwaypoints.SCALES[self.i % 32]))
+            self.waypoints += 1
+            self.i += 1
+            if (len(self.pending) >= MAX_PENDING):
+                self.full.set()
+
+
+
+    def take(self):
+        # The waypoints since the last call, for writing
+        pending = self.pending
+        self.pending = []
+        self.full.clear()
+        return pending
+
+
+
+    def write(self, waypoints):
+        # Add the waypoints to the layer file: the new file is built next to it and renamed into place
+        if (not waypoints and os.path.exists(self.layerFileName)):
+            return
+        with gpxwriter.GpxWriter(self.layerFileName, gpxwriter.GPX_HEADER, gpxwriter.LAYER_FOOTER, extend = True) as writer:
+            for waypoint in waypoints:
+                writer.write(waypoint)
+        print ("Layer file {} updated with {} waypoints; {} lines, {} waypoints so far".format(self.layerFileName, len(waypoints), self.lines, self.waypoints))
+
+
+
+async def flushPeriodically(layer, interval, loadTide=None):
+    # Update the layer file every interval seconds, or as soon as it is full; reload the tidal data
+    # with loadTide now and then. An update is shielded from cancelling, so it always completes.
+    loop = asyncio.get_running_loop()
+    reloaded = loop.time()
+    while True:
+        try:
+            await asyncio.wait_for(layer.full.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        if (loadTide is not None and loop.time() - reloaded >= TIDE_RELOAD_INTERVAL):
+            reloaded = loop.time()
+            tidalData = await loop.run_in_executor(None, loadTide)
+            if (tidalData.lastTime() is not None):
+                layer.setTidalData(tidalData)
+            else:
+                print ("*** No tidal data after the reload; the previous data is kept")
+        layer.writing = loop.run_in_executor(None, layer.write, layer.take())
+        await asyncio.shield(layer.writing)
+
+
+
+async def readTcp(host, port, layer):
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port, limit = MAX_LINE)
+            print ("Connected to {}:{}".format(host, port))
+            try:
+                while True:
+                    line = await reader.readline()
+                    if (not line):
+                        break
+                    layer.feed(line.decode('ascii', 'replace'))
+            finally:
+                writer.close()
+            print ("Connection to {}:{} closed".format(host, port))
+        except (OSError, ValueError) as e:
+            print ("*** {}:{}: {}".format(host, port, str(e)))
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+
+class UdpReceiver(asyncio.DatagramProtocol):
+
+    def __init__(self, layer):
+        self.layer = layer
+
+    def datagram_received(self, data, addr):
+        for line in data.decode('ascii', 'replace').splitlines():
+            self.layer.feed(line)
+
+
+
+async def stream(layer, tcp=None, udp=None, flushInterval=FLUSH_INTERVAL, loadTide=None):
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.ensure_future(flushPeriodically(layer, flushInterval, loadTide))]
+    transport = None
+    if (tcp is not None):
+        host, port = tcp
+        tasks.append(asyncio.ensure_future(readTcp(host, port, layer)))
+    if (udp is not None):
+        transport, protocol = await loop.create_datagram_endpoint(lambda: UdpReceiver(layer), local_addr = ("0.0.0.0", udp))
+        print ("Listening on UDP port {}".format(udp))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if (transport is not None):
+            transport.close()
+        if (layer.writing is not None):
+            await layer.writing  # an update still running writes the same temporary file
+        layer.write(layer.take())
+
+
+
+async def replay(filename, port, rate):
+    # Serve the log file to every client connecting to the local TCP port, at about rate lines per second
+    async def serve(reader, writer):
+        print ("Replaying {} to {}".format(filename, writer.get_extra_info("peername")))
+        with open(filename, "rb") as f:
+            n = 0
+            for line in f:
+                writer.write(line)
+                n += 1
+                if (rate and n % max(1, rate // 10) == 0):
+                    await writer.drain()
+                    await asyncio.sleep(0.1)
+            await writer.drain()
+        writer.close()
+        print ("Replay of {} done".format(filename))
+
+    server = await asyncio.start_server(serve, "127.0.0.1", port)
+    print ("Replaying {} on TCP port {}".format(filename, port))
+    async with server:
+        await server.serve_forever()
+
+
+
+def hostPort(value):
+    host, _, port = value.rpartition(":")
+    return (host or "localhost", int(port))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = "Generate a depth layer live from an NMEA0183 TCP or UDP stream.")
+    parser.add_argument("--tcp", type = hostPort, help = "host:port to read NMEA0183 from over TCP")
+    parser.add_argument("--udp", type = int, help = "UDP port to receive NMEA0183 on")
+    parser.add_argument("-l", "--layer", help = "layer file with depth waypoints; new waypoints are added to it")
+    parser.add_argument("--interval", type = float, default = depthwaypoints.DEFAULT_INTERVAL, help = "waypoint interval in meters (default %(default)s)")
+    parser.add_argument("--max-depth", type = float, default = depthwaypoints.DEFAULT_MAX_DEPTH, help = "deepest sounding to show, in meters (default %(default)s)")
+    parser.add_argument("--no-tide", action = "store_true", help = "do not correct the depths for the tide")
+    depthwaypoints.addTideArguments(parser)
+    parser.add_argument("--flush", type = float, default = FLUSH_INTERVAL, help = "seconds between layer file updates (default %(default)s)")
+    parser.add_argument("--replay", metavar = "LOG", help = "instead, serve this log file on a local TCP port for testing")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT, help = "TCP port for --replay (default %(default)s)")
+    parser.add_argument("--rate", type = int, default = 100, help = "lines per second for --replay; 0 for as fast as possible (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        if (args.replay is not None):
+            asyncio.run(replay(args.replay, args.port, args.rate))
+            return 0
+        if (args.layer is None or (args.tcp is None and args.udp is None)):
+            parser.error("give --layer and --tcp and/or --udp")
+        layerFileName = os.path.abspath(args.layer)
+        tidalData = None
+        loadTide = None
+        if (not args.no_tide):
+            os.chdir(os.path.dirname(os.path.realpath(__file__)))
+            loadTide = lambda: depthwaypoints.loadTidalData(args.tide_stations, args.tide_radius)
+            tidalData = loadTide()
+        layer = LiveLayer(layerFileName, tidalData, args.max_depth, args.interval)
+        asyncio.run(stream(layer, args.tcp, args.udp, args.flush, loadTide))
+    except KeyboardInterrupt:
+        print ("--- Stopped")
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
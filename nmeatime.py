@@ -0,0 +1,97 @@
+import datetime
+
+# Times of NMEA0183 logs as integer UTC epoch seconds.
+#
+# The RMC date (ddmmyy) is converted once per date and remembered, so turning a fix into epoch
+# seconds is a dictionary lookup and some integer arithmetic, without strptime or a locale.
+# Epoch seconds compare correctly across days, months and years, unlike ddmmyyhhmmss. GPX
+# <time> strings are put together from a remembered date part and a table of two-digit numbers.
+# Two-digit years are read as strptime's %y does: 69-99 in the 1900s, 00-68 in the 2000s.
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+TWO_DIGITS = ["{:02d}".format(x) for x in range(100)]
+
+dates = {}      # ddmmyy: epoch seconds at midnight
+prefixes = {}   # days since the epoch: "yyyy-mm-ddT"
+
+
+
+def dateEpoch(ddmmyy):
+    # Epoch seconds at the start of the RMC date; ValueError if it is no date
+    epoch = dates.get(ddmmyy)
+    if (epoch is None):
+        if (len(ddmmyy) != 6):
+            raise ValueError("invalid date '{}'".format(ddmmyy))
+        year = int(ddmmyy[4:6])
+        year += 2000 if (year < 69) else 1900
+        epoch = (datetime.date(year, int(ddmmyy[2:4]), int(ddmmyy[0:2])).toordinal() - EPOCH_ORDINAL) * 86400
+        dates[ddmmyy] = epoch
+    return epoch
+
+
+
+def secondsOfDay(hhmmss):
+    # Seconds since midnight of hhmmss; a fraction of a second (hhmmss.ss) is dropped. ValueError
+    # unless it starts with six digits of a time of day (a second of 60 is a leap second).
+    if (len(hhmmss) < 6 or not hhmmss[0:6].isdigit() or (len(hhmmss) > 6 and hhmmss[6] != ".")):
+        raise ValueError("invalid time '{}'; expected hhmmss".format(hhmmss))
+    t = int(hhmmss[0:6])
+    h = t // 10000
+    m = t // 100 % 100
+    s = t % 100
+    if (h > 23 or m > 59 or s > 60):
+        raise ValueError("invalid time '{}'; expected hhmmss".format(hhmmss))
+    return h * 3600 + m * 60 + s
+
+
+
+def toEpoch(ddmmyy, hhmmss):
+    # Epoch seconds of an RMC date and time
+    return dateEpoch(ddmmyy) + secondsOfDay(hhmmss)
+
+
+
+def parseTimeStamp(timeStamp):
+    # Epoch seconds of a ddmmyyhhmmss time stamp, as entered by the user
+    if (len(timeStamp) != 12):
+        raise ValueError("invalid time stamp '{}'; expected ddmmyyhhmmss".format(timeStamp))
+    return toEpoch(timeStamp[0:6], timeStamp[6:12])
+
+
+
+def formatTime(epoch):
+    # GPX time, e.g. 2023-02-13T06:00:09Z
+    day, s = divmod(int(epoch), 86400)
+    prefix = prefixes.get(day)
+    if (prefix is None):
+        prefix = prefixes[day] = datetime.date.fromordinal(day + EPOCH_ORDINAL).isoformat() + "T"
+    return prefix + TWO_DIGITS[s // 3600] + ":" + TWO_DIGITS[s // 60 % 60] + ":" + TWO_DIGITS[s % 60] + "Z"
+
+
+
+def formatDate(epoch):
+    # ddmmyy, as in RMC sentences
+    date = datetime.date.fromordinal(int(epoch) // 86400 + EPOCH_ORDINAL)
+    return TWO_DIGITS[date.day] + TWO_DIGITS[date.month] + TWO_DIGITS[date.year % 100]
+
+
+
+def formatTimeOfDay(epoch):
+    # hhmmss, as in RMC sentences
+    s = int(epoch) % 86400
+    return TWO_DIGITS[s // 3600] + TWO_DIGITS[s // 60 % 60] + TWO_DIGITS[s % 60]
+
+
+
+def uncovered(fromTimeStamp, toTimeStamp, covered):
+    # The parts of the window fromTimeStamp - toTimeStamp (epoch seconds, both included) outside
+    # all the windows (from, to) in covered, as a list of (from, to)
+    windows = []
+    for start, end in sorted(covered):
+        if (start > fromTimeStamp):
+            windows.append((fromTimeStamp, min(start - 1, toTimeStamp)))
+        fromTimeStamp = max(fromTimeStamp, end + 1)
+        if (fromTimeStamp > toTimeStamp):
+            return windows
+    windows.append((fromTimeStamp, toTimeStamp))
+    return windows
@@ -1,16 +1,18 @@
 #!/usr/bin/env python
 import wx
-import socket
 import time
-import math
 import platform
-import re    ## regular expressions
-import datetime
-import locale
+import os
+import multiprocessing
+import threading
+
+import depthwaypoints
+import instrumentation
+import nmealog
+import tidaldata
 
-GPX_HEADER='<?xml version="1.0" encoding="UTF-8" ?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">\n'
-DEFAULT_INTERVAL = 15
-TRACK_INTERVAL = 30
+DEFAULT_INTERVAL = depthwaypoints.DEFAULT_INTERVAL
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates
 
 
 if (platform.system() == "Windows"):
@@ -26,10 +28,37 @@ else:
 
 
 
+class Progress(object):
+
+    # Reports the progress of a step running on the worker thread to a label on the GUI thread,
+    # with rate and estimated time remaining
+
+    def __init__(self, label, action, unit, scale=1):
+        self.label = label
+        self.action = action
+        self.unit = unit
+        self.scale = scale
+        self.start = time.time()
+        self.last = 0
+
+    def __call__(self, done, total, lines=None):
+        now = time.time()
+        if (now - self.last < PROGRESS_INTERVAL and done < total):
+            return
+        self.last = now
+        elapsed = max(now - self.start, 1e-6)
+        eta = int(elapsed * (total - done) / done) if (done > 0) else 0
+        count = done if (lines is None) else lines
+        text = "{}: {:.1f} of {:.1f} {}, {:.0f} {}/s, ETA {}:{:02d}".format(self.action, done / self.scale, total / self.scale, self.unit,
+            count / elapsed, "lines" if (lines is not None) else self.unit, eta // 60, eta % 60)
+        wx.CallAfter(self.label.SetLabel, text)
+
+
+
 class DepthWaypointsFrame(wx.Frame):
 
     def __init__(self, parent, title):
-        super(DepthWaypointsFrame, self).__init__(parent, title = title, size=(510,245))
+        super(DepthWaypointsFrame, self).__init__(parent, title = title, size=(510,275))
 
         self.InitUI()
         self.Centre()
@@ -61,6 +90,8 @@ class DepthWaypointsFrame(wx.Frame):
         sizer.Add(text10, pos = (5, 0), flag = wx.ALL, border = 3)
         text11 = wx.StaticText(panel, label = "Output track file")
         sizer.Add(text11, pos = (6, 0), flag = wx.ALL, border = 3)
+        text12 = wx.StaticText(panel)
+        sizer.Add(text12, pos = (7, 0), flag = wx.ALL, border = 3, span=(1,4))
 
         ## Setup up controls
         filename = wx.TextCtrl(panel, value=DEFAULT_FILENAME)
@@ -74,7 +105,7 @@ class DepthWaypointsFrame(wx.Frame):
             dlg = wx.FileDialog(self, "NMEA0183 log file to open",
                 defaultDir = os.path.dirname(""),
                 defaultFile = os.path.basename("nmea.log"),
-                wildcard = "Log files (*.log)|*.log|All files|*")
+                wildcard = "Log files, also rotated and compressed (*.log*)|*.log*|All files|*")
 
             if dlg.ShowModal() == wx.ID_OK:
                 print ("Selected", dlg.GetPath())
@@ -100,6 +131,10 @@ class DepthWaypointsFrame(wx.Frame):
         sizer.Add(buttonGenerate, pos = (4, 4), flag = wx.ALIGN_CENTER|wx.ALL, border = 3)
         buttonGenerate.Disable()
 
+        buttonCancel = wx.Button(panel, label = "Cancel" )
+        sizer.Add(buttonCancel, pos = (7, 4), flag = wx.ALIGN_CENTER|wx.ALL, border = 3)
+        buttonCancel.Disable()
+
         startTime = wx.TextCtrl(panel, value="", size=(80,20))
         sizer.Add(startTime, pos = (2, 1), flag = wx.EXPAND|wx.ALL, border = 3)
         endTime = wx.TextCtrl(panel, value="", size=(80,20))
@@ -117,42 +152,74 @@ class DepthWaypointsFrame(wx.Frame):
 
 
 
-        def loadFile(event):
-            l = 0
-            rmc = 0
-            dpt = 0
-            self.mintime = "999999"
-            self.mindate = "999999"
-            self.maxtime = "000000"
-            self.maxdate = "000000"
-            self.mindepth = 99.0
-            self.maxdepth = -99.0
-            text7.SetLabel("")
-            print ("Loading NMEA log file {}...".format(filename.GetValue()))
-            for lines in open(filename.GetValue(), 'r'):
+        self.worker = None
+        self.cancel = threading.Event()
+
+        def runInBackground(work, done):
+            # Run work() on a worker thread, keeping the window responsive. done(result) is
+            # called on the GUI thread when it completes; Cancel stops it with nmealog.Cancelled.
+            buttonLoad.Disable()
+            buttonFetch.Disable()
+            buttonGenerate.Disable()
+            buttonCancel.Enable()
+            self.cancel.clear()
+
+            def run():
                 try:
-                    l += 1
-                    line = lines.strip().split(',')
-                    if (re.match(r"\$[A-Z]{2}RMC", line[0]) and line[1] != ""):
-                        rmc += 1
-                        if (line[1] < self.mintime): self.mintime = line[1][:6]
-                        if (line[1] > self.maxtime): self.maxtime = line[1][:6]
-                        if (line[9] < self.mindate): self.mindate = line[9]
-                        if (line[9] > self.maxdate): self.maxdate = line[9]
-                    if (re.match(r"\$[A-Z]{2}DPT", line[0])):
-                        depth = float(line[1])
-                        if (depth < self.mindepth): self.mindepth = depth;
-                        if (depth > self.maxdepth): self.maxdepth = depth;
-                        dpt += 1
+                    result = work()
+                    wx.CallAfter(finished, done, result, None)
+                except nmealog.Cancelled:
+                    print ("--- Cancelled")
+                    wx.CallAfter(finished, None, None, "Cancelled")
                 except Exception as e:
-                    print ("could not read line {}: {}".format(l, line))
-            text7.SetLabel("Lines={}, RMC={}, DPT={}, depth={} - {}".format(l, rmc, dpt, round(self.mindepth, 1), round(self.maxdepth, 1)))
+                    print ("*** " + str(e))
+                    wx.CallAfter(finished, None, None, "Error: " + str(e))
+
+            self.worker = threading.Thread(target = run, daemon = True)
+            self.worker.start()
+
+        def finished(done, result, message):
+            self.worker = None
+            buttonCancel.Disable()
+            buttonLoad.Enable()
+            buttonFetch.Enable()
+            if (hasattr(self, "nmeaLog")):
+                buttonGenerate.Enable()
+            text12.SetLabel(message or "")
+            if (done is not None):
+                done(result)
+
+        def cancelWork(event):
+            self.cancel.set()
+
+        buttonCancel.Bind(wx.EVT_BUTTON, cancelWork)
+
+
+
+        def loadFile(event):
+            text7.SetLabel("")
+            log = nmealog.NmeaLog(filename.GetValue())
+
+            def work():
+                log.open(depthwaypoints.PARSE_PROCESSES, Progress(text12, "Loading", "MB", 1024 * 1024), self.cancel)
+                return log
+
+            runInBackground(work, loadFinished)
+
+        def loadFinished(log):
+            self.nmeaLog = log
+            self.mintime = log.mintime
+            self.mindate = log.mindate
+            self.maxtime = log.maxtime
+            self.maxdate = log.maxdate
+            self.mindepth = log.mindepth
+            self.maxdepth = log.maxdepth
+            text7.SetLabel("Lines={}, RMC={}, DPT={}, depth={} - {}".format(log.lines, log.rmc, log.dpt, round(self.mindepth, 1), round(self.maxdepth, 1)))
             startTime.SetValue(self.mintime)
             endTime.SetValue(self.maxtime)
             buttonGenerate.Enable()
             layerfilename.SetValue(DEFAULT_LAYERPATH.replace(".gpx", "-20{}-{}-{}.gpx").format(self.mindate[4:6], self.mindate[2:4], self.mindate[0:2]))
             trackfilename.SetValue(DEFAULT_TRACKPATH.replace("tracks.gpx", "20{}-{}-{}-tracks.gpx").format(self.mindate[4:6], self.mindate[2:4], self.mindate[0:2]))
-            print ("OK - File loaded.")
             print ("self.mintime {} self.maxtime {} self.mindate {} self.maxdate {}".format(self.mintime, self.maxtime, self.mindate, self.maxdate))
             
             
@@ -162,210 +229,48 @@ class DepthWaypointsFrame(wx.Frame):
         
         
         
-        def convertLatLon (latLon):
-            if (latLon[4] == "."):
-                latLon = "" + "0" + latLon
-            val = float(latLon[0:3]) + float(latLon[3:])/60
-            return val
-        
-        
-        
-        def nmeaToIso (timestamp):
-            locale.setlocale(locale.LC_ALL, 'en_US')
-            try:
-                date_time_obj = datetime.datetime.strptime(timestamp, '%d%m%y%H%M%S')
-                new_minute = math.floor(date_time_obj.minute/10)*10
-                val = date_time_obj.replace(second=0, minute=new_minute).isoformat()
-            except Exception as e:
-                print ("nmeaToIso", timestamp, str(e))
-                pass 
-            return val
-        
-        
-        
-        def depthIcon (curdepth, waterLevel):
-            
-            actualDepth = round(float(curdepth) - float(waterLevel) , 1)  # 1 digit
-            
-            if (actualDepth < 0):
-                name = 'dry'
-            else:
-                name = 'depth'
-                
-            m = math.floor(abs(actualDepth))
-            dm = math.floor((abs(actualDepth) - m )*10)
-            icon = "{}_{}-{}".format(name, m, dm)
-            
-            #if (curdepth == self.mindepth):
-            #    print ("yes")
-         
-            return icon
-        
-        
-        
-        def scale (x):
-            s = 32
-            a = x % 32
-            for z in range(5, -1, -1):
-                if a > 31:
-                    s = 2 ** z
-                    a = a - 32
-                a = a * 2
-            return (s * 1600)
-
-
-
-        def generateLayerFile (event):
-            rmc = 0
-            dpt = 0
-            waypoints = 0
-            lastlat = 0
-            lastlon = 0
-            i = 0  # cycle for scale pendulum
-            n = 0  # line counter for verbose exception handling 
-            print ("Generating layer file", layerfilename.GetValue())
-            
-            fromTimeStamp = "" + self.mindate + startTime.GetValue()
-            toTimeStamp = "" + self.maxdate + endTime.GetValue()
-            tideOffsetValue = float(tideOffset.GetValue())
-            maxDepthValue = float(maxDepth.GetValue())
-            if (tideOffsetValue != 0):
-                print ("Warning! Tide Offset = {}.".format(tideOffsetValue))
-            text9.SetLabel("")
-            
-            f = open(layerfilename.GetValue(), "w")
-            f.write(GPX_HEADER)
-            timeStamp = ""
-            
-            for lines in open(filename.GetValue(), 'r'):
-                n += 1
-                line = lines.strip().split(',')
-                
-                try:
-                    if (re.match(r"\$[A-Z]{2}RMC", line[0])):
-                        curdate = line[9]
-                        curtime = line[1][:6]
-                        timeStamp = "" + curdate + curtime
-                        
-                        if (timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
-                            rmc += 1
-                            curlat = convertLatLon(line[3])
-                            curlon = convertLatLon(line[5])
-                        #else:
-                        #    print ("NOT within time interval")
-
-                            
-                    if (re.match(r"\$[A-Z]{2}DPT", line[0])):
-                        if (timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
-                            dpt += 1
-                            curdepth = float(line[1])
-                            
-                            # Caluculate distance to previously generated waypoint
-                            distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852
-                            
-                            if (distance > 10000):
-                                lastlat = curlat; lastlon = curlon;   #distance = 0; to deal with initial measurement
-                                
-                            if (distance > float (interval.GetValue())):
-                                
-                                waterLevel = tidalData.getWeighedWaterLevel(nmeaToIso(timeStamp), curlat, curlon)
-                                
-                                if (curdepth - waterLevel < maxDepthValue and curdepth != 0):
-                                    gpx = '  <wpt lat="{:.6f}" lon="{:.6f}"><sym>{}</sym><extensions><opencpn:scale_min_max UseScale="true" ScaleMin="{}" /></extensions></wpt>' \
-                                        .format(curlat, curlon, depthIcon(curdepth, waterLevel), scale(i))
-                                    ### print (gpx)
-                                    f.write(gpx + "\n")
-                                    waypoints += 1
-                                    i += 1
-                                lastlat = curlat
-                                lastlon = curlon
-                except Exception as e:
-                    print ("exception processing line {} of {}: ".format(n, filename.GetValue()) + lines  + str(e))
-                    pass
- 
- 
-            text9.SetLabel("{} waypoints".format(waypoints))
-            f.write ('</gpx>')
-            f.close()
-            
-            print ("OK - Waypoint file created with {} waypoints".format(waypoints))
-            tidalData.printStatistics()
-            
-            
-        def formatTimestamp(timeStamp):
-            # format 130223060009 into 2023-02-13T06:00:09Z
-            return "20{}-{}-{}T{}:{}:{}Z".format(timeStamp[4:6], timeStamp[2:4], timeStamp[0:2], timeStamp[6:8], timeStamp[8:10], timeStamp[10:12])
-            
-            
-        def generateTrackFile (event):
-            rmc = 0
-            waypoints = 0
-            lastlat = 0
-            lastlon = 0
-            i = 0  # cycle for scale pendulum
-            n = 0  # line counter for verbose exception handling 
-            print ("Generating track file", trackfilename.GetValue())
-            
-            fromTimeStamp = "" + self.mindate + startTime.GetValue()
-            toTimeStamp = "" + self.maxdate + endTime.GetValue()
-            text9.SetLabel("")
-            
-            f = open(trackfilename.GetValue(), "w")
-            f.write(GPX_HEADER)
-            f.write("<trk><name></name><trkseg>")
-            timeStamp = ""
-            
-            for lines in open(filename.GetValue(), 'r'):
-                n += 1
-                line = lines.strip().split(',')
-                
-                try:
-                    if (re.match(r"\$[A-Z]{2}RMC", line[0])):
-                        curdate = line[9]
-                        curtime = line[1][:6]
-                        timeStamp = "" + curdate + curtime
-                        
-                        if (timeStamp >= fromTimeStamp and timeStamp <= toTimeStamp):
-                            rmc += 1
-                            curlat = convertLatLon(line[3])
-                            curlon = convertLatLon(line[5])
-
-                            # Caluculate distance to previously generated waypoint
-                            distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852
-                            
-                            if (distance > 10000):
-                                lastlat = curlat; lastlon = curlon;   #distance = 0; to deal with initial measurement
-                                
-                            if (distance > float (TRACK_INTERVAL)):
-                                
-                                gpx = '  <trkpt lat="{:.6f}" lon="{:.6f}"><time>{}</time></trkpt>' \
-                                    .format(curlat, curlon, formatTimestamp(timeStamp))
-                                ### print (gpx)
-                                f.write(gpx + "\n")
-                                waypoints += 1
-                                i += 1
-                                
-                                lastlat = curlat
-                                lastlon = curlon
-                except Exception as e:
-                    print ("exception processing line {} of {}: ".format(n, filename.GetValue()) + lines  + str(e))
-                    pass
- 
-            f.write ('</trkseg></trk></gpx>')
-            f.close()
-            
-            print ("OK - Track file created with {} waypoints".format(waypoints))
-
-           
         def generateFiles(event):
-            generateLayerFile (event)
-            generateTrackFile (event)
+            text9.SetLabel("")
+            layerFileName = layerfilename.GetValue()
+            trackFileName = trackfilename.GetValue()
+            try:
+                fromTimeStamp, toTimeStamp = depthwaypoints.timeWindow(self.nmeaLog, startTime.GetValue(), endTime.GetValue())
+                tideOffsetValue = float(tideOffset.GetValue())
+                maxDepthValue = float(maxDepth.GetValue())
+                intervalValue = float(interval.GetValue())
+            except ValueError as e:
+                print ("*** " + str(e))
+                text12.SetLabel("Error: " + str(e))
+                return
+            tides = tidalData  # the stations of this run, even if a fetch replaces them
+
+            def work():
+                # Only the time window is read from the file if the log was loaded from its time index
+                log = self.nmeaLog.window(fromTimeStamp, toTimeStamp, depthwaypoints.PARSE_PROCESSES, Progress(text12, "Reading", "MB", 1024 * 1024), self.cancel)
+                waypoints = depthwaypoints.generateLayerFile (log, tides, layerFileName, fromTimeStamp, toTimeStamp, tideOffsetValue, maxDepthValue, intervalValue,
+                    Progress(text12, "Layer", "soundings"), self.cancel)
+                wx.CallAfter(text9.SetLabel, "{} waypoints".format(waypoints))
+                depthwaypoints.generateTrackFile (log, trackFileName, fromTimeStamp, toTimeStamp, Progress(text12, "Track", "fixes"), self.cancel)
+
+            runInBackground(work, lambda result: None)
            
         buttonGenerate.Bind(wx.EVT_BUTTON, generateFiles)
         
         def fetchData (event):
             print ("Fetching tidal data from the internet...")
-            tidalData.readStations(tidalData.FETCH_DATA)
+
+            def work():
+                # Downloads and reads the stations into a new TidalData, off the GUI thread
+                fetched = tidaldata.TidalData()
+                fetched.readStations(fetched.FETCH_DATA)
+                return fetched
+
+            runInBackground(work, fetchFinished)
+
+        def fetchFinished(fetched):
+            # On the GUI thread: the next Generate uses the fetched stations
+            global tidalData
+            tidalData = fetched
             
         buttonFetch.Bind(wx.EVT_BUTTON, fetchData)
 
@@ -376,25 +281,28 @@ class DepthWaypointsFrame(wx.Frame):
     
     def OnExitApp(self, event):
         print ('--- Window closed')
+        self.cancel.set()
         self.Destroy()
         
-import os
-full_path = os.path.realpath(__file__)
-path, filename = os.path.split(full_path)
-os.chdir(path)
-
-print ("Attempting " + AUTOFETCH)
-import subprocess
-if os.path.exists(AUTOFETCH):
-    output = subprocess.check_output(AUTOFETCH, shell=False).decode("utf-8").split("\r\n")
-    for line in output:
-        print (line)
-
-import tidaldata
-tidalData = tidaldata.TidalData()
-tidalData.readStations(tidalData.DONT_FETCH_DATA)
-
-app = wx.App()
-myFrame = DepthWaypointsFrame(None, title = 'Depth processor')
-app.MainLoop()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # the parallel log parser must not start the GUI in its workers
+    instrumentation.startFromEnvironment("process_depth")  # DEPTH_REPORT, DEPTH_PROFILE, DEPTH_TRACEMALLOC
+
+    full_path = os.path.realpath(__file__)
+    path, filename = os.path.split(full_path)
+    os.chdir(path)
+
+    print ("Attempting " + AUTOFETCH)
+    import subprocess
+    if os.path.exists(AUTOFETCH):
+        output = subprocess.check_output(AUTOFETCH, shell=False).decode("utf-8").split("\r\n")
+        for line in output:
+            print (line)
+
+    tidalData = depthwaypoints.loadTidalData()
+
+    app = wx.App()
+    myFrame = DepthWaypointsFrame(None, title = 'Depth processor')
+    app.MainLoop()
+    instrumentation.finish()
 
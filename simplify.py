@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+
+# Douglas-Peucker simplification of a track, in bounded windows.
+#
+# A point is dropped when the simplified track passes within `tolerance` meters of it: of every
+# stretch between two kept points, the point furthest from the straight line between them is kept
+# if it lies further away than the tolerance, and the stretch is split there. Distances are to the
+# line segment, not the infinite line, so a boat turning back on its own track keeps the turn.
+# Points are kept or dropped whole, so the kept ones have their own timestamps.
+#
+# Tracks are simplified WINDOW points at a time, which bounds the memory and the worst case (a
+# track that zigzags at the tolerance costs O(WINDOW) per point); the usual cost is O(n log n).
+# Every window but the last is only taken up to its last kept point but one, and the next window
+# starts there, so the windows do not show in the result. Within a window, positions are projected
+# to meters around its first point.
+
+WINDOW = 4096  # points
+METERS_PER_DEGREE = 60 * 1852
+
+
+
+def project(lat, lon):
+    # x, y in meters, equirectangular around the first point
+    cosLat = math.cos(lat[0] / 180 * math.pi)
+    return (lon - lon[0]) * METERS_PER_DEGREE * cosLat, (lat - lat[0]) * METERS_PER_DEGREE
+
+
+
+def douglasPeucker(x, y, tolerance):
+    # Boolean mask of the points kept; the first and last point always are
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[n - 1] = True
+    stretches = [(0, n - 1)]
+    while (stretches):
+        first, last = stretches.pop()
+        if (last - first < 2):
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        lengthSquared = dx * dx + dy * dy
+        if (lengthSquared > 0):
+            t = np.clip((px * dx + py * dy) / lengthSquared, 0, 1)
+            px = px - t * dx
+            py = py - t * dy
+        d = px * px + py * py
+        k = int(d.argmax())
+        if (d[k] > tolerance * tolerance):
+            k += first + 1
+            keep[k] = True
+            stretches.append((first, k))
+            stretches.append((k, last))
+    return keep
+
+
+
+def simplifyWindow(lat, lon, tolerance, final):
+    # (kept, restart): the indices of the points of the window that are kept for good, and where
+    # the next window starts; for the final window, all points kept and None
+    kept = np.flatnonzero(douglasPeucker(*project(lat, lon), tolerance))
+    if (final):
+        return kept, None
+    restart = int(kept[-2]) if (len(kept) > 2) else int(kept[-1])
+    return kept[kept < restart], restart
+
+
+
+def simplify(lat, lon, tolerance, window=WINDOW):
+    # Returns the indices of the points kept, as an int64 array. A tolerance of 0 keeps all points.
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    if (tolerance <= 0 or n <= 2):
+        return np.arange(n, dtype=np.int64)
+    parts = []
+    start = 0
+    while True:
+        end = min(start + window, n)
+        kept, restart = simplifyWindow(lat[start:end], lon[start:end], tolerance, end == n)
+        parts.append(kept + start)
+        if (restart is None):
+            break
+        start += restart
+    return np.concatenate(parts).astype(np.int64)
+
+
+
+class Simplifier(object):
+
+    # The same simplification for points that arrive one at a time, e.g. while converting a log:
+    # add() and flush() return the items of the points that are kept, in order, as soon as that is
+    # decided. With a tolerance of 0, every item is returned right away.
+
+    def __init__(self, tolerance, window=WINDOW):
+        self.tolerance = float(tolerance)
+        self.window = window
+        self.lats = []
+        self.lons = []
+        self.items = []
+
+    def add(self, lat, lon, item):
+        if (self.tolerance <= 0):
+            return [item]
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.items.append(item)
+        if (len(self.items) < self.window):
+            return []
+        return self.simplify(False)
+
+    def flush(self):
+        # The items still held back, at the end of the track
+        if (len(self.items) <= 2):
+            items, self.items, self.lats, self.lons = self.items, [], [], []
+            return items
+        return self.simplify(True)
+
+    def simplify(self, final):
+        kept, restart = simplifyWindow(np.array(self.lats), np.array(self.lons), self.tolerance, final)
+        items = [self.items[k] for k in kept.tolist()]
+        if (restart is None):
+            restart = len(self.items)
+        del self.lats[:restart], self.lons[:restart], self.items[:restart]
+        return items
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the top directory of the repository, next to this one
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import benchmark
+
+LOG_SIZE = 2  # MB
+
+
+
+@pytest.fixture(scope="session")
+def syntheticLog(tmp_path_factory):
+    # A VDR log as generated for the benchmarks: mixed talkers, other sentences, corrupt lines
+    filename = str(tmp_path_factory.mktemp("log") / "synthetic.log")
+    benchmark.generateLog(filename, LOG_SIZE, 1, 3)
+    return filename
@@ -0,0 +1,117 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+import bathymetry
+import nmealog
+
+# The grid against a cell-by-cell computation of the same interpolation, and contours through
+# depths whose shape is known
+
+
+
+def randomSoundings(seed, n=400):
+    rng = np.random.default_rng(seed)
+    return 53.2 + rng.random(n) * 0.003, 5.3 + rng.random(n) * 0.005, np.round(rng.random(n) * 10, 1)
+
+
+
+def cellByCell(grid, lats, lons, depths):
+    # Inverse distance weighted mean, or the nearest depth, of the soundings within the radius of every cell centre
+    result = np.full((grid.rows, grid.cols), np.nan)
+    v = (lats - grid.south) / grid.cellDegrees
+    u = (lons - grid.west) / grid.cellDegrees
+    for row in range(grid.rows):
+        for col in range(grid.cols):
+            d = np.hypot((col + 0.5 - u) * grid.cellWidth, (row + 0.5 - v) * grid.cellHeight)
+            inside = d <= grid.radius
+            if (not inside.any()):
+                continue
+            if (grid.method == "idw"):
+                w = np.maximum(d[inside], grid.cellHeight / 2) ** -bathymetry.POWER
+                result[row, col] = (w * depths[inside]).sum() / w.sum()
+            else:
+                result[row, col] = depths[inside][d[inside].argmin()]
+    return result
+
+
+
+@pytest.mark.parametrize("method", bathymetry.METHODS)
+def test_grid(method, monkeypatch):
+    monkeypatch.setattr(bathymetry, "SCATTER_BLOCK", 5000)  # soundings spread in several blocks
+    lats, lons, depths = randomSoundings(1)
+    grid = bathymetry.DepthGrid(lats.min(), lons.min(), lats.max(), lons.max(), method = method)
+    grid.add(lats, lons, depths)
+    expected = cellByCell(grid, lats, lons, depths)
+    actual = grid.values()
+    assert np.array_equal(np.isnan(actual), np.isnan(expected))
+    assert np.allclose(actual[~np.isnan(actual)], expected[~np.isnan(expected)])
+
+
+
+def test_cells():
+    # Square in degrees: CELL_SIZE meters north-south, cos(latitude) of that east-west
+    grid = bathymetry.DepthGrid(53.0, 5.0, 53.01, 5.01)
+    assert grid.cellHeight == pytest.approx(bathymetry.CELL_SIZE)
+    assert grid.cellWidth == pytest.approx(bathymetry.CELL_SIZE * math.cos(53.005 / 180 * math.pi), rel = 0.001)
+
+
+
+def test_too_large():
+    with pytest.raises(ValueError):
+        bathymetry.DepthGrid(53.0, 5.0, 53.5, 5.5, cellSize = 2)
+    rows = cols = int(math.sqrt(bathymetry.MAX_GRID_MEMORY / bathymetry.BYTES_PER_CELL)) - 10
+    size = (rows - 10) * bathymetry.CELL_SIZE / bathymetry.METERS_PER_DEGREE
+    bathymetry.DepthGrid(53.0, 5.0, 53.0 + size, 5.0 + size, method = "nearest")
+
+
+
+def bump(n=40):
+    # A round shoal: 1 m in the middle, 9 m at the edges
+    r = np.hypot(*np.mgrid[-1:1:n * 1j, -1:1:n * 1j])
+    return 1 + 8 * np.minimum(r, 1)
+
+
+
+def test_contour_around_shoal():
+    depth = bump()
+    lines = bathymetry.contourLines(depth, 5)
+    assert len(lines) == 1
+    line = lines[0]
+    assert line[0] == line[-1]  # closed
+    for side in line:
+        row, col = bathymetry.sidePosition(depth, side, 5)
+        # On the circle where the depth is 5 m, within the resolution of the grid
+        r = math.hypot(row / 39 * 2 - 1, col / 39 * 2 - 1)
+        assert r == pytest.approx(0.5, abs = 0.03)
+
+
+
+def test_contour_across_slope():
+    depth = np.tile(np.arange(10, dtype=np.float64), (6, 1))  # deeper to the east
+    lines = bathymetry.contourLines(depth, 4.5)
+    assert len(lines) == 1
+    assert sorted(round(bathymetry.sidePosition(depth, side, 4.5)[1], 6) for side in lines[0]) == [4.5] * 6
+    # No data ends a contour
+    depth[3, :] = np.nan
+    assert len(bathymetry.contourLines(depth, 4.5)) == 2
+
+
+
+def test_raster(syntheticLog, tmp_path):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    rasterFileName = str(tmp_path / "depths.asc")
+    contourFileName = str(tmp_path / "contours.gpx")
+    cells = bathymetry.generateRaster(log, None, rasterFileName, nmealog.MIN_TIME, nmealog.MAX_TIME, cellSize = 50, contourFileName = contourFileName)
+    with open(rasterFileName) as f:
+        header = [next(f).split() for k in range(6)]
+        rows = [line.split() for line in f]
+    ncols, nrows = int(header[0][1]), int(header[1][1])
+    assert len(rows) == nrows and all(len(row) == ncols for row in rows)
+    assert sum(value != str(bathymetry.NODATA) for row in rows for value in row) == cells > 0
+    assert os.path.exists(str(tmp_path / "depths.prj"))
+    with open(contourFileName) as f:
+        assert "<rte><name>" in f.read()
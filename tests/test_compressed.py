@@ -0,0 +1,97 @@
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+
+import nmealog
+
+# Compressed logs, and logs rotated into segments, read as the one plain log they hold
+
+COLUMNS = ["fixTime", "fixLat", "fixLon", "fixValid", "soundingDepth", "soundingFix"]
+SUMMARY = ["lines", "rmc", "dpt", "firstTime", "lastTime", "mindepth", "maxdepth"]
+COMPRESSORS = {".gz": gzip.compress, ".bz2": bz2.compress, ".xz": lzma.compress}
+if (nmealog.zstandard is not None):
+    COMPRESSORS[".zst"] = lambda data: nmealog.zstandard.ZstdCompressor().compress(data)
+
+
+
+@pytest.fixture(scope="module")
+def plain(syntheticLog):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    return log
+
+
+
+@pytest.fixture(scope="module")
+def data(syntheticLog):
+    with open(syntheticLog, "rb") as f:
+        return f.read()
+
+
+
+def assertSameLog(a, b):
+    for column in COLUMNS:
+        # Byte for byte, so NaN positions before the first fix compare as well
+        assert getattr(a, column).tobytes() == getattr(b, column).tobytes(), column
+    for name in SUMMARY:
+        assert getattr(a, name) == getattr(b, name), name
+
+
+
+def writeFile(filename, data):
+    extension = os.path.splitext(filename)[1]
+    with open(filename, "wb") as f:
+        f.write(COMPRESSORS[extension](data) if (extension in COMPRESSORS) else data)
+    return filename
+
+
+
+@pytest.mark.parametrize("extension", sorted(COMPRESSORS))
+def test_compressed(plain, data, tmp_path, monkeypatch, extension):
+    monkeypatch.setattr(nmealog, "PROGRESS_BLOCK", 64 * 1024)  # many blocks, cut anywhere in a line
+    filename = writeFile(str(tmp_path / ("nmea.log" + extension)), data)
+    log = nmealog.NmeaLog(filename)
+    log.load()
+    assertSameLog(log, plain)
+    assert log.end is None
+
+
+
+def test_compressed_whole_only(data, tmp_path):
+    filename = writeFile(str(tmp_path / "nmea.log.gz"), data)
+    with pytest.raises(ValueError):
+        nmealog.NmeaLog(filename).load(start = 100)
+
+
+
+def test_truncated(data, tmp_path):
+    filename = str(tmp_path / "nmea.log.gz")
+    with open(filename, "wb") as f:
+        f.write(gzip.compress(data)[:len(data) // 10])
+    with pytest.raises(EOFError):
+        nmealog.NmeaLog(filename).load()
+
+
+
+def test_rotated(plain, data, tmp_path):
+    # Rotated as logrotate does: the newest segment under the plain name, older ones numbered and
+    # compressed. The segments are read in the order of their first fix, not their names.
+    cuts = [0] + [data.index(b"\n", len(data) * k // 4) + 1 for k in (1, 2, 3)] + [len(data)]
+    names = ["nmea.log.3.xz", "nmea.log.2.gz", "nmea.log.1", "nmea.log"]
+    for name, start, end in zip(names, cuts, cuts[1:]):
+        writeFile(str(tmp_path / name), data[start:end])
+    writeFile(str(tmp_path / "nmea.log.idx"), b"{}")  # files next to the log are no segments
+    pattern = str(tmp_path / "nmea.log*")
+    assert nmealog.logSegments(pattern) == [str(tmp_path / name) for name in names]
+    log = nmealog.NmeaLog(pattern)
+    log.load()
+    assertSameLog(log, plain)
+
+
+
+def test_no_segments(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        nmealog.logSegments(str(tmp_path / "nmea.log*"))
@@ -0,0 +1,109 @@
+import math
+import random
+
+import pytest
+
+import decimate
+import depthwaypoints
+import gpxwriter
+import nmealog
+import nmeatime
+
+# The vectorized distance filter against the per-point loop it replaced, from the layer and track
+# generators of process_depth.py
+
+
+
+def baselineKept(lats, lons, interval):
+    kept = []
+    lastlat = 0
+    lastlon = 0
+    for k, (curlat, curlon) in enumerate(zip(lats, lons)):
+        distance = math.sqrt(((curlon - lastlon) * math.cos(curlat/180*math.pi)) ** 2 + (curlat - lastlat) ** 2) * 60 * 1852
+        if (distance > 10000):
+            lastlat = curlat; lastlon = curlon
+        if (distance > float(interval)):
+            kept.append(k)
+            lastlat = curlat
+            lastlon = curlon
+    return kept
+
+
+
+def baselineTimestamp(epoch):
+    # The ddmmyyhhmmss time stamp of the baseline, formatted as it did
+    timeStamp = nmeatime.formatDate(epoch) + nmeatime.formatTimeOfDay(epoch)
+    return "20{}-{}-{}T{}:{}:{}Z".format(timeStamp[4:6], timeStamp[2:4], timeStamp[0:2], timeStamp[6:8], timeStamp[8:10], timeStamp[10:12])
+
+
+
+def randomTrack(seed, n=20000):
+    # A track that lies still, creeps, sails, and jumps more than 10 km now and then
+    rng = random.Random(seed)
+    lat, lon = 53.2, 5.3
+    lats = []
+    lons = []
+    for k in range(n):
+        mode = (k // 500) % 4
+        if (mode == 1):
+            lat += rng.gauss(0, 0.00001)
+            lon += rng.gauss(0, 0.00001)
+        elif (mode == 2):
+            lat += rng.gauss(0, 0.0003)
+            lon += rng.gauss(0, 0.0005)
+        if (rng.random() < 0.001):
+            lat += rng.choice((-1, 1)) * 0.2
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
+
+
+
+@pytest.mark.parametrize("interval", [0, 5, 15, 30, 250, 20000])
+def test_random_track(interval):
+    lats, lons = randomTrack(interval)
+    assert decimate.decimate(lats, lons, interval).tolist() == baselineKept(lats, lons, interval)
+
+
+
+@pytest.mark.parametrize("interval", [5, 15, 30])
+def test_synthetic_log(syntheticLog, interval):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    timeStamps, lats, lons, depths = log.soundingColumns(nmealog.MIN_TIME, nmealog.MAX_TIME)
+    assert decimate.decimate(lats, lons, interval).tolist() == baselineKept(lats.tolist(), lons.tolist(), interval)
+
+
+
+def test_continued_from_anchor():
+    # An incremental run carries on from the last point kept before
+    lats, lons = randomTrack(1)
+    split = len(lats) // 3
+    first = decimate.decimate(lats[:split], lons[:split], 15)
+    last = first[-1]
+    second = decimate.decimate(lats[split:], lons[split:], 15, lats[last], lons[last]) + split
+    assert first.tolist() + second.tolist() == baselineKept(lats, lons, 15)
+
+
+
+def test_decimator():
+    lats, lons = randomTrack(2)
+    decimator = decimate.Decimator(15)
+    assert [k for k, (lat, lon) in enumerate(zip(lats, lons)) if (decimator.keep(lat, lon))] == baselineKept(lats, lons, 15)
+
+
+
+def test_track_file(syntheticLog, tmp_path):
+    # The track file is byte for byte the one the baseline loop wrote
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    trackFileName = str(tmp_path / "track.gpx")
+    depthwaypoints.generateTrackFile(log, trackFileName, nmealog.MIN_TIME, nmealog.MAX_TIME)
+
+    timeStamps, lats, lons = log.fixColumns(nmealog.MIN_TIME, nmealog.MAX_TIME)
+    expected = gpxwriter.GPX_HEADER + "<trk><name></name><trkseg>"
+    for k in baselineKept(lats.tolist(), lons.tolist(), depthwaypoints.TRACK_INTERVAL):
+        expected += '  <trkpt lat="{:.6f}" lon="{:.6f}"><time>{}</time></trkpt>'.format(lats[k], lons[k], baselineTimestamp(timeStamps[k])) + "\n"
+    expected += '</trkseg></trk></gpx>'
+    with open(trackFileName) as f:
+        assert f.read() == expected
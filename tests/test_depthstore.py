@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+import pytest
+
+import depthstore
+import nmealog
+
+# The depth store against a per-sounding aggregation of the same soundings
+
+
+
+def randomSoundings(seed, n=50000):
+    # Passes over the same water, so most cells get several soundings
+    rng = np.random.default_rng(seed)
+    utcTimes = 1677448800 + np.arange(n, dtype=np.int64) * 2
+    lats = 53.2 + rng.random(n) * 0.002
+    lons = 5.3 + rng.random(n) * 0.003
+    depths = np.round(rng.random(n) * 10, 1)
+    return utcTimes, lats, lons, depths
+
+
+
+def aggregated(store, utcTimes, lats, lons, depths):
+    # {(row, col): [count, min, sum, latest, latestDepth]}, one sounding at a time
+    rows, cols = store.cells(lats, lons)
+    cells = {}
+    for key, utcTime, depth in zip(zip(rows.tolist(), cols.tolist()), utcTimes.tolist(), depths.tolist()):
+        cell = cells.get(key)
+        if (cell is None):
+            cells[key] = [1, depth, depth, utcTime, depth]
+        else:
+            cell[0] += 1
+            cell[1] = min(cell[1], depth)
+            cell[2] += depth
+            if (utcTime >= cell[3]):
+                cell[3], cell[4] = utcTime, depth
+    return cells
+
+
+
+def stored(store):
+    return {(row, col): [count, minimum, total, latest, latestDepth]
+        for row, col, count, minimum, total, latest, latestDepth in store.db.execute("SELECT * FROM cells")}
+
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = depthstore.DepthStore(str(tmp_path / "depths.db"))
+    yield store
+    store.close()
+
+
+
+def test_add(store, monkeypatch):
+    monkeypatch.setattr(depthstore, "INGEST_BLOCK", 7000)  # cells split over blocks
+    soundings = randomSoundings(1)
+    # In shuffled order and in two parts, so the latest sounding is not simply the last one added
+    order = np.random.default_rng(2).permutation(len(soundings[0]))
+    half = len(order) // 2
+    store.add(*(column[order[:half]] for column in soundings))
+    store.add(*(column[order[half:]] for column in soundings))
+    expected = aggregated(store, *soundings)
+    actual = stored(store)
+    assert actual.keys() == expected.keys()
+    for key, (count, minimum, total, latest, latestDepth) in expected.items():
+        assert actual[key][0] == count and actual[key][1] == minimum and actual[key][3] == latest and actual[key][4] == latestDepth
+        assert actual[key][2] == pytest.approx(total)
+    assert store.statistics() == (len(expected), len(order), 0)
+
+
+
+def test_cells(store):
+    # Cells are about cellSize meters square, and the centre of a cell lies in it
+    utcTimes, lats, lons, depths = randomSoundings(3)
+    rows, cols = store.cells(lats, lons)
+    centres = [store.cellCentre(row, col) for row, col in zip(rows.tolist()[:1000], cols.tolist()[:1000])]
+    centreRows, centreCols = store.cells(np.array([lat for lat, lon in centres]), np.array([lon for lat, lon in centres]))
+    assert centreRows.tolist() == rows.tolist()[:1000] and centreCols.tolist() == cols.tolist()[:1000]
+    area = 0.002 * depthstore.METERS_PER_DEGREE * 0.003 * depthstore.METERS_PER_DEGREE * np.cos(53.2 / 180 * np.pi)
+    assert len(set(zip(rows.tolist(), cols.tolist()))) == pytest.approx(area / store.cellSize ** 2, rel = 0.1)
+
+
+
+def test_cell_size_kept(tmp_path):
+    store = depthstore.DepthStore(str(tmp_path / "depths.db"), 7)
+    store.close()
+    store = depthstore.DepthStore(str(tmp_path / "depths.db"), 3)
+    assert store.cellSize == 7
+    store.close()
+
+
+
+def test_export(store, tmp_path):
+    store.add(*randomSoundings(4))
+    layerFileName = str(tmp_path / "layer.gpx")
+    for depth in ("min", "mean", "latest"):
+        cells = [(lat, lon, value) for lat, lon, value, count in store.query(depth, 5) if (value != 0)]
+        assert store.export(layerFileName, 5, depth) == len(cells)
+        with open(layerFileName) as f:
+            waypoints = re.findall(r'<wpt lat="([^"]+)" lon="([^"]+)">', f.read())
+        assert waypoints == [("{:.6f}".format(lat), "{:.6f}".format(lon)) for lat, lon, value in cells]
+    assert all(value < 5 for lat, lon, value, count in store.query("min", 5))
+
+
+
+def test_add_log(store, syntheticLog, capsys):
+    # A log added twice, or after a part of it, only adds what was not added before
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    middle = (log.firstTime + log.lastTime) // 2
+    first = depthstore.addLog(store, log, None, nmealog.MIN_TIME, middle)
+    rest = depthstore.addLog(store, log, None, nmealog.MIN_TIME, nmealog.MAX_TIME)
+    assert depthstore.addLog(store, log, None, nmealog.MIN_TIME, nmealog.MAX_TIME) is None
+    assert "in the store already" in capsys.readouterr().out
+    utcTimes, lats, lons, depths = log.soundingColumns(nmealog.MIN_TIME, nmealog.MAX_TIME)
+    assert first + rest == np.count_nonzero(depths)
+    assert store.statistics()[1:] == (first + rest, 1)
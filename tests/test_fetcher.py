@@ -0,0 +1,126 @@
+import glob
+import http.server
+import os
+import threading
+
+import pytest
+
+import tidaldata
+
+# The tide data fetcher against a local stand-in for the waterinfo server
+
+STATIONS = ["HARL", "KOBU", "WTER", "VLIE", "DENH", "OUDE"]
+
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+
+    # Serves /csv/<station> as a CSV download with an ETag, keeps connections open, and answers a
+    # request with the current ETag with 304. The first requests of a path in failures get a 503.
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        station = self.path.rsplit("/", 1)[-1]
+        etag = '"{}-{}"'.format(station, server.version)
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1], self.headers.get("If-None-Match")))
+            failing = server.failures.get(self.path, 0)
+            if (failing):
+                server.failures[self.path] = failing - 1
+        if (failing):
+            self.reply(503, b"busy")
+        elif (self.headers.get("If-None-Match") == etag):
+            self.reply(304, b"", {"ETag": etag})
+        else:
+            body = "Datum;Tijd;Parameter;Locatie;Meting;Verwachting\n1-3-2023;00:00:00;Waterhoogte;{};12;\n".format(station).encode()
+            self.reply(200, body, {"ETag": etag, "Content-Disposition": 'attachment; filename="{}.csv"'.format(station)})
+
+    def reply(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.failures = {}
+    server.version = 1
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+
+@pytest.fixture
+def dataDir(tmp_path, monkeypatch):
+    directory = str(tmp_path) + os.sep
+    monkeypatch.setattr(tidaldata, "DATADIR", directory)
+    monkeypatch.setattr(tidaldata, "FETCHSTATEFILE", directory + "fetch.json")
+    monkeypatch.setattr(tidaldata, "FETCH_RETRY_DELAY", 0)
+    return directory
+
+
+
+def urls(server, stations=STATIONS):
+    return ["http://127.0.0.1:{}/csv/{}".format(server.server_address[1], station) for station in stations]
+
+
+
+def downloaded(dataDir):
+    return sorted(os.path.basename(f).split("-", 3)[3] for f in glob.glob(dataDir + "*.csv"))
+
+
+
+def test_fetch_all(server, dataDir):
+    tidaldata.Fetcher(threads = 2).fetchAll(urls(server))
+    assert downloaded(dataDir) == sorted(station + ".csv" for station in STATIONS)
+    # Each of the 2 threads reuses its connection for the next station
+    assert len(set(port for path, port, etag in server.requests)) <= 2
+    assert len(server.requests) == len(STATIONS)
+
+
+
+def test_not_modified(server, dataDir):
+    tidaldata.Fetcher(threads = 3).fetchAll(urls(server))
+    for f in glob.glob(dataDir + "*.csv"):
+        os.remove(f)
+    # The ETags were kept, so an unchanged station is not transferred again
+    tidaldata.Fetcher(threads = 3).fetchAll(urls(server))
+    assert downloaded(dataDir) == []
+    assert all(etag is not None for path, port, etag in server.requests[len(STATIONS):])
+    # Changed data is
+    server.version = 2
+    tidaldata.Fetcher(threads = 3).fetchAll(urls(server, STATIONS[:2]))
+    assert downloaded(dataDir) == sorted(station + ".csv" for station in STATIONS[:2])
+
+
+
+def test_retry(server, dataDir):
+    server.failures["/csv/HARL"] = tidaldata.FETCH_RETRIES
+    server.failures["/csv/KOBU"] = tidaldata.FETCH_RETRIES + 1
+    tidaldata.Fetcher(threads = 2).fetchAll(urls(server, ["HARL", "KOBU"]))
+    # HARL succeeds at the last attempt; KOBU gives up after it
+    assert downloaded(dataDir) == ["HARL.csv"]
+    assert [path for path, port, etag in server.requests].count("/csv/KOBU") == tidaldata.FETCH_RETRIES + 1
+
+
+
+def test_unreachable(dataDir):
+    # A refused connection is retried and then given up, without raising
+    fetcher = tidaldata.Fetcher(threads = 1, timeout = 1)
+    fetcher.fetchAll(["http://127.0.0.1:1/csv/HARL"])
+    assert downloaded(dataDir) == []
@@ -0,0 +1,141 @@
+import json
+import re
+
+import pytest
+
+import depthwaypoints
+import nmealog
+
+# Incremental runs over a growing log add up to the layer and track of one run over the whole log
+
+INTERVAL = 15
+MAX_DEPTH = 10
+WAYPOINT = re.compile(r'<wpt lat="([^"]+)" lon="([^"]+)"><sym>([^<]+)</sym>')
+
+
+
+@pytest.fixture(scope="module")
+def data(syntheticLog):
+    with open(syntheticLog, "rb") as f:
+        return f.read()
+
+
+
+@pytest.fixture(scope="module")
+def expected(syntheticLog, tmp_path_factory):
+    # Layer and track of one run over the whole log
+    directory = tmp_path_factory.mktemp("whole")
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    layerFileName = str(directory / "layer.gpx")
+    trackFileName = str(directory / "track.gpx")
+    depthwaypoints.generateLayerFile(log, None, layerFileName, nmealog.MIN_TIME, nmealog.MAX_TIME, 0, MAX_DEPTH, INTERVAL)
+    depthwaypoints.generateTrackFile(log, trackFileName, nmealog.MIN_TIME, nmealog.MAX_TIME)
+    return waypoints(layerFileName), read(trackFileName)
+
+
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+
+
+def waypoints(layerFileName):
+    # (lat, lon, icon) of every waypoint; the scale levels are spread per run
+    return WAYPOINT.findall(read(layerFileName))
+
+
+
+class Run(object):
+
+    # Files of a growing log, and incremental runs over them
+
+    def __init__(self, directory):
+        self.logFile = str(directory / "nmea.log")
+        self.layerFileName = str(directory / "layer.gpx")
+        self.trackFileName = str(directory / "track.gpx")
+        self.checkpointFile = self.logFile + ".checkpoint"
+
+    def grow(self, data):
+        with open(self.logFile, "wb") as f:
+            f.write(data)
+
+    def run(self, interval=INTERVAL):
+        return depthwaypoints.generateIncremental(self.logFile, self.checkpointFile, None, self.layerFileName, self.trackFileName, 0, MAX_DEPTH, interval)
+
+
+
+def test_growing_log(data, expected, tmp_path, capsys):
+    # Cut anywhere, also within a line that is still being written
+    run = Run(tmp_path)
+    for part in (0.2, 0.45, 0.8, 1):
+        run.grow(data[:int(len(data) * part)])
+        run.run()
+    assert capsys.readouterr().out.count("Continuing at byte") == 3
+    assert waypoints(run.layerFileName) == expected[0]
+    assert read(run.trackFileName) == expected[1]
+
+
+
+def test_nothing_appended(data, expected, tmp_path):
+    run = Run(tmp_path)
+    run.grow(data)
+    run.run()
+    log = run.run()
+    assert log.lines == 0
+    assert waypoints(run.layerFileName) == expected[0]
+    assert read(run.trackFileName) == expected[1]
+
+
+
+def fresh(data, directory, interval):
+    # Waypoints of a first incremental run over the log
+    directory.mkdir()
+    run = Run(directory)
+    run.grow(data)
+    run.run(interval)
+    return waypoints(run.layerFileName)
+
+
+
+@pytest.mark.parametrize("change", ["settings", "layer", "log"])
+def test_start_over(data, tmp_path, capsys, change):
+    # Other settings, a layer file changed since, or a log that was replaced: everything is generated again
+    run = Run(tmp_path)
+    run.grow(data[:len(data) // 2])
+    run.run()
+    interval = INTERVAL + 1 if (change == "settings") else INTERVAL
+    if (change == "layer"):
+        with open(run.layerFileName, "a") as f:
+            f.write("\n")
+    if (change == "log"):
+        data = b"!" + data[1:]
+    run.grow(data)
+    run.run(interval)
+    assert "does not match the files or settings; starting from the beginning" in capsys.readouterr().out
+    assert waypoints(run.layerFileName) == fresh(data, tmp_path / "fresh", interval)
+
+
+
+def test_checkpoint(data, tmp_path):
+    run = Run(tmp_path)
+    half = data[:data.index(b"\n", len(data) // 2) + 1]
+    run.grow(half + b"$GPRMC,1200")
+    log = run.run()
+    with open(run.checkpointFile) as f:
+        checkpoint = json.load(f)
+    assert checkpoint["offset"] == len(half)  # up to the last complete line
+    assert checkpoint["lastFix"] == list(log.lastFix())
+    assert checkpoint["layer"]["file"] == run.layerFileName and checkpoint["track"]["file"] == run.trackFileName
+
+
+
+@pytest.mark.parametrize("output", ["--layer", "--track"])
+def test_compressed_output_refused(data, tmp_path, capsys, output):
+    # The footer of a compressed file cannot be checked, so every run would start over
+    run = Run(tmp_path)
+    run.grow(data)
+    with pytest.raises(SystemExit):
+        depthwaypoints.main([run.logFile, output, str(tmp_path / "out.gpx.gz"), "--incremental", "--no-tide"])
+    assert "cannot be compressed" in capsys.readouterr().err
@@ -0,0 +1,92 @@
+import collections
+
+import numpy as np
+import pytest
+
+import levelofdetail
+
+# Scale levels: per level, every cell with waypoints shows up to PER_CELL of them, the shallowest,
+# however often the same water was sailed and however many runs the waypoints came in
+
+
+
+def randomWaypoints(seed, n=20000):
+    rng = np.random.default_rng(seed)
+    return 53.2 + rng.random(n) * 0.05, 5.3 + rng.random(n) * 0.08, np.round(rng.random(n) * 10, 1)
+
+
+
+def cellsOf(lats, lons, level):
+    # The cells of levelofdetail.scaleLevels
+    size = level * levelofdetail.SCREEN_CELL
+    y = lats * levelofdetail.METERS_PER_DEGREE
+    x = lons * levelofdetail.METERS_PER_DEGREE * np.cos(lats / 180 * np.pi)
+    return (np.floor(y / size).astype(np.int64) * 2**32 + np.floor(x / size).astype(np.int64)).tolist()
+
+
+
+def assertSpread(lats, lons, scales, perCell):
+    # Every cell of a level shows as many waypoints as it has, up to perCell
+    for level in levelofdetail.LEVELS[:-1]:
+        cells = cellsOf(lats, lons, level)
+        waypoints = collections.Counter(cells)
+        shown = collections.Counter(cell for cell, scale in zip(cells, scales.tolist()) if (scale >= level))
+        for cell, n in waypoints.items():
+            assert shown[cell] == min(n, perCell), level
+
+
+
+@pytest.mark.parametrize("perCell", [1, 3])
+def test_spread(perCell):
+    lats, lons, depths = randomWaypoints(1)
+    scales = levelofdetail.scaleLevels(lats, lons, depths, perCell)
+    assert set(scales.tolist()) <= set(levelofdetail.LEVELS)
+    assertSpread(lats, lons, scales, perCell)
+
+
+
+def test_shallowest_first():
+    lats, lons, depths = randomWaypoints(2)
+    scales = levelofdetail.scaleLevels(lats, lons, depths)
+    coarsest = levelofdetail.LEVELS[0]
+    shallowest = {}
+    for cell, depth in zip(cellsOf(lats, lons, coarsest), depths.tolist()):
+        shallowest[cell] = min(depth, shallowest.get(cell, depth))
+    for cell, depth, scale in zip(cellsOf(lats, lons, coarsest), depths.tolist(), scales.tolist()):
+        if (scale == coarsest):
+            assert depth == shallowest[cell]
+
+
+
+def test_sailed_twice():
+    # The same water sailed twice shows as many waypoints at the coarse levels as sailed once
+    lats, lons, depths = randomWaypoints(3)
+    once = collections.Counter(levelofdetail.scaleLevels(lats, lons, depths).tolist())
+    twice = collections.Counter(levelofdetail.scaleLevels(np.r_[lats, lats], np.r_[lons, lons], np.r_[depths, depths]).tolist())
+    for level in levelofdetail.LEVELS[:-1]:
+        assert twice[level] == once[level]
+
+
+
+@pytest.mark.parametrize("runs", [2, 5])
+def test_runs(runs):
+    # Waypoints added in several runs, against the cells the earlier runs took, fill each level as
+    # one run would
+    lats, lons, depths = randomWaypoints(4)
+    taken = {}
+    parts = np.array_split(np.arange(len(lats)), runs)
+    scales = np.concatenate([levelofdetail.scaleLevels(lats[part], lons[part], depths[part], taken = taken) for part in parts])
+    assertSpread(lats, lons, scales, levelofdetail.PER_CELL)
+    assert collections.Counter(scales.tolist()) == collections.Counter(levelofdetail.scaleLevels(lats, lons, depths).tolist())
+    # Without what the earlier runs took, every run fills the coarse cells again
+    separate = np.concatenate([levelofdetail.scaleLevels(lats[part], lons[part], depths[part]) for part in parts])
+    assert collections.Counter(separate.tolist())[levelofdetail.LEVELS[0]] > collections.Counter(scales.tolist())[levelofdetail.LEVELS[0]]
+
+
+
+def test_taken_first_run():
+    lats, lons, depths = randomWaypoints(5)
+    taken = {}
+    assert np.array_equal(levelofdetail.scaleLevels(lats, lons, depths, taken = taken), levelofdetail.scaleLevels(lats, lons, depths))
+    assert sorted(taken) == sorted(str(level) for level in levelofdetail.LEVELS[:-1])
+    assert len(taken[str(levelofdetail.LEVELS[0])]) == len(set(cellsOf(lats, lons, levelofdetail.LEVELS[0])))
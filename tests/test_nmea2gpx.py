@@ -0,0 +1,131 @@
+import glob
+import gzip
+import importlib
+import os
+import re
+import shutil
+
+import pytest
+
+import nmealog
+
+# The nmea2gpx batch: log files converted together, in one process or several, into one track file
+# per day, and the manifest that keeps a log file from being converted twice. nmea2gpx works in the
+# current directory, so it is imported in a directory with its nmea/, nmea/old/ and gpx/.
+
+TRACKPOINT = re.compile(r'<trkpt lat="([^"]+)" lon="([^"]+)"><time>([^<]+)</time>')
+
+
+
+def makeWorkDir(directory):
+    for subdirectory in ("nmea/old", "gpx"):
+        os.makedirs(os.path.join(directory, subdirectory))
+
+
+
+@pytest.fixture
+def nmea2gpx(tmp_path, monkeypatch):
+    makeWorkDir(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("nmea2gpx")
+
+
+
+def splitLog(syntheticLog, parts, name="part"):
+    # The log in parts of about equal length in nmea/, split at line ends; returns their file names
+    with open(syntheticLog) as f:
+        lines = f.readlines()
+    filenames = []
+    for k in range(parts):
+        filename = "nmea/{0}{1}.log".format(name, k + 1)
+        with open(filename, "w") as f:
+            f.writelines(lines[k * len(lines) // parts:(k + 1) * len(lines) // parts])
+        filenames.append(filename)
+    return filenames
+
+
+
+def trackpoints(filename):
+    with open(filename) as f:
+        return TRACKPOINT.findall(f.read())
+
+
+
+def trackFiles():
+    return {os.path.basename(filename): open(filename).read() for filename in sorted(glob.glob("gpx/*.gpx"))}
+
+
+
+def convert(nmea2gpx, processes=1):
+    return nmea2gpx.generateTrackFiles(sorted(glob.glob("nmea/*.*")), nmealog.MIN_TIME, nmealog.MAX_TIME, processes)
+
+
+
+def test_days_merged(nmea2gpx, syntheticLog):
+    # The log spans two days; the first half and the second half both cover the first day
+    splitLog(syntheticLog, 2)
+    assert convert(nmea2gpx) == 2
+    manifest = nmea2gpx.loadManifest()
+    assert sorted(entry["file"] for entry in manifest.values()) == ["part1.log", "part2.log"]
+    assert all("2023-02-27" in entry["days"] for entry in manifest.values())
+    assert sorted(trackFiles()) == ["2023-02-27.gpx", "2023-02-28.gpx"]
+    for day in ("2023-02-27", "2023-02-28"):
+        points = trackpoints("gpx/{0}.gpx".format(day))
+        times = [time for lat, lon, time in points]
+        assert all(time.startswith(day) for time in times) and times == sorted(times)
+        assert len(points) == sum(entry["days"].get(day, 0) for entry in manifest.values())
+    assert glob.glob("nmea/*.*") == [] and sorted(os.listdir("nmea/old")) == ["part1.log", "part2.log"]
+
+
+
+def test_manifest(nmea2gpx, syntheticLog):
+    filenames = splitLog(syntheticLog, 2)
+    digests = sorted(nmea2gpx.fileDigest(filename) for filename in filenames)
+    convert(nmea2gpx)
+    assert sorted(nmea2gpx.loadManifest()) == digests
+    before = trackFiles()
+    manifest = nmea2gpx.loadManifest()
+    # The same content again, under other names and twice in one batch: nothing is converted
+    os.rename("nmea/old/part1.log", "nmea/again.log")
+    with open("nmea/old/part2.log") as f, open("nmea/copy.log", "w") as copy:
+        copy.write(f.read())
+    assert convert(nmea2gpx) == 0
+    assert trackFiles() == before and nmea2gpx.loadManifest() == manifest
+    assert glob.glob("nmea/*.*") == [] and "again.log" in os.listdir("nmea/old")
+    # New content, of which two copies: converted once
+    first, second, third = splitLog(syntheticLog, 3, "third")
+    os.remove(first)
+    os.remove(second)
+    shutil.copy(third, "nmea/copy of third3.log")
+    assert convert(nmea2gpx) == 1
+    assert len(nmea2gpx.loadManifest()) == 3
+
+
+
+def test_failed_file(nmea2gpx, syntheticLog, capsys):
+    # A truncated compressed log is reported and left in nmea/, and the other logs are converted
+    first, second = splitLog(syntheticLog, 2)
+    with open(second, "rb") as f:
+        data = gzip.compress(f.read())
+    os.remove(second)
+    with open("nmea/broken.log.gz", "wb") as f:
+        f.write(data[:len(data) // 2])
+    assert convert(nmea2gpx) == 2
+    assert "*** Could not convert nmea/broken.log.gz" in capsys.readouterr().out
+    assert glob.glob("nmea/*.*") == ["nmea/broken.log.gz"]
+    assert [entry["file"] for entry in nmea2gpx.loadManifest().values()] == ["part1.log"]
+    assert trackFiles()
+
+
+
+def test_processes(nmea2gpx, syntheticLog, tmp_path, monkeypatch):
+    # Converted in one process or several, the track files are the same
+    splitLog(syntheticLog, 3)
+    convert(nmea2gpx, 1)
+    single = trackFiles()
+    other = str(tmp_path / "other")
+    makeWorkDir(other)
+    monkeypatch.chdir(other)
+    splitLog(syntheticLog, 3)
+    convert(nmea2gpx, 3)
+    assert trackFiles() == single
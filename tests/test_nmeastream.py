@@ -0,0 +1,166 @@
+import asyncio
+import re
+import socket
+
+import numpy as np
+import pytest
+
+import depthwaypoints
+import nmealog
+import nmeastream
+import tidaldata
+
+# The live layer from a local socket replaying a log gives the waypoints of the layer generated
+# from the log file
+
+INTERVAL = 15
+MAX_DEPTH = 10
+WAYPOINT = re.compile(r'<wpt lat="([^"]+)" lon="([^"]+)"><sym>([^<]+)</sym>')
+
+
+
+def waypoints(layerFileName):
+    # (lat, lon, icon) of every waypoint; the scale levels differ, as the stream cannot know the area
+    with open(layerFileName) as f:
+        return WAYPOINT.findall(f.read())
+
+
+
+@pytest.fixture(scope="module")
+def expected(syntheticLog, tmp_path_factory):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    layerFileName = str(tmp_path_factory.mktemp("layer") / "layer.gpx")
+    depthwaypoints.generateLayerFile(log, None, layerFileName, nmealog.MIN_TIME, nmealog.MAX_TIME, 0, MAX_DEPTH, INTERVAL)
+    return waypoints(layerFileName)
+
+
+
+def lineCount(filename):
+    with open(filename, "rb") as f:
+        return sum(1 for line in f)
+
+
+
+def freePort(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+
+async def streamUntil(layer, lines, timeout=60, **kwargs):
+    # Run the stream until the layer has seen all lines, then stop it as Ctrl-C would
+    task = asyncio.ensure_future(nmeastream.stream(layer, flushInterval = 0.2, **kwargs))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (layer.lines < lines and loop.time() < deadline and not task.done()):
+        await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+
+def test_feed(syntheticLog, expected, tmp_path):
+    layer = nmeastream.LiveLayer(str(tmp_path / "live.gpx"), None, MAX_DEPTH, INTERVAL)
+    with open(syntheticLog) as f:
+        for line in f:
+            layer.feed(line)
+    layer.write(layer.take())
+    assert waypoints(layer.layerFileName) == expected
+
+
+
+def test_tcp_replay(syntheticLog, expected, tmp_path):
+    port = freePort(socket.SOCK_STREAM)
+    layer = nmeastream.LiveLayer(str(tmp_path / "live.gpx"), None, MAX_DEPTH, INTERVAL)
+
+    async def run():
+        server = asyncio.ensure_future(nmeastream.replay(syntheticLog, port, 0))
+        await asyncio.sleep(0.2)
+        try:
+            await streamUntil(layer, lineCount(syntheticLog), tcp = ("127.0.0.1", port))
+        finally:
+            server.cancel()
+
+    asyncio.run(run())
+    assert layer.lines == lineCount(syntheticLog)
+    assert waypoints(layer.layerFileName) == expected
+
+
+
+def test_udp(syntheticLog, expected, tmp_path):
+    port = freePort(socket.SOCK_DGRAM)
+    layer = nmeastream.LiveLayer(str(tmp_path / "live.gpx"), None, MAX_DEPTH, INTERVAL)
+    with open(syntheticLog, "rb") as f:
+        lines = f.readlines()
+    # A few lines per datagram, as SignalK sends them
+    datagrams = [b"".join(lines[start:start + 10]) for start in range(0, len(lines), 10)]
+    # The receiver splits datagrams on any line break, e.g. also inside a corrupt line
+    received = sum(len(datagram.decode("ascii", "replace").splitlines()) for datagram in datagrams)
+
+    async def send():
+        await asyncio.sleep(0.2)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for datagram in datagrams:
+                s.sendto(datagram, ("127.0.0.1", port))
+                await asyncio.sleep(0)  # the receiver runs in between, so the loopback drops none
+
+    async def run():
+        sender = asyncio.ensure_future(send())
+        await streamUntil(layer, received, udp = port)
+        await sender
+
+    asyncio.run(run())
+    assert layer.lines == received
+    assert waypoints(layer.layerFileName) == expected
+
+
+
+def test_bounded_memory(syntheticLog, tmp_path, monkeypatch):
+    # Waypoints are written out once MAX_PENDING of them are held, and then no longer held
+    monkeypatch.setattr(nmeastream, "MAX_PENDING", 100)
+    layer = nmeastream.LiveLayer(str(tmp_path / "live.gpx"), None, MAX_DEPTH, INTERVAL)
+    held = 0
+    with open(syntheticLog) as f:
+        for line in f:
+            layer.feed(line)
+            if (layer.full.is_set()):
+                layer.write(layer.take())
+            held = max(held, len(layer.pending))
+    assert held <= 100
+    layer.write(layer.take())
+    assert len(waypoints(layer.layerFileName)) == layer.waypoints
+
+
+
+def flatTide(firstTime, lastTime):
+    # Tidal data of one station with a water level of 0 from firstTime to lastTime
+    tidalData = tidaldata.TidalData()
+    station = tidaldata.TidalData.TidalStation("Harlingen", "", "", 53.17, 5.41, "")
+    station.times = np.arange(firstTime, lastTime + 1, 600, dtype=np.int64)
+    station.levels = np.zeros(len(station.times), dtype=np.int32)
+    tidalData.stations = {station.stationName: station}
+    return tidalData
+
+
+
+def test_held_back_for_tide(syntheticLog, expected, tmp_path):
+    # Soundings after the end of the tidal data wait for a reload that covers them
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    middle = (log.firstTime + log.lastTime) // 2
+    layer = nmeastream.LiveLayer(str(tmp_path / "live.gpx"), flatTide(log.firstTime - 600, middle), MAX_DEPTH, INTERVAL)
+    with open(syntheticLog) as f:
+        for line in f:
+            layer.feed(line)
+    assert layer.heldBack and all(epoch > layer.tideUntil for epoch, lat, lon, depth in layer.heldBack)
+    layer.write(layer.take())
+    assert waypoints(layer.layerFileName) == expected[:layer.waypoints]
+    layer.setTidalData(flatTide(log.firstTime - 600, log.lastTime + 600))
+    assert not layer.heldBack
+    layer.write(layer.take())
+    assert waypoints(layer.layerFileName) == expected
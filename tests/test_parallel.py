@@ -0,0 +1,45 @@
+import pytest
+
+import nmealog
+
+# Parsing a log in parallel chunks gives the same log as parsing it in one go
+
+COLUMNS = ["fixTime", "fixLat", "fixLon", "fixValid", "soundingDepth", "soundingFix"]
+SUMMARY = ["lines", "rmc", "dpt", "firstTime", "lastTime", "mintime", "mindate", "maxtime", "maxdate", "mindepth", "maxdepth", "minuteFixes", "end"]
+
+
+
+def loaded(filename, processes, start=0):
+    log = nmealog.NmeaLog(filename)
+    log.load(processes, start = start)
+    return log
+
+
+
+def assertSameLog(a, b):
+    for column in COLUMNS:
+        # Byte for byte, so NaN positions before the first fix compare as well
+        assert getattr(a, column).tobytes() == getattr(b, column).tobytes(), column
+    for name in SUMMARY:
+        assert getattr(a, name) == getattr(b, name), name
+
+
+
+@pytest.mark.parametrize("processes", [2, 3, 5])
+def test_parallel_same_as_serial(syntheticLog, monkeypatch, capsys, processes):
+    monkeypatch.setattr(nmealog, "PARALLEL_MIN_SIZE", 0)
+    monkeypatch.setattr(nmealog, "PARALLEL_CHUNK_SIZE", 64 * 1024)  # many chunks, cut anywhere in the log
+    parallel = loaded(syntheticLog, processes)
+    assert "chunks in {} processes".format(processes) in capsys.readouterr().out
+    assertSameLog(parallel, loaded(syntheticLog, 1))
+
+
+
+def test_parallel_from_offset(syntheticLog, monkeypatch):
+    # As an incremental load does: from the middle of the file on
+    monkeypatch.setattr(nmealog, "PARALLEL_MIN_SIZE", 0)
+    monkeypatch.setattr(nmealog, "PARALLEL_CHUNK_SIZE", 64 * 1024)
+    with open(syntheticLog, "rb") as f:
+        data = f.read()
+    start = data.index(b"\n", len(data) // 2) + 1
+    assertSameLog(loaded(syntheticLog, 4, start), loaded(syntheticLog, 1, start))
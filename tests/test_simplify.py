@@ -0,0 +1,110 @@
+import random
+import re
+
+import numpy as np
+import pytest
+
+import depthwaypoints
+import nmealog
+import simplify
+
+# Douglas-Peucker simplification: every point of the track lies within the tolerance of the
+# simplified track, which keeps the points it keeps whole
+
+
+
+def randomTrack(seed, n=20000):
+    # A track that lies still, creeps, sails and tacks
+    rng = random.Random(seed)
+    lat, lon = 53.2, 5.3
+    heading = 0.5
+    lats = []
+    lons = []
+    for k in range(n):
+        mode = (k // 500) % 3
+        if (mode == 0):
+            lat += rng.gauss(0, 0.000005)
+            lon += rng.gauss(0, 0.000005)
+        else:
+            if (rng.random() < 0.01):
+                heading += rng.choice((-1.5, 1.5))
+            lat += 0.00003 * np.cos(heading) + rng.gauss(0, 0.000003)
+            lon += 0.00005 * np.sin(heading) + rng.gauss(0, 0.000003)
+        lats.append(lat)
+        lons.append(lon)
+    return np.array(lats), np.array(lons)
+
+
+
+def maxDeviation(lats, lons, kept):
+    # Meters from every point to the segment between the kept points around it
+    x, y = simplify.project(lats, lons)
+    worst = 0.0
+    for first, last in zip(kept[:-1].tolist(), kept[1:].tolist()):
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first:last + 1] - x[first], y[first:last + 1] - y[first]
+        lengthSquared = dx * dx + dy * dy
+        t = np.clip((px * dx + py * dy) / lengthSquared, 0, 1) if (lengthSquared > 0) else 0
+        worst = max(worst, float(np.hypot(px - t * dx, py - t * dy).max()))
+    return worst
+
+
+
+@pytest.mark.parametrize("tolerance", [1, 5, 25])
+@pytest.mark.parametrize("window", [50, simplify.WINDOW])
+def test_within_tolerance(tolerance, window):
+    lats, lons = randomTrack(tolerance)
+    kept = simplify.simplify(lats, lons, tolerance, window)
+    assert kept[0] == 0 and kept[-1] == len(lats) - 1
+    assert np.all(np.diff(kept) > 0)
+    assert len(kept) < len(lats) // 5
+    # Windows are projected around their own first point, which differs by far less than a millimetre
+    assert maxDeviation(lats, lons, kept) <= tolerance * 1.0001
+
+
+
+def test_no_tolerance():
+    lats, lons = randomTrack(1, 100)
+    assert simplify.simplify(lats, lons, 0).tolist() == list(range(100))
+
+
+
+def test_straight_line():
+    lats = np.linspace(53.0, 53.1, 1000)
+    lons = np.linspace(5.0, 5.2, 1000)
+    assert simplify.simplify(lats, lons, 1).tolist() == [0, 999]
+
+
+
+def test_turning_back():
+    # Back along the same line: the turn is kept, though it lies on the line between the ends
+    lats = np.r_[np.linspace(53.0, 53.1, 500), np.linspace(53.1, 53.05, 250)[1:]]
+    lons = np.full(len(lats), 5.0)
+    assert simplify.simplify(lats, lons, 1).tolist() == [0, 499, len(lats) - 1]
+
+
+
+@pytest.mark.parametrize("window", [50, simplify.WINDOW])
+def test_simplifier(window):
+    # One point at a time, the same points as all at once
+    lats, lons = randomTrack(2)
+    simplifier = simplify.Simplifier(5, window)
+    items = []
+    for k, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+        items.extend(simplifier.add(lat, lon, k))
+    items.extend(simplifier.flush())
+    assert items == simplify.simplify(lats, lons, 5, window).tolist()
+
+
+
+def test_track_file(syntheticLog, tmp_path):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    trackFileName = str(tmp_path / "track.gpx")
+    trackpoints = depthwaypoints.generateTrackFile(log, trackFileName, nmealog.MIN_TIME, nmealog.MAX_TIME, tolerance = 10)
+    timeStamps, lats, lons = log.fixColumns(nmealog.MIN_TIME, nmealog.MAX_TIME)
+    kept = simplify.simplify(lats, lons, 10)
+    with open(trackFileName) as f:
+        points = re.findall(r'<trkpt lat="([^"]+)" lon="([^"]+)">', f.read())
+    assert trackpoints == len(points) == len(kept)
+    assert points == [("{:.6f}".format(lats[k]), "{:.6f}".format(lons[k])) for k in kept.tolist()]
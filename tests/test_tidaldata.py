@@ -0,0 +1,188 @@
+import numpy as np
+import pytest
+
+import tidaldata
+
+# Water levels of a station between its measurements, one time at a time and for arrays of times,
+# the CSV files they are read from, parsed once and then read from the cache, and the weighed water
+# levels of a batch of points against those of one point at a time
+
+T0 = 1677628800  # 2023-03-01 00:00 UTC
+
+
+
+def station(times, levels, name="Harlingen", lat=53.17, lon=5.41):
+    station = tidaldata.TidalData.TidalStation(name, "", "", lat, lon, "")
+    station.times = np.array(times, dtype=np.int64)
+    station.levels = np.array(levels, dtype=np.int32)
+    return station
+
+
+
+def tidalStation():
+    # Every 10 minutes for two hours, then a gap of more than MAX_GAP, then another hour
+    times = [T0 + k * 600 for k in range(13)] + [T0 + 7200 + tidaldata.MAX_GAP + 600 + k * 600 for k in range(7)]
+    levels = [int(100 * np.sin(t / 3600)) for t in range(len(times))]
+    return station(times, levels)
+
+
+
+def test_exact():
+    s = tidalStation()
+    assert [s.getStationWaterLevel(t) for t in s.times.tolist()] == s.levels.tolist()
+
+
+
+def test_linear(monkeypatch):
+    monkeypatch.setattr(tidaldata, "INTERPOLATION", "linear")
+    s = station([T0, T0 + 600], [-20, 40])
+    assert s.getStationWaterLevel(T0 + 150) == pytest.approx(-5)
+    assert s.getStationWaterLevel(T0 + 300) == pytest.approx(10)
+
+
+
+def test_outside():
+    s = tidalStation()
+    assert s.getStationWaterLevel(T0 - 1) is None
+    assert s.getStationWaterLevel(int(s.times[-1]) + 1) is None
+    assert station([], []).getStationWaterLevel(T0) is None
+
+
+
+def test_gap():
+    s = tidalStation()
+    assert s.getStationWaterLevel(T0 + 7200 + 600) is None
+    assert s.getStationWaterLevel(T0 + 7200) == s.levels[12]
+
+
+
+def test_cubic(monkeypatch):
+    # Exact for a cubic, where the linear interpolation is not; linear next to a gap and at the ends
+    monkeypatch.setattr(tidaldata, "INTERPOLATION", "cubic")
+    times = [T0 + k * 600 for k in range(6)]
+    s = station(times, [k * k for k in range(6)])
+    assert s.getStationWaterLevel(T0 + 2 * 600 + 300) == pytest.approx(2.5 ** 2)
+    assert s.getStationWaterLevel(T0 + 300) == pytest.approx(0.5)
+    gap = station(times[:3] + [times[3] + tidaldata.MAX_GAP] + [t + tidaldata.MAX_GAP for t in times[4:]], [k * k for k in range(6)])
+    assert gap.getStationWaterLevel(T0 + 600 + 300) == pytest.approx(2.5)
+
+
+
+@pytest.mark.parametrize("interpolation", ["linear", "cubic"])
+def test_array(interpolation, monkeypatch):
+    # The array version returns what the scalar version returns, NaN for None
+    monkeypatch.setattr(tidaldata, "INTERPOLATION", interpolation)
+    s = tidalStation()
+    utcTimes = np.arange(T0 - 1200, int(s.times[-1]) + 1200, 37, dtype=np.int64)
+    expected = [s.getStationWaterLevel(t) for t in utcTimes.tolist()]
+    actual = s.getStationWaterLevels(utcTimes)
+    assert np.array_equal(np.isnan(actual), [level is None for level in expected])
+    assert np.allclose(actual[~np.isnan(actual)], [level for level in expected if (level is not None)])
+    assert np.isnan(station([], []).getStationWaterLevels(utcTimes)).all()
+
+
+
+def writeCsv(filename, rows):
+    # waterinfo CSV of (local date, local time, level) rows; the times are UTC+1
+    with open(filename, "w") as f:
+        f.write("Datum;Tijd;Parameter;Locatie;Meting;Verwachting\n")
+        for date, time, level in rows:
+            f.write("{};{};Waterhoogte;Harlingen;{};\n".format(date, time, level))
+
+
+
+@pytest.fixture
+def dataDir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tidaldata, "DATADIR", str(tmp_path) + "/")
+    monkeypatch.setattr(tidaldata, "CACHEDIR", str(tmp_path) + "/cache/")
+    return tmp_path
+
+
+
+def csvStation():
+    return tidaldata.TidalData.TidalStation("Harlingen", "", "harl*.csv", 53.17, 5.41, "")
+
+
+
+def test_csv(dataDir):
+    writeCsv(str(dataDir / "harl1.csv"), [("1-3-2023", "01:00:00", 12), ("1-3-2023", "01:10:00", ""), ("1-3-2023", "01:20:00", -7)])
+    s = csvStation()
+    s.loadStationData()
+    assert s.times.tolist() == [T0, T0 + 1200] and s.levels.tolist() == [12, -7]
+
+
+
+def test_cache(dataDir, monkeypatch):
+    # Parsed once, then read from the cache until the file changes
+    writeCsv(str(dataDir / "harl1.csv"), [("1-3-2023", "01:00:00", 12), ("1-3-2023", "01:10:00", 14)])
+    writeCsv(str(dataDir / "harl2.csv"), [("1-3-2023", "01:10:00", 15), ("1-3-2023", "01:20:00", 18)])
+    s = csvStation()
+    s.loadStationData()
+    assert s.times.tolist() == [T0, T0 + 600, T0 + 1200] and s.levels.tolist() == [12, 15, 18]  # the most recent file wins
+    assert (dataDir / "cache" / "Harlingen.npz").exists()
+
+    parsed = []
+    readCsvFile = tidaldata.TidalData.TidalStation.readCsvFile
+
+    def countingRead(station, file):
+        parsed.append(file)
+        return readCsvFile(station, file)
+
+    monkeypatch.setattr(tidaldata.TidalData.TidalStation, "readCsvFile", countingRead)
+    cached = csvStation()
+    cached.loadStationData()
+    assert parsed == []
+    assert cached.times.tolist() == s.times.tolist() and cached.levels.tolist() == s.levels.tolist()
+
+    writeCsv(str(dataDir / "harl2.csv"), [("1-3-2023", "01:10:00", 16), ("1-3-2023", "01:20:00", 18), ("1-3-2023", "01:30:00", 21)])
+    changed = csvStation()
+    changed.loadStationData()
+    assert parsed == [str(dataDir / "harl2.csv")]
+    assert changed.levels.tolist() == [12, 16, 18, 21]
+
+
+
+def test_broken_cache(dataDir, capsys):
+    writeCsv(str(dataDir / "harl1.csv"), [("1-3-2023", "01:00:00", 12)])
+    csvStation().loadStationData()
+    (dataDir / "cache" / "Harlingen.npz").write_bytes(b"not a cache")
+    s = csvStation()
+    s.loadStationData()
+    assert "Ignoring tidal data cache" in capsys.readouterr().out
+    assert s.levels.tolist() == [12]
+
+
+
+def tidalData(nearestStations, maxRadius):
+    # Stations around the Waddenzee, each with its own tide and a gap in its own place
+    rng = np.random.default_rng(7)
+    tidalData = tidaldata.TidalData(nearestStations, maxRadius)
+    tidalData.stations = {}
+    for k in range(12):
+        times = T0 + np.arange(0, 86400, 600)
+        times = np.r_[times[:20 + 5 * k], times[21 + 5 * k + 8:]]
+        levels = (120 * np.sin(times / 44700 * 2 * np.pi + k) + rng.normal(0, 5, len(times))).astype(np.int32)
+        s = station(times, levels, "station{}".format(k), 52.9 + rng.random() * 0.5, 4.8 + rng.random() * 1.0)
+        tidalData.stations[s.stationName] = s
+    tidalData.buildIndex()
+    return tidalData
+
+
+
+@pytest.mark.parametrize("nearestStations, maxRadius", [(0, 0), (3, 0), (0, 8), (2, 10)])
+@pytest.mark.parametrize("interpolation", ["linear", "cubic"])
+def test_batch(nearestStations, maxRadius, interpolation, monkeypatch):
+    monkeypatch.setattr(tidaldata, "INTERPOLATION", interpolation)
+    monkeypatch.setattr(tidaldata, "BATCH_SIZE", 700)  # points in several blocks
+    rng = np.random.default_rng(8)
+    n = 3000
+    utcTimes = T0 - 3600 + rng.integers(0, 86400 + 7200, n)
+    lats = 52.8 + rng.random(n) * 0.7
+    lons = 4.6 + rng.random(n) * 1.4
+    expected = tidalData(nearestStations, maxRadius)
+    assert (expected.stationIndex is None) == (not nearestStations and not maxRadius)
+    levels = [expected.getWeighedWaterLevel(t, lat, lon) for t, lat, lon in zip(utcTimes.tolist(), lats.tolist(), lons.tolist())]
+    actual = tidalData(nearestStations, maxRadius)
+    assert np.allclose(actual.getWeighedWaterLevels(utcTimes, lats, lons), levels)
+    assert (actual.corrected, actual.uncorrected) == (expected.corrected, expected.uncorrected)
+    assert expected.corrected > 0 and expected.uncorrected > 0
@@ -0,0 +1,122 @@
+import glob
+import json
+import os
+import re
+
+import pytest
+
+import depthwaypoints
+import gpxwriter
+import nmealog
+
+# Tiled layer output: the tiles together hold the waypoints of the single layer file, each in the
+# tile it lies in, and a log only adds the times not added before
+
+INTERVAL = 15
+MAX_DEPTH = 10
+TILE_SIZE = 0.02
+WAYPOINT = re.compile(r'<wpt lat="([^"]+)" lon="([^"]+)"><sym>([^<]+)</sym>')
+
+
+
+@pytest.fixture(scope="module")
+def log(syntheticLog):
+    log = nmealog.NmeaLog(syntheticLog)
+    log.load()
+    return log
+
+
+
+@pytest.fixture(scope="module")
+def expected(log, tmp_path_factory):
+    layerFileName = str(tmp_path_factory.mktemp("layer") / "layer.gpx")
+    depthwaypoints.generateLayerFile(log, None, layerFileName, nmealog.MIN_TIME, nmealog.MAX_TIME, 0, MAX_DEPTH, INTERVAL)
+    return sorted(waypoints(layerFileName))
+
+
+
+def waypoints(filename):
+    with open(filename) as f:
+        return WAYPOINT.findall(f.read())
+
+
+
+def tileWaypoints(directory):
+    return sorted(waypoint for filename in glob.glob(os.path.join(directory, "*.gpx")) for waypoint in waypoints(filename))
+
+
+
+def index(directory):
+    with open(os.path.join(directory, gpxwriter.TILE_INDEX)) as f:
+        return json.load(f)
+
+
+
+def addTiles(log, directory, fromTimeStamp=nmealog.MIN_TIME, toTimeStamp=nmealog.MAX_TIME, interval=INTERVAL):
+    return depthwaypoints.generateLayerFile(log, None, directory, fromTimeStamp, toTimeStamp, 0, MAX_DEPTH, interval, tileSize = TILE_SIZE)
+
+
+
+def test_tiles(log, expected, tmp_path):
+    directory = str(tmp_path / "tiles")
+    assert addTiles(log, directory) == len(expected)
+    assert tileWaypoints(directory) == expected
+    tiles = index(directory)["tiles"]
+    assert len(tiles) > 1
+    for name, tile in tiles.items():
+        inside = waypoints(os.path.join(directory, name))
+        assert len(inside) == tile["waypoints"]
+        for lat, lon, icon in inside:
+            assert tile["south"] <= float(lat) < tile["north"] and tile["west"] <= float(lon) < tile["east"]
+
+
+
+def test_added_once(log, expected, tmp_path, capsys):
+    directory = str(tmp_path / "tiles")
+    addTiles(log, directory)
+    assert addTiles(log, directory) == 0
+    assert "not added again" in capsys.readouterr().out
+    assert tileWaypoints(directory) == expected
+
+
+
+def test_log_that_grew(log, expected, tmp_path):
+    # The first half of the log, then all of it: only the second half is added
+    directory = str(tmp_path / "tiles")
+    middle = (log.firstTime + log.lastTime) // 2
+    addTiles(log, directory, nmealog.MIN_TIME, middle)
+    addTiles(log, directory)
+    trips = index(directory)["trips"]
+    assert [(trip["from"], trip["to"]) for trip in trips] == [(nmealog.MIN_TIME, middle), (middle + 1, nmealog.MAX_TIME)]
+    assert sum(trip["waypoints"] for trip in trips) == len(expected)
+    assert sum(tile["waypoints"] for tile in index(directory)["tiles"].values()) == len(tileWaypoints(directory))
+
+
+
+def test_other_settings(log, tmp_path):
+    directory = str(tmp_path / "tiles")
+    addTiles(log, directory)
+    with pytest.raises(ValueError):
+        addTiles(log, directory, interval = INTERVAL + 1)
+
+
+
+def test_all_or_nothing(log, tmp_path, monkeypatch):
+    # A failure while writing the tiles leaves all of them, and the index, as they were
+    directory = str(tmp_path / "tiles")
+    middle = (log.firstTime + log.lastTime) // 2
+    addTiles(log, directory, nmealog.MIN_TIME, middle)
+    before = {filename: open(filename).read() for filename in glob.glob(os.path.join(directory, "*"))}
+    finished = []
+
+    def finish(writer):
+        if (len(finished) == 2):
+            raise OSError("disk full")
+        finished.append(writer.filename)
+        finishTile(writer)
+
+    finishTile = gpxwriter.GpxWriter.finish
+    monkeypatch.setattr(gpxwriter.GpxWriter, "finish", finish)
+    with pytest.raises(OSError):
+        addTiles(log, directory)
+    assert {filename: open(filename).read() for filename in glob.glob(os.path.join(directory, "*"))} == before
@@ -0,0 +1,110 @@
+import shutil
+
+import numpy as np
+import pytest
+
+import nmealog
+
+# A time window read through the time index holds the same fixes and soundings as the whole log
+
+
+
+@pytest.fixture
+def logFile(syntheticLog, tmp_path):
+    # A copy, so the index is written next to it
+    filename = str(tmp_path / "nmea.log")
+    shutil.copyfile(syntheticLog, filename)
+    return filename
+
+
+
+def loaded(filename):
+    log = nmealog.NmeaLog(filename)
+    log.load()
+    return log
+
+
+
+def assertSameColumns(a, b):
+    for x, y in zip(a, b):
+        assert np.array_equal(x, y)
+
+
+
+def test_summary_from_index(logFile):
+    full = nmealog.NmeaLog(logFile)
+    full.open()
+    assert full.timeIndex is None
+    indexed = nmealog.NmeaLog(logFile)
+    indexed.open()
+    assert indexed.timeIndex is not None
+    assert len(indexed.fixTime) == 0
+    for name in ["lines", "rmc", "dpt", "firstTime", "lastTime", "mintime", "mindate", "maxtime", "maxdate", "mindepth", "maxdepth", "end"]:
+        assert getattr(indexed, name) == getattr(full, name), name
+
+
+
+@pytest.mark.parametrize("fromPart, toPart", [(0, 1), (0.25, 0.5), (0.5, 0.51), (0.9, 1)])
+def test_window(logFile, fromPart, toPart):
+    full = loaded(logFile)
+    nmealog.NmeaLog(logFile).open()
+    indexed = nmealog.NmeaLog(logFile)
+    indexed.open()
+    first, last = full.firstTime, full.lastTime
+    fromTimeStamp = int(first + (last - first) * fromPart)
+    toTimeStamp = int(first + (last - first) * toPart)
+    window = indexed.window(fromTimeStamp, toTimeStamp)
+    assert len(window.fixTime) < len(full.fixTime) or (fromPart, toPart) == (0, 1)
+    assertSameColumns(window.soundingColumns(fromTimeStamp, toTimeStamp), full.soundingColumns(fromTimeStamp, toTimeStamp))
+    assertSameColumns(window.fixColumns(fromTimeStamp, toTimeStamp), full.fixColumns(fromTimeStamp, toTimeStamp))
+
+
+
+def test_outside_the_log(logFile):
+    nmealog.NmeaLog(logFile).open()
+    indexed = nmealog.NmeaLog(logFile)
+    indexed.open()
+    window = indexed.window(indexed.lastTime + 3600, indexed.lastTime + 7200)
+    assert len(window.fixTime) == 0 and len(window.soundingDepth) == 0
+
+
+
+def test_extended_by_incremental_loads(logFile, tmp_path):
+    # Loading a growing log part by part leaves the same index as indexing it at once
+    with open(logFile, "rb") as f:
+        data = f.read()
+    growing = str(tmp_path / "growing.log")
+    index = nmealog.TimeIndex(growing)
+    log = nmealog.NmeaLog(growing)
+    start = 0
+    for part in (0.3, 0.7, 1):
+        with open(growing, "wb") as f:
+            f.write(data[:int(len(data) * part)])
+        index.load()
+        log.load(start = start, completeLines = True, index = index)
+        start = log.end
+        assert index.holds(start)  # up to the last complete line
+    assert index.current()
+
+    nmealog.NmeaLog(logFile).open()
+    whole = nmealog.TimeIndex(logFile)
+    whole.load()
+    for name in ["size", "head", "lines", "rmc", "dpt", "firstTime", "lastTime", "mindepth", "maxdepth"]:
+        assert getattr(index, name) == getattr(whole, name), name
+    assert [entry[:2] for entry in index.minutes] == [entry[:2] for entry in whole.minutes]
+
+
+
+def test_stale_index(logFile):
+    nmealog.NmeaLog(logFile).open()
+    with open(logFile, "ab") as f:
+        f.write(b"$GPDPT,1.0,0.0\n")
+    log = nmealog.NmeaLog(logFile)
+    log.open()
+    assert log.timeIndex is None
+    # A log replaced by another of the same size
+    with open(logFile, "r+b") as f:
+        f.write(b"$GPXXX")
+    log = nmealog.NmeaLog(logFile)
+    log.open()
+    assert log.timeIndex is None
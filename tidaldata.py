@@ -1,47 +1,240 @@
+import calendar
 import csv
 import glob
 from datetime import datetime
 import pytz
 import math
+import numpy as np
 import os
-import locale
 
+import concurrent.futures
 import http.client
+import json
 import re
+import threading
+import time
 from urllib.parse import urlparse
 
+import instrumentation
+
 STATIONSFILE = "tidalstations.conf"
 DATADIR = "data/"
+CACHEDIR = DATADIR + "cache/"  # parsed CSV files, one .npz per station
+INTERPOLATION = "linear"  # "linear" or "cubic" interpolation between water level measurements
+MAX_GAP = 3600            # seconds; no water level is interpolated across larger gaps in a series
+BATCH_SIZE = 65536        # points per block in getWeighedWaterLevels, bounding the station-by-point matrices
+NEAREST_STATIONS = 0      # weigh only this many nearest stations; 0 for all stations
+MAX_RADIUS = 0            # NM; ignore stations further away than this; 0 for no limit
+CELL_SIZE = 2             # NM; grid cell of the station index. Points in one cell share their candidate stations.
+SETTINGS = {"nearest": ("nearestStations", int), "max_radius": ("maxRadius", float)}  # name<TAB>value rows of STATIONSFILE
+FETCHSTATEFILE = DATADIR + "fetch.json"  # ETag/Last-Modified of the last download per URL
+FETCH_THREADS = 6
+FETCH_TIMEOUT = 30        # seconds
+FETCH_RETRIES = 2
+FETCH_RETRY_DELAY = 1     # seconds, doubled on every retry
+
+
+
+class Fetcher(object):
+
+    # Downloads tidal data CSV files concurrently. Every worker thread keeps one open connection per
+    # host and reuses it for the next download. Requests time out and are retried, and carry the
+    # ETag/Last-Modified of the previous download of the same URL, so unchanged data is not transferred.
+
+    def __init__(self, threads=FETCH_THREADS, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES):
+        self.threads = threads
+        self.timeout = timeout
+        self.retries = retries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.state = {}  # url: {"etag": ..., "lastModified": ...}
+        try:
+            with open(FETCHSTATEFILE) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+
+
+    def fetchAll(self, urls):
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+            list(pool.map(self.fetch, urls))
+        self.saveState()
+
+
+
+    def saveState(self):
+        try:
+            with open(FETCHSTATEFILE + ".tmp", "w") as f:
+                json.dump(self.state, f, indent=1)
+            os.replace(FETCHSTATEFILE + ".tmp", FETCHSTATEFILE)
+        except OSError as e:
+            print ("*** Could not save {}: {}".format(FETCHSTATEFILE, str(e)))
+
+
+
+    def connection(self, o):
+        # This thread's connection to the host of the parsed url o
+        connections = getattr(self.local, "connections", None)
+        if (connections is None):
+            connections = self.local.connections = {}
+        key = (o.scheme, o.netloc)
+        if (key not in connections):
+            if (o.scheme == "http"):
+                connections[key] = http.client.HTTPConnection(o.netloc, timeout = self.timeout)
+            else:
+                import ssl
+                connections[key] = http.client.HTTPSConnection(o.netloc, timeout = self.timeout, context = ssl._create_unverified_context())
+        return connections[key]
+
+
+
+    def dropConnection(self, o):
+        conn = self.local.connections.pop((o.scheme, o.netloc), None)
+        if (conn is not None):
+            conn.close()
+
+
+
+    def fetch(self, url):
+        o = urlparse(url)
+        with self.lock:
+            previous = dict(self.state.get(url, {}))
+        headers = {}
+        if ("etag" in previous):
+            headers["If-None-Match"] = previous["etag"]
+        if ("lastModified" in previous):
+            headers["If-Modified-Since"] = previous["lastModified"]
+
+        for attempt in range(self.retries + 1):
+            try:
+                conn = self.connection(o)
+                conn.request("GET", "{}?{}".format(o.path, o.query) if o.query else o.path, headers = headers)
+                r1 = conn.getresponse()
+                data1 = r1.read()
+                if (r1.status < 500):
+                    break
+                print ("*** {} from {} (attempt {})".format(r1.status, url, attempt + 1))
+            except (OSError, http.client.HTTPException) as e:
+                print ("*** Could not retrieve {} (attempt {}): {}".format(url, attempt + 1, str(e)))
+                self.dropConnection(o)
+                r1 = None
+            if (attempt < self.retries):
+                time.sleep(FETCH_RETRY_DELAY * 2 ** attempt)
+
+        if (r1 is None):
+            return
+        if (r1.status == 304):
+            print ("Not modified: {}".format(url))
+            return
+        if (r1.status != 200):
+            print ("*** Could not retrieve {}".format(url))
+            return
+        d = r1.headers['content-disposition']
+        #print (d)
+        if (d is not None and "filename=" in d):
+            fname = re.findall("filename=(.+)", d)[0].split(";")[0].strip('"')
+        else:
+            fname = os.path.basename(o.path)
+        
+        print ("Fetching {} from {}...".format(fname, o.netloc))
+
+        dateStamp = datetime.now().strftime("%Y-%m-%d-")
+        f = open(DATADIR + dateStamp + fname, "wb")
+        f.write(data1)
+        f.close()
+
+        validators = {}
+        if (r1.headers['etag'] is not None):
+            validators["etag"] = r1.headers['etag']
+        if (r1.headers['last-modified'] is not None):
+            validators["lastModified"] = r1.headers['last-modified']
+        with self.lock:
+            self.state[url] = validators
 
 
 
 def getHttps(url):
-    o = urlparse(url)
-    import ssl
-    conn = http.client.HTTPSConnection(o.netloc, context = ssl._create_unverified_context())
-    conn.request("GET", "{}?{}".format(o.path, o.query))
-
-    r1 = conn.getresponse()
-    if (r1.status != 200):
-        print ("*** Could not retrieve {}".format(url))
-        return
-    d = r1.headers['content-disposition']
-    #print (d)
-    fname = re.findall("filename=(.+)", d)[0].split(";")[0]
-    
-    print ("Fetching {} from {}...".format(fname, o.netloc))
+    fetcher = Fetcher()
+    fetcher.fetch(url)
+    fetcher.saveState()
 
-    data1 = r1.read()
     
-    dateStamp = datetime.now().strftime("%Y-%m-%d-")
-    f = open(DATADIR + dateStamp + fname, "wb")
-    f.write(data1)
-    f.close()
     
-    conn.close()
+class StationIndex(object):
+
+    # Grid index over the tidal stations, on an equirectangular projection in NM. For each grid cell it
+    # selects the stations that take part in the weighing for points in that cell: the nearest ones to
+    # the cell centre, within the radius (plus half a cell diagonal, so none is missed near the edges).
+    # The selection for the last cell is kept, so consecutive points of a track reuse it.
+
+    def __init__(self, stations, nearest, maxRadius, cellSize):
+        self.stations = stations
+        self.nearest = nearest
+        self.maxRadius = maxRadius
+        self.cellSize = cellSize
+        self.cosLat = math.cos(sum(station.stationLat for station in stations) / len(stations) / 180 * math.pi)
+        self.grid = {}
+        for k, station in enumerate(stations):
+            self.grid.setdefault(self.cell(station.stationLat, station.stationLon), []).append(k)
+        self.lastCell = None
+        self.lastNeighbours = None
+
+
+
+    def cell(self, lat, lon):
+        return (int(math.floor(lon * 60 * self.cosLat / self.cellSize)), int(math.floor(lat * 60 / self.cellSize)))
+
+
+
+    def cells(self, lats, lons):
+        # Array version of cell(): the cell x and y of every point
+        return (np.floor(lons * 60 * self.cosLat / self.cellSize).astype(np.int64), np.floor(lats * 60 / self.cellSize).astype(np.int64))
+
+
+
+    def neighbours(self, lat, lon):
+        # Indices into self.stations of the stations to weigh for a point at lat, lon
+        return self.cellNeighbours(self.cell(lat, lon))
+
+
+
+    def cellNeighbours(self, cell):
+        if (cell != self.lastCell):
+            self.lastNeighbours = self.searchCell(cell)
+            self.lastCell = cell
+        return self.lastNeighbours
+
+
+
+    def searchCell(self, cell):
+        # Visit the occupied grid cells in rings of increasing distance around the cell, until the
+        # nearest stations are certain to be found
+        cx, cy = cell
+        x = (cx + 0.5) * self.cellSize
+        y = (cy + 0.5) * self.cellSize
+        limit = self.maxRadius + self.cellSize * math.sqrt(0.5) if self.maxRadius else math.inf
+        rings = sorted((max(abs(gx - cx), abs(gy - cy)), (gx, gy)) for (gx, gy) in self.grid)
+        found = []
+        for ring, gridCell in rings:
+            # Stations in this ring and beyond are at least this far from the cell centre
+            reach = max(ring - 0.5, 0) * self.cellSize
+            if (reach > limit):
+                break
+            if (self.nearest and len(found) >= self.nearest and sorted(found)[self.nearest - 1][0] <= reach):
+                break
+            for k in self.grid[gridCell]:
+                station = self.stations[k]
+                d = math.hypot(station.stationLon * 60 * self.cosLat - x, station.stationLat * 60 - y)
+                if (d <= limit):
+                    found.append((d, k))
+        found.sort()
+        if (self.nearest):
+            found = found[:self.nearest]
+        return tuple(sorted(k for d, k in found))
+
+
 
-    
-    
 class TidalData(object):
 
     FETCH_DATA = 1
@@ -52,6 +245,22 @@ class TidalData(object):
     corrected = 0
     uncorrected = 0
 
+    nearestStations = NEAREST_STATIONS
+    maxRadius = MAX_RADIUS
+    stationIndex = None  # StationIndex when the weighing is limited to nearby stations
+
+
+
+    def __init__(self, nearestStations=None, maxRadius=None):
+        # nearestStations and maxRadius, when given, take precedence over the settings in STATIONSFILE
+        self.overrides = set()
+        if (nearestStations is not None):
+            self.nearestStations = nearestStations
+            self.overrides.add("nearestStations")
+        if (maxRadius is not None):
+            self.maxRadius = maxRadius
+            self.overrides.add("maxRadius")
+
     
     class TidalStation (object):
     
@@ -64,50 +273,200 @@ class TidalData(object):
             self.stationLon = float(stationLon)
             self.stationSource = stationSource
             
-            self.waterLevel = {} # dict of waterLevel measurements
+            # Water level series, sorted by time: UTC epoch seconds and centimetres
+            self.times = np.zeros(0, dtype=np.int64)
+            self.levels = np.zeros(0, dtype=np.int32)
  
  
  
         def loadStationData(self):
-            # For this station, read tidal data from all CSV files that are defined for it, into self.waterLevel{} records
+            # For this station, read tidal data from all CSV files that are defined for it into the sorted
+            # self.times/self.levels series. Where downloads overlap, the most recent file wins.
+            # Parsed files are kept in a per-station cache; only new or changed CSV files are parsed.
             print ("Loading {} for {}".format(self.csvFileName, self.stationName))
-            locale.setlocale(locale.LC_ALL, 'en_US')
-            local=pytz.timezone('Etc/GMT-1')
-            
-            f = 0
-            for file in glob.glob(DATADIR + self.csvFileName):
-                with open(file) as csvfile:
-                    tidalRows = csv.reader(csvfile, delimiter=';')
-                    headers = next(tidalRows, None)
-                    n = 0
-                    for row in tidalRows:
-                        try:
-                            date_time_str = row[0] + " " + row[1];  # e.g. 26-2-2022 16:20:00
-                            date_time_obj = datetime.strptime(date_time_str, '%d-%m-%Y %H:%M:%S')
-                            date_time_utc = local.localize(date_time_obj, is_dst=None).astimezone(pytz.utc).replace(tzinfo=None).isoformat()
-                            if (row[4] != ""):
-                                self.waterLevel[date_time_utc] = row[4]
-                                n += 1
-                        except Exception as e:
-                            print ("*** loadStationData: (file = {}, row={}, error = {}".format(file, row, str(e)))
-                            pass
-                    print ("- file {} read; {} waterLevels.".format(file, n))
-                    f += 1
+            cache = self.readCache()
+            series = []
+            cached = 0
+            for file in sorted(glob.glob(DATADIR + self.csvFileName)):
+                name = os.path.basename(file)
+                stat = os.stat(file)
+                entry = cache.get(name)
+                if (entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime):
+                    times, levels = entry[2], entry[3]
+                    cached += 1
+                else:
+                    times, levels = self.readCsvFile(file)
+                series.append((name, stat.st_size, stat.st_mtime, times, levels))
                     
-            if (f == 0):
+            if (len(series) == 0):
                 print ("No file: go online and press Fetch to download csv files.")
+            elif (cached > 0):
+                print ("- {} file(s) from cache.".format(cached))
+            if (cached != len(series) or len(cache) != len(series)):
+                self.writeCache(series)
+
+            # Merge in file order; of equal times, the last one (from the most recent file) is kept
+            times = np.concatenate([np.zeros(0, dtype=np.int64)] + [entry[3] for entry in series])
+            levels = np.concatenate([np.zeros(0, dtype=np.int32)] + [entry[4] for entry in series])
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            levels = levels[order]
+            last = np.append(times[1:] != times[:-1], True)
+            self.times = times[last]
+            self.levels = levels[last]
+
+
+
+        def readCsvFile(self, file):
+            # Parse one waterinfo CSV file into arrays of UTC epoch seconds and centimetres.
+            # The dates are all-numeric, so no locale is needed.
+            local=pytz.timezone('Etc/GMT-1')
+            times = []
+            levels = []
+            with open(file) as csvfile:
+                tidalRows = csv.reader(csvfile, delimiter=';')
+                headers = next(tidalRows, None)
+                for row in tidalRows:
+                    try:
+                        date_time_str = row[0] + " " + row[1];  # e.g. 26-2-2022 16:20:00
+                        date_time_obj = datetime.strptime(date_time_str, '%d-%m-%Y %H:%M:%S')
+                        date_time_utc = local.localize(date_time_obj, is_dst=None).astimezone(pytz.utc)
+                        if (row[4] != ""):
+                            levels.append(int(row[4]))
+                            times.append(calendar.timegm(date_time_utc.timetuple()))
+                    except Exception as e:
+                        print ("*** loadStationData: (file = {}, row={}, error = {}".format(file, row, str(e)))
+                        pass
+            print ("- file {} read; {} waterLevels.".format(file, len(times)))
+            return np.array(times, dtype=np.int64), np.array(levels, dtype=np.int32)
 
 
 
-        def getStationWaterLevel (self, utcTimeStamp):
+        def cacheFileName(self):
+            return CACHEDIR + re.sub(r"\W", "_", self.stationName) + ".npz"
+
+
+
+        def readCache(self):
+            # {file name: (size, mtime, times, levels)} from this station's cache, empty if there is none
+            cache = {}
+            try:
+                with np.load(self.cacheFileName()) as npz:
+                    for k, (name, size, mtime) in enumerate(zip(npz["names"].tolist(), npz["sizes"].tolist(), npz["mtimes"].tolist())):
+                        cache[name] = (size, mtime, npz["times{}".format(k)], npz["levels{}".format(k)])
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print ("*** Ignoring tidal data cache {}: {}".format(self.cacheFileName(), str(e)))
+            return cache
+
+
+
+        def writeCache(self, series):
+            # Write the parsed files to this station's cache, replacing it atomically
+            if (not os.path.exists(CACHEDIR)):
+                os.mkdir(CACHEDIR)
+            arrays = {
+                "names": np.array([entry[0] for entry in series], dtype=str),
+                "sizes": np.array([entry[1] for entry in series], dtype=np.int64),
+                "mtimes": np.array([entry[2] for entry in series], dtype=np.float64),
+            }
+            for k, entry in enumerate(series):
+                arrays["times{}".format(k)] = entry[3]
+                arrays["levels{}".format(k)] = entry[4]
+            tmpFileName = self.cacheFileName() + ".tmp"
             try:
-                result = int(self.waterLevel[utcTimeStamp])
-            except:
-                result = None
+                with open(tmpFileName, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(tmpFileName, self.cacheFileName())
+            except Exception as e:
+                print ("*** Could not write tidal data cache {}: {}".format(self.cacheFileName(), str(e)))
+
+
+
+        def getStationWaterLevel (self, utcTime):
+            # Water level in cm at the given UTC epoch time, interpolated between measurements,
+            # or None outside the series or within a gap of more than MAX_GAP seconds
+            times = self.times
+            i = int(np.searchsorted(times, utcTime, side='right'))
+            if (i == 0):
+                return None
+            if (times[i-1] == utcTime):
+                return int(self.levels[i-1])
+            if (i == len(times) or times[i] - times[i-1] > MAX_GAP):
+                return None
+            return self.interpolate(i-1, utcTime)
+
+
+
+        def interpolate(self, k, t):
+            # Interpolate between measurement k and k+1
+            times = self.times
+            levels = self.levels
+            t0 = int(times[k])
+            t1 = int(times[k+1])
+            v0 = float(levels[k])
+            v1 = float(levels[k+1])
+            h = t1 - t0
+            s = (t - t0) / h
+            if (INTERPOLATION == "cubic" and k > 0 and k + 2 < len(times)
+                    and t0 - times[k-1] <= MAX_GAP and times[k+2] - t1 <= MAX_GAP):
+                # Cubic Hermite with Catmull-Rom slopes from the neighbouring measurements
+                m0 = (v1 - float(levels[k-1])) / (t1 - int(times[k-1])) * h
+                m1 = (float(levels[k+2]) - v0) / (int(times[k+2]) - t0) * h
+                s2 = s * s
+                s3 = s2 * s
+                return (2*s3 - 3*s2 + 1) * v0 + (s3 - 2*s2 + s) * m0 + (-2*s3 + 3*s2) * v1 + (s3 - s2) * m1
+            return v0 + (v1 - v0) * s
+
+
+
+        def getStationWaterLevels (self, utcTimes):
+            # Array version of getStationWaterLevel: water levels in cm at an array of UTC epoch
+            # times, with NaN where getStationWaterLevel would return None
+            utcTimes = np.asarray(utcTimes, dtype=np.int64)
+            result = np.full(len(utcTimes), np.nan)
+            times = self.times
+            levels = self.levels
+            if (len(times) == 0):
+                return result
+            i = np.searchsorted(times, utcTimes, side='right')
+            before = np.maximum(i - 1, 0)
+            after = np.minimum(i, len(times) - 1)
+            exact = (i > 0) & (times[before] == utcTimes)
+            inner = (i > 0) & (i < len(times)) & ~exact & (times[after] - times[before] <= MAX_GAP)
+            result[exact] = levels[before[exact]]
+
+            k = before[inner]
+            t = utcTimes[inner]
+            t0 = times[k]
+            t1 = times[k+1]
+            v0 = levels[k].astype(np.float64)
+            v1 = levels[k+1].astype(np.float64)
+            h = t1 - t0
+            s = (t - t0) / h
+            value = v0 + (v1 - v0) * s
+            if (INTERPOLATION == "cubic"):
+                # Same cubic Hermite as interpolate(), where both neighbouring measurements exist
+                kPrev = np.maximum(k - 1, 0)
+                kNext = np.minimum(k + 2, len(times) - 1)
+                cubic = (k > 0) & (k + 2 < len(times)) & (t0 - times[kPrev] <= MAX_GAP) & (times[kNext] - t1 <= MAX_GAP)
+                m0 = (v1 - levels[kPrev]) / (t1 - times[kPrev]) * h
+                m1 = (levels[kNext] - v0) / (times[kNext] - t0) * h
+                s2 = s * s
+                s3 = s2 * s
+                value = np.where(cubic, (2*s3 - 3*s2 + 1) * v0 + (s3 - 2*s2 + s) * m0 + (-2*s3 + 3*s2) * v1 + (s3 - s2) * m1, value)
+            result[inner] = value
             return result
 
 
 
+        def getStationDistances(self, lats, lons):
+            # Array version of getStationDistance, in NM
+            return np.sqrt(((lons - self.stationLon) * np.cos(lats/180*math.pi)) ** 2 + (lats - self.stationLat) ** 2) * 60
+
+
+
         def getStationDistance(self, lat, lon):
             # Get the distance between the given latlon position to this station, in NM
             distance = math.sqrt(((lon - self.stationLon) * math.cos(lat/180*math.pi)) ** 2 + (lat - self.stationLat) ** 2) * 60
@@ -125,13 +484,30 @@ class TidalData(object):
             os.rename (file, DATADIR + file)
         try:
             with open (STATIONSFILE, newline='') as stationsfile:
-                allstations = csv.reader(stationsfile, delimiter='\t')
+                allstations = []
+                # A station per row; rows of a name and a value are settings, rows starting with # comments
+                for row in csv.reader(stationsfile, delimiter='\t'):
+                    if (len(row) == 0 or row[0].startswith("#")):
+                        continue
+                    if (len(row) == 2):
+                        self.setting(row[0].strip(), row[1].strip())
+                    else:
+                        allstations.append(row)
+            if (action == self.FETCH_DATA):
+                with instrumentation.stage("tide fetch"):
+                    Fetcher().fetchAll([row[5] for row in allstations])
+            # A new table, so a reload never changes the stations another TidalData is weighing with
+            stations = {}
+            with instrumentation.stage("tide load"):
                 for row in allstations:
                     tidalStation = self.TidalStation(row[0], row[1], row[2], row[3], row[4], row[5])
-                    self.stations[row[0]] = tidalStation
-                    if (action == self.FETCH_DATA):
-                        getHttps(row[5])
+                    stations[row[0]] = tidalStation
                     tidalStation.loadStationData()
+            self.stations = stations
+            self.buildIndex()
+            if (self.nearestStations or self.maxRadius):
+                print ("Weighing {}{}".format("the {} nearest stations".format(self.nearestStations) if (self.nearestStations) else "all stations",
+                    " within {} NM".format(self.maxRadius) if (self.maxRadius) else ""))
             print ("OK - Tidal stations processed.")
         except Exception as e:
             print (str(e))
@@ -140,17 +516,44 @@ class TidalData(object):
 
 
 
-    def getWeighedWaterLevel(self, utcTimeStamp, lat, lon):
+    def setting(self, name, value):
+        if (name not in SETTINGS):
+            raise ValueError("unknown setting '{}' in {}; expected one of {}".format(name, STATIONSFILE, ", ".join(SETTINGS)))
+        attribute, kind = SETTINGS[name]
+        if (attribute not in self.overrides):
+            setattr(self, attribute, kind(value))
+
+
+
+    def buildIndex(self):
+        # Spatial index of the stations, when the weighing is limited to the nearest stations or a radius
+        stations = list(self.stations.values())
+        if ((self.nearestStations or self.maxRadius) and len(stations) > 0):
+            self.stationIndex = StationIndex(stations, self.nearestStations, self.maxRadius, CELL_SIZE)
+        else:
+            self.stationIndex = None
+
+
+
+    def getWeighedWaterLevel(self, utcTime, lat, lon):
+        instrumentation.count("tide lookups")
         m = 0
         n = 0
+        distanceToStation = None
         try:
-            for station in self.stations:
-                distanceToStation = self.stations[station].getStationDistance(lat, lon)
+            if (self.stationIndex is None):
+                stations = self.stations.values()
+            else:
+                stations = [self.stationIndex.stations[k] for k in self.stationIndex.neighbours(lat, lon)]
+            for station in stations:
+                distanceToStation = station.getStationDistance(lat, lon)
+                if (self.maxRadius and distanceToStation > self.maxRadius):
+                    continue
                 weighingFactor = 1 / distanceToStation
-                waterLevel = self.stations[station].getStationWaterLevel(utcTimeStamp)
+                waterLevel = station.getStationWaterLevel(utcTime)
                 
                 if (waterLevel != None):
-                    m += self.stations[station].getStationWaterLevel(utcTimeStamp) * weighingFactor
+                    m += waterLevel * weighingFactor
                     n += weighingFactor
                 
             if (n != 0):
@@ -161,7 +564,7 @@ class TidalData(object):
                 self.uncorrected += 1
             
         except Exception as e:
-                print ("*** getWeighedWaterLevel:", utcTimeStamp, lat, lon, n, m, distanceToStation, str(e))
+                print ("*** getWeighedWaterLevel:", utcTime, lat, lon, n, m, distanceToStation, str(e))
                 self.uncorrected += 1
                 result = 0
                 
@@ -169,8 +572,75 @@ class TidalData(object):
 
 
 
+    def getWeighedWaterLevels(self, utcTimes, lats, lons):
+        # Batch version of getWeighedWaterLevel for arrays of UTC epoch times and positions; returns an
+        # array of water levels in m. Works through the points in blocks of BATCH_SIZE, and within a
+        # block per group of points that share their stations (all stations, without an index).
+        utcTimes = np.asarray(utcTimes, dtype=np.int64)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        result = np.zeros(len(utcTimes))
+        corrected = np.zeros(len(utcTimes), dtype=bool)
+        allStations = list(self.stations.values())
+        index = self.stationIndex
+        instrumentation.count("tide lookups", len(utcTimes))
+        with instrumentation.stage("tide lookup"):
+            for start in range(0, len(utcTimes), BATCH_SIZE):
+                end = min(start + BATCH_SIZE, len(utcTimes))
+                if (index is None):
+                    groups = {tuple(range(len(allStations))): np.arange(start, end)}
+                else:
+                    cx, cy = index.cells(lats[start:end], lons[start:end])
+                    cellKeys, inverse = np.unique(np.stack((cx, cy), axis=1), axis=0, return_inverse=True)
+                    inverse = inverse.reshape(-1)
+                    groups = {}
+                    for c, (x, y) in enumerate(cellKeys.tolist()):
+                        members = start + np.flatnonzero(inverse == c)
+                        neighbours = index.cellNeighbours((x, y))
+                        groups[neighbours] = np.concatenate((groups[neighbours], members)) if (neighbours in groups) else members
+                for neighbours, points in groups.items():
+                    if (len(neighbours) == 0):
+                        continue
+                    stations = [allStations[k] for k in neighbours]
+                    level, ok = self.weighStations(stations, utcTimes[points], lats[points], lons[points])
+                    result[points] = level
+                    corrected[points] = ok
+        self.corrected += int(np.count_nonzero(corrected))
+        self.uncorrected += int(np.count_nonzero(~corrected))
+        return result
+
+
+
+    def weighStations(self, stations, utcTimes, lats, lons):
+        # Inverse-distance weighing over the given stations, with a station-by-point matrix of weights
+        # and one of station water levels. Returns the levels in m and where they could be corrected.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.array([station.getStationDistances(lats, lons) for station in stations])
+            weights = 1 / distances
+            waterLevels = np.array([station.getStationWaterLevels(utcTimes) for station in stations])
+            valid = ~np.isnan(waterLevels)
+            if (self.maxRadius):
+                valid &= distances <= self.maxRadius
+            # Summed station by station, in the same order as getWeighedWaterLevel
+            m = np.where(valid, waterLevels * weights, 0).sum(axis=0)
+            n = np.where(valid, weights, 0).sum(axis=0)
+            level = m / n / 100
+        # As in getWeighedWaterLevel: 0 where no station has data, or on top of a station
+        ok = (n != 0) & np.isfinite(level)
+        return np.where(ok, level, 0), ok
+
+
+
+    def lastTime(self):
+        # UTC epoch time of the last water level of any station, or None without tidal data
+        times = [int(station.times[-1]) for station in self.stations.values() if (len(station.times) > 0)]
+        return max(times) if (times) else None
+
+
+
     def printStatistics(self):
-        print ("{}% of waypoints corrected with tidal data".format(100* self.corrected/(self.uncorrected+self.corrected)) )
+        if (self.uncorrected + self.corrected > 0):
+            print ("{}% of waypoints corrected with tidal data".format(100* self.corrected/(self.uncorrected+self.corrected)) )
         self.corrected = 0
         self.uncorrected = 0
     
@@ -179,7 +649,7 @@ class TidalData(object):
 if __name__ == '__main__':
     tidalData = TidalData()
     tidalData.readStations()
-    t = '2022-02-26T11:20:00'
+    t = calendar.timegm(datetime(2022, 2, 26, 11, 20).timetuple())
     print ("Kornwerd", tidalData.stations['Kornwerd'].getStationWaterLevel(t))
     print ("Harlingen", tidalData.stations['Harlingen'].getStationWaterLevel(t))
     print ("Average:", tidalData.getAverageWaterLevel(t))